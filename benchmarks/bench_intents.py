@@ -0,0 +1,131 @@
+"""
+Benchmark del clasificador de intenciones: precisión sobre un conjunto etiquetado
+y throughput (mensajes por segundo)
+
+Uso:
+    python benchmarks/bench_intents.py
+    python benchmarks/bench_intents.py --iterations 200000 --verbose
+"""
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.intents import classifier
+
+LABELLED = [
+    ("¿Cuántas facturas tenemos?", "count_invoices"),
+    ("¿Cuántas facturas tenemos en total?", "count_invoices"),
+    ("Dame el total de ventas", "count_invoices"),
+    ("cuantas ventas hubo hoy", "count_invoices"),
+    ("número de facturas registradas", "count_invoices"),
+    ("¿Cuántos clientes únicos hay?", "count_customers"),
+    ("cuantos clientes tenemos", "count_customers"),
+    ("total clientes", "count_customers"),
+    ("Muéstrame las últimas 10 ventas", "recent_sales"),
+    ("últimas facturas", "recent_sales"),
+    ("Lista los últimos 5 clientes", "recent_sales"),
+    ("ventas recientes", "recent_sales"),
+    ("Dame las últimas 3 ventas por favor", "recent_sales"),
+    ("¿Quién es el cliente con más ventas?", "top_customers"),
+    ("top 10 clientes", "top_customers"),
+    ("mejores clientes", "top_customers"),
+    ("ranking de clientes", "top_customers"),
+    ("top cinco compradores", "top_customers"),
+    ("Dame una lista de los mejores clientes", "top_customers"),
+    ("top clientes de 2024", "top_customers"),
+    ("Busca facturas que contengan \"producto X\"", "search"),
+    ("busca ventas de laptop", "search"),
+    ("Encuentra ventas del usuario @juan", "search"),
+    ("buscar garantía", "search"),
+    ("Ventas del último mes", "sales_by_date"),
+    ("Muéstrame ventas de esta semana", "sales_by_date"),
+    ("ventas de ayer", "sales_by_date"),
+    ("facturas del mes pasado", "sales_by_date"),
+    ("ventas en octubre", "sales_by_date"),
+    ("ventas de marzo 2024", "sales_by_date"),
+    ("facturas de marzo", "sales_by_date"),
+    ("ventas de 2023", "sales_by_date"),
+    ("Dame estadísticas del mes", "stats"),
+    ("resumen de ventas", "stats"),
+    ("estadísticas de la empresa", "stats"),
+    ("¿Cuál es el promedio de ventas por día?", "data_query"),
+    ("compara las ventas de enero y febrero", "data_query"),
+    ("¿cuál fue el mes con más ventas?", "data_query"),
+    ("hola", "chat"),
+    ("hola, ¿cómo estás?", "chat"),
+    ("dame un consejo para vender más", "chat"),
+    ("gracias!", "chat"),
+    ("¿qué productos ofrecen?", "chat"),
+    ("dame una idea", "chat"),
+    ("cuéntame un chiste", "chat"),
+    ("¿cuál es su horario de atención?", "chat"),
+    ("muestra interés en el cliente", "chat"),
+]
+
+
+# Parámetros esperados: (pregunta, límite, año del rango de fechas o None)
+SLOTS = [
+    ("Dame una lista de los mejores clientes", None, None),
+    ("top clientes de 2024", None, 2024),
+    ("top 10 clientes de 2024", 10, 2024),
+    ("top cinco compradores", 5, None),
+    ("Muéstrame las últimas 10 ventas", 10, None),
+    ("ventas de marzo 2024", None, 2024),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del clasificador de intenciones")
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    
+    # Precisión
+    correct = 0
+    errors = Counter()
+    for question, expected in LABELLED:
+        intent = classifier.classify(question)
+        if intent.name == expected:
+            correct += 1
+        else:
+            errors[(expected, intent.name)] += 1
+            if args.verbose:
+                print(f"  ✗ {question!r}: esperado {expected}, obtenido {intent.name}")
+    
+    accuracy = correct / len(LABELLED)
+    print(f"🎯 Precisión: {correct}/{len(LABELLED)} ({accuracy:.1%})")
+    for (expected, got), count in errors.most_common():
+        print(f"   {expected} → {got}: {count}")
+    
+    # Parámetros extraídos (límite y año del rango de fechas)
+    slots_ok = 0
+    for question, limit, year in SLOTS:
+        intent = classifier.classify(question)
+        got_year = intent.date_range[0].year if intent.date_range else None
+        if intent.limit == limit and got_year == year:
+            slots_ok += 1
+        elif args.verbose:
+            print(f"  ✗ {question!r}: esperado límite={limit} año={year}, obtenido límite={intent.limit} año={got_year}")
+    print(f"🧩 Parámetros: {slots_ok}/{len(SLOTS)}")
+    
+    # Precisión binaria datos/conversación (la decisión que controla el costo)
+    binary = sum(
+        1 for question, expected in LABELLED
+        if classifier.classify(question).is_data == (expected != "chat")
+    )
+    print(f"🔀 Datos vs conversación: {binary}/{len(LABELLED)} ({binary / len(LABELLED):.1%})")
+    
+    # Throughput
+    questions = [question for question, _ in LABELLED]
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        classifier.classify(questions[i % len(questions)])
+    elapsed = time.perf_counter() - start
+    print(f"⚡ Throughput: {args.iterations / elapsed:,.0f} mensajes/s ({elapsed / args.iterations * 1e6:.1f} µs/mensaje)")
+
+
+if __name__ == "__main__":
+    main()
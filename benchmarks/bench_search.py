@@ -0,0 +1,137 @@
+"""
+Benchmark de búsqueda: ILIKE '%term%' vs índices tsvector/pg_trgm
+
+Crea un esquema aislado (bench_search) con una tabla invoices sintética de N filas
+en la base de datos de STR_DB, y mide las tres búsquedas de NeonDatabase en
+ambos modos.
+
+Uso:
+    python benchmarks/bench_search.py --rows 500000 --repeat 20
+    python benchmarks/bench_search.py --keep   # reutiliza la tabla ya creada
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.neon import NeonDatabase
+from database.search import SearchEngine
+
+load_dotenv()
+
+SCHEMA = "bench_search"
+
+WORDS = [
+    'laptop', 'monitor', 'teclado', 'mouse', 'impresora', 'garantía', 'envío',
+    'factura', 'descuento', 'premium', 'licencia', 'soporte', 'devolución',
+    'pedido', 'pago', 'tarjeta', 'transferencia', 'cliente', 'producto', 'precio',
+]
+
+KEYWORDS = ['laptop', 'garantía', 'devolución', 'premium', 'FAC-0012']
+QUESTIONS = ['¿cuál es la garantía del monitor?', 'quiero una devolución del pedido']
+
+
+async def seed(conn, rows: int):
+    """Crea y llena la tabla invoices sintética"""
+    print(f"🌱 Generando {rows} filas sintéticas en {SCHEMA}.invoices...")
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f'''
+        CREATE TABLE {SCHEMA}.invoices (
+            id SERIAL PRIMARY KEY,
+            invoice_number VARCHAR(255),
+            user_id BIGINT,
+            username VARCHAR(255),
+            chat_id BIGINT,
+            message_text TEXT,
+            gpt_response TEXT,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    ''')
+    await conn.execute(f'''
+        INSERT INTO {SCHEMA}.invoices
+            (invoice_number, user_id, username, chat_id, message_text, gpt_response, created_at)
+        SELECT
+            'FAC-' || lpad(g::text, 8, '0'),
+            (g % 5000),
+            'user_' || (g % 5000),
+            (g % 5000),
+            'pregunta sobre ' || w[1 + (g % array_length(w, 1))] || ' y ' || w[1 + ((g / 7) % array_length(w, 1))],
+            'respuesta acerca de ' || w[1 + ((g / 3) % array_length(w, 1))],
+            NOW() - (g || ' minutes')::interval
+        FROM generate_series(1, $1) g, (SELECT $2::text[] AS w) words
+    ''', rows, WORDS)
+    await conn.execute(f"ANALYZE {SCHEMA}.invoices")
+
+
+async def measure(label: str, func, repeat: int):
+    """Ejecuta func repeat veces y muestra p50/p95"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"  {label:<45} p50={statistics.median(timings):8.2f}ms  p95={p95:8.2f}ms")
+    return statistics.median(timings)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de búsqueda ILIKE vs índices")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="No regenerar la tabla sintética")
+    args = parser.parse_args()
+    
+    pool = await asyncpg.create_pool(
+        os.environ.get("STR_DB"),
+        min_size=1,
+        max_size=4,
+        server_settings={'search_path': f'{SCHEMA}, public'},
+    )
+    
+    if not args.keep:
+        async with pool.acquire() as conn:
+            await seed(conn, args.rows)
+    
+    db = NeonDatabase()
+    db.pool = pool
+    db.search = SearchEngine(pool)
+    
+    start = time.perf_counter()
+    await db.search.bootstrap()
+    print(f"🔧 Migración de índices: {time.perf_counter() - start:.2f}s")
+    if not db.search.enabled:
+        print("❌ No se pudieron crear los índices, abortando")
+        return
+    
+    cases = []
+    for keyword in KEYWORDS:
+        cases.append((f"search_all_sales_by_keyword('{keyword}')", lambda k=keyword: db.search_all_sales_by_keyword(k, 10)))
+        cases.append((f"search_sales_by_keyword(user_42, '{keyword}')", lambda k=keyword: db.search_sales_by_keyword('user_42', k, 10)))
+    for question in QUESTIONS:
+        cases.append((f"search_similar_questions('{question[:20]}...')", lambda q=question: db.search_similar_questions(q, 5)))
+    
+    results = {}
+    for mode, enabled in (("ILIKE", False), ("Índices", True)):
+        db.search.enabled = enabled
+        print(f"\n📊 Modo {mode}")
+        for label, func in cases:
+            results.setdefault(label, {})[mode] = await measure(label, func, args.repeat)
+    
+    print("\n⚡ Aceleración (p50 ILIKE / p50 índices)")
+    for label, modes in results.items():
+        print(f"  {label:<45} x{modes['ILIKE'] / max(modes['Índices'], 1e-6):.1f}")
+    
+    await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
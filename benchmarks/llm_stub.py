@@ -0,0 +1,346 @@
+"""
+Servidor LLM local compatible con la API de chat completions de OpenAI
+
+Sustituye a Groq en pruebas de carga y ejecuciones sin red: responde a
+POST /v1/chat/completions (con y sin stream) con latencia y tasa de errores
+configurables, de forma determinista (--seed).
+
+Respuestas, en orden de prioridad:
+    1. Grabadas (--replay): respuestas reales guardadas con --record
+    2. Guion (--script): reglas JSON por expresión regular
+    3. Por defecto: respuestas ReAct para el SQL Agent y texto fijo para el chat
+
+Formato del guion:
+    {
+        "rules": [
+            {"match": "promedio", "sql": "SELECT AVG(...) FROM invoices",
+             "answer": "El promedio es {observation}"},
+            {"match": "hola", "content": "¡Hola! ¿En qué puedo ayudarte?"}
+        ],
+        "default": "Respuesta simulada."
+    }
+
+Uso:
+    python benchmarks/llm_stub.py --port 8090 --latency 0.3 --jitter 0.1 --error-rate 0.01
+
+    LLM_BASE_URL=http://127.0.0.1:8090/v1 GROQ_API_KEY=stub python main.py
+
+    # Grabar respuestas reales de Groq para reproducirlas después sin red
+    python benchmarks/llm_stub.py --upstream https://api.groq.com/openai/v1 --record llm.jsonl
+    python benchmarks/llm_stub.py --replay llm.jsonl
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+
+import httpx
+from tornado import httpserver, web
+from tornado.netutil import bind_sockets
+
+# Pregunta y observaciones dentro del prompt ReAct (ZERO_SHOT_REACT_DESCRIPTION)
+QUESTION_RE = re.compile(r"Question:(.*?)(?:\nThought:|\Z)", re.S)
+# Línea con la pregunta original dentro del prompt que arma SalesAgent
+USER_QUESTION_RE = re.compile(r"Pregunta del usuario:\s*(.+)")
+OBSERVATION_RE = re.compile(r"Observation:\s*(.*?)(?:\nThought:|\Z)", re.S)
+
+DEFAULT_SQL = "SELECT COUNT(*) AS total FROM invoices"
+DEFAULT_ANSWER = "Según la base de datos, el resultado es: {observation}"
+DEFAULT_CONTENT = (
+    "Esta es una respuesta simulada del servidor LLM local. "
+    "Puedo ayudarte con consultas de ventas, clientes y facturación."
+)
+
+
+def _request_key(messages: list) -> str:
+    """Clave de una petición grabada: el último mensaje (incluye el scratchpad del agente)"""
+    last = messages[-1].get('content', '') if messages else ''
+    return hashlib.sha256(str(last).encode()).hexdigest()
+
+
+def _extract_question(prompt: str) -> str:
+    """
+    Pregunta del último bloque Question: del prompt ReAct; la entrada del agente
+    puede ocupar varias líneas (SalesAgent antepone instrucciones a la pregunta)
+    """
+    questions = QUESTION_RE.findall(prompt)
+    question = questions[-1] if questions else ''
+    user_question = USER_QUESTION_RE.search(question)
+    return user_question.group(1).strip() if user_question else question.strip()
+
+
+def _apply_stop(text: str, stop) -> str:
+    """Corta el texto en la primera secuencia de parada, como haría el modelo"""
+    if isinstance(stop, str):
+        stop = [stop]
+    for sequence in stop or []:
+        index = text.find(sequence)
+        if index != -1:
+            text = text[:index]
+    return text
+
+
+class StubLLM:
+    """
+    Genera las respuestas y simula latencia y errores del proveedor
+    """
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, token_delay: float = 0.01,
+                 error_rate: float = 0.0, error_status: int = 500, script: dict = None,
+                 replay: dict = None, upstream: str = None, record: str = None, seed: int = 42):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rules = [
+            dict(rule, pattern=re.compile(rule['match'], re.I))
+            for rule in (script or {}).get('rules', [])
+        ]
+        self.default_content = (script or {}).get('default', DEFAULT_CONTENT)
+        self.replay = replay or {}
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.record = record
+        self._random = random.Random(seed)
+        self._http = None
+        self.stats = {'requests': 0, 'streams': 0, 'errors': 0, 'replayed': 0, 'agent_steps': 0}
+
+    def delay(self) -> float:
+        """Latencia hasta el primer byte de esta petición"""
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _match_rule(self, text: str):
+        for rule in self.rules:
+            if rule['pattern'].search(text):
+                return rule
+        return None
+
+    def _react(self, prompt: str) -> str:
+        """
+        Paso del agente ReAct: primero ejecuta una consulta SQL y, con la
+        observación en el scratchpad, entrega la respuesta final
+        """
+        self.stats['agent_steps'] += 1
+        rule = self._match_rule(_extract_question(prompt)) or {}
+        observations = OBSERVATION_RE.findall(prompt.split("Question:")[-1])
+
+        if not observations:
+            sql = rule.get('sql', DEFAULT_SQL)
+            return (
+                "Voy a consultar la tabla invoices.\n"
+                "Action: sql_db_query\n"
+                f"Action Input: {sql}"
+            )
+        observation = observations[-1].strip()
+        answer = rule.get('answer', DEFAULT_ANSWER).format(observation=observation)
+        return f"Ya tengo la respuesta.\nFinal Answer: {answer}"
+
+    async def _from_upstream(self, payload: dict, authorization: str) -> str:
+        """Pide la respuesta al proveedor real y la graba para reproducirla después"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=60)
+        body = dict(payload, stream=False)
+        response = await self._http.post(
+            f"{self.upstream}/chat/completions",
+            json=body,
+            headers={'Authorization': authorization or ''},
+        )
+        response.raise_for_status()
+        content = response.json()['choices'][0]['message']['content'] or ''
+        key = _request_key(payload.get('messages', []))
+        self.replay[key] = content
+        if self.record:
+            with open(self.record, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'content': content}, ensure_ascii=False) + "\n")
+        return content
+
+    async def complete(self, payload: dict, authorization: str = None) -> str:
+        """Texto de la respuesta para una petición de chat completions"""
+        messages = payload.get('messages', [])
+        key = _request_key(messages)
+        if key in self.replay:
+            self.stats['replayed'] += 1
+            content = self.replay[key]
+        elif self.upstream:
+            content = await self._from_upstream(payload, authorization)
+        else:
+            prompt = "\n".join(str(m.get('content', '')) for m in messages)
+            if "Action Input" in prompt and "Question:" in prompt:
+                content = self._react(prompt)
+            else:
+                last = str(messages[-1].get('content', '')) if messages else ''
+                rule = self._match_rule(last)
+                content = rule.get('content', self.default_content) if rule else self.default_content
+        return _apply_stop(content, payload.get('stop'))
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+
+    def application(self):
+        stub = self
+
+        class CompletionsHandler(web.RequestHandler):
+            async def post(self):
+                payload = json.loads(self.request.body or b'{}')
+                stub.stats['requests'] += 1
+                await asyncio.sleep(stub.delay())
+
+                if stub.should_fail():
+                    stub.stats['errors'] += 1
+                    self.set_status(stub.error_status)
+                    if stub.error_status == 429:
+                        self.set_header('Retry-After', '1')
+                    self.write({'error': {'message': 'Error simulado', 'type': 'server_error'}})
+                    return
+
+                content = await stub.complete(payload, self.request.headers.get('Authorization'))
+                model = payload.get('model', 'stub')
+                completion_id = f"chatcmpl-{stub.stats['requests']}"
+                created = int(time.time())
+
+                if not payload.get('stream'):
+                    prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in payload.get('messages', []))
+                    completion_tokens = len(content.split())
+                    self.write({
+                        'id': completion_id,
+                        'object': 'chat.completion',
+                        'created': created,
+                        'model': model,
+                        'choices': [{
+                            'index': 0,
+                            'message': {'role': 'assistant', 'content': content},
+                            'finish_reason': 'stop',
+                        }],
+                        'usage': {
+                            'prompt_tokens': prompt_tokens,
+                            'completion_tokens': completion_tokens,
+                            'total_tokens': prompt_tokens + completion_tokens,
+                        },
+                    })
+                    return
+
+                # Server-sent events: un chunk por palabra y [DONE] al final
+                stub.stats['streams'] += 1
+                self.set_header('Content-Type', 'text/event-stream')
+                self.set_header('Cache-Control', 'no-cache')
+
+                def chunk(delta: dict, finish_reason=None) -> str:
+                    return "data: " + json.dumps({
+                        'id': completion_id,
+                        'object': 'chat.completion.chunk',
+                        'created': created,
+                        'model': model,
+                        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                    }, ensure_ascii=False) + "\n\n"
+
+                self.write(chunk({'role': 'assistant', 'content': ''}))
+                await self.flush()
+                for word in re.findall(r"\S+\s*", content):
+                    await asyncio.sleep(stub.token_delay)
+                    self.write(chunk({'content': word}))
+                    await self.flush()
+                self.write(chunk({}, 'stop'))
+                self.write("data: [DONE]\n\n")
+
+        class ModelsHandler(web.RequestHandler):
+            def get(self):
+                self.write({'object': 'list', 'data': [{'id': 'stub', 'object': 'model', 'owned_by': 'local'}]})
+
+        class StatsHandler(web.RequestHandler):
+            def get(self):
+                self.write(stub.stats)
+
+        # Cualquier prefijo (/v1, /openai/v1) para poder apuntar LLM_BASE_URL a la misma ruta que Groq
+        return web.Application([
+            (r".*/chat/completions", CompletionsHandler),
+            (r".*/models", ModelsHandler),
+            (r"/stats", StatsHandler),
+        ])
+
+
+def load_script(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_recordings(path: str) -> dict:
+    """Respuestas grabadas con --record (una línea JSON por petición)"""
+    recordings = {}
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    recordings[entry['key']] = entry['content']
+    return recordings
+
+
+def start_server(stub: StubLLM, port: int = 0, host: str = "127.0.0.1"):
+    """
+    Inicia el servidor en el event loop actual
+
+    Returns:
+        (servidor, URL base para LLM_BASE_URL)
+    """
+    server = httpserver.HTTPServer(stub.application())
+    sockets = bind_sockets(port, host)
+    server.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+    return server, f"http://{host}:{port}/v1"
+
+
+async def main(args):
+    stub = StubLLM(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        script=load_script(args.script) if args.script else None,
+        replay=load_recordings(args.replay),
+        upstream=args.upstream,
+        record=args.record,
+        seed=args.seed,
+    )
+    server, base_url = start_server(stub, args.port, args.host)
+    print(f"🤖 LLM simulado en {base_url} (LLM_BASE_URL={base_url})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        await stub.close()
+        print(f"📊 {stub.stats}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos hasta el primer byte")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variación uniforme ± de la latencia")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Segundos entre chunks del stream")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que fallan")
+    parser.add_argument("--error-status", type=int, default=500, help="Código HTTP de los errores (500, 429, 503)")
+    parser.add_argument("--script", help="Reglas de respuesta en JSON")
+    parser.add_argument("--replay", help="Respuestas grabadas (JSONL)")
+    parser.add_argument("--upstream", help="Proveedor real al que reenviar las peticiones sin grabación")
+    parser.add_argument("--record", help="Archivo JSONL donde grabar las respuestas del proveedor real")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,221 @@
+"""
+Harness local del modo webhook: publica updates sintéticos en el webhook del bot
+y mide throughput y latencias sin pasar por Telegram
+
+Levanta una Bot API simulada (getMe, setWebhook, sendMessage, ...) y registra cada
+respuesta que el bot envía, para medir también la latencia de extremo a extremo.
+
+Uso:
+    # 1. Iniciar la API simulada y, en otra terminal, el bot apuntando a ella
+    python benchmarks/webhook_harness.py --updates 500 --concurrency 50
+
+    BOT_MODE=webhook WEBHOOK_PORT=8443 WEBHOOK_SECRET=harness-secret \\
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot python main.py
+
+    # 2. El harness espera a que el bot registre el webhook y envía los updates
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from urllib.parse import parse_qs
+
+import httpx
+from tornado import httpserver, web
+
+MESSAGES = [
+    "¿Cuántas facturas tenemos?",
+    "¿Cuántos clientes únicos hay?",
+    "Muéstrame las últimas 5 ventas",
+    "top 10 clientes",
+    "Ventas del último mes",
+    "resumen de ventas",
+    "Hola, ¿cómo estás?",
+    "¿Qué productos venden?",
+]
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Harness', 'username': 'harness_bot'}
+
+
+class FakeBotAPI:
+    """
+    Bot API simulada: responde ok a todos los métodos y registra los mensajes enviados
+    """
+
+    def __init__(self):
+        self.webhook_registered = asyncio.Event()
+        self.webhook_url = None
+        self.calls = {}
+        self.replies = {}  # chat_id -> lista de instantes de respuesta
+        self._message_id = 0
+
+    def handle(self, method: str, params: dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.webhook_registered.set()
+            return True
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            if method == 'sendMessage':
+                self.replies.setdefault(chat_id, []).append(time.perf_counter())
+            self._message_id += 1
+            return {
+                'message_id': int(params.get('message_id', self._message_id)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        return True
+
+    def application(self):
+        api = self
+
+        class Handler(web.RequestHandler):
+            def post(self, token, method):
+                content_type = self.request.headers.get('Content-Type', '')
+                body = self.request.body.decode() if self.request.body else ''
+                if 'json' in content_type:
+                    params = json.loads(body or '{}')
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body).items()}
+                self.write({'ok': True, 'result': api.handle(method, params)})
+
+            get = post
+
+        return web.Application([(r"/bot([^/]+)/(\w+)", Handler)])
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Update sintético de un mensaje de texto privado"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Carga', 'username': f'carga_{chat_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def post_updates(url: str, secret: str, updates: int, users: int, concurrency: int):
+    """
+    Publica los updates con la concurrencia indicada
+
+    Returns:
+        (latencias de aceptación, instantes de envío por chat, errores, segundos totales)
+    """
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret}
+    semaphore = asyncio.Semaphore(concurrency)
+    accept_latencies = []
+    sent_at = {}
+    errors = 0
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        # El webhook debe rechazar updates sin el secreto correcto
+        rejected = await client.post(url, json=make_update(0, 1, "x"),
+                                     headers={'X-Telegram-Bot-Api-Secret-Token': 'incorrecto'})
+        print(f"🔐 Update con secreto incorrecto: HTTP {rejected.status_code}")
+
+        async def send(update_id: int):
+            nonlocal errors
+            chat_id = 1000 + update_id % users
+            update = make_update(update_id, chat_id, random.choice(MESSAGES))
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, json=update, headers=headers)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                accept_latencies.append(time.perf_counter() - start)
+                sent_at.setdefault(chat_id, []).append(start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(1, updates + 1)))
+        elapsed = time.perf_counter() - start
+
+    return accept_latencies, sent_at, errors, elapsed
+
+
+async def run(args):
+    api = FakeBotAPI()
+    server = httpserver.HTTPServer(api.application())
+    server.listen(args.api_port, address='127.0.0.1')
+    print(f"🧪 Bot API simulada en http://127.0.0.1:{args.api_port}/bot")
+
+    if args.url:
+        url = args.url
+    else:
+        print("⏳ Esperando a que el bot registre el webhook...")
+        await api.webhook_registered.wait()
+        url = api.webhook_url
+    print(f"🌐 Webhook: {url}")
+
+    accept, sent_at, errors, elapsed = await post_updates(
+        url, args.secret, args.updates, args.users, args.concurrency
+    )
+
+    # Dar tiempo al bot para terminar de responder
+    deadline = time.perf_counter() + args.drain
+    while time.perf_counter() < deadline:
+        if sum(len(v) for v in api.replies.values()) >= len(accept):
+            break
+        await asyncio.sleep(0.1)
+
+    # Latencia de extremo a extremo: envío del update -> primer sendMessage posterior del mismo chat
+    e2e = []
+    for chat_id, sends in sent_at.items():
+        replies = sorted(api.replies.get(chat_id, []))
+        for sent, reply in zip(sorted(sends), replies):
+            if reply >= sent:
+                e2e.append(reply - sent)
+
+    server.stop()
+
+    print()
+    print(f"📨 Updates enviados: {len(accept)} (errores: {errors}) en {elapsed:.2f}s")
+    print(f"🚀 Throughput de aceptación: {len(accept) / elapsed:.1f} updates/s")
+    print(f"⏱️ Aceptación p50 {percentile(accept, 50) * 1000:.1f}ms | "
+          f"p95 {percentile(accept, 95) * 1000:.1f}ms | p99 {percentile(accept, 99) * 1000:.1f}ms")
+    if e2e:
+        print(f"💬 Respuestas recibidas: {len(e2e)}")
+        print(f"⏱️ Extremo a extremo p50 {percentile(e2e, 50):.2f}s | "
+              f"p95 {percentile(e2e, 95):.2f}s | media {statistics.mean(e2e):.2f}s")
+    print(f"📞 Llamadas a la Bot API: {api.calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="URL del webhook (por defecto, la que registre el bot)")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", "harness-secret"))
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--drain", type=float, default=30.0,
+                        help="Segundos máximos de espera por las respuestas del bot")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Almacén acotado del historial de conversación por usuario
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _message_size(message: dict) -> int:
+    """Tamaño aproximado en bytes de un mensaje del historial"""
+    return sys.getsizeof(message.get('content', '')) + 64
+
+
+class ConversationStore:
+    """
+    Historial de conversación con límites de memoria:
+    
+    - Máximo de mensajes por usuario (se conservan los más recientes)
+    - Expulsión LRU global por número de usuarios y por presupuesto de memoria
+    - Expiración por inactividad (TTL)
+    - Escritura opcional en la tabla bot_conversations, con carga diferida
+      del historial de usuarios que no están en memoria
+    - Backend de estado compartido opcional (src/state.py) para que otro proceso
+      worker pueda retomar la conversación
+    """
+    
+    def __init__(self, database=None, max_messages: int = None, max_users: int = None,
+                 ttl: float = None, memory_budget: int = None, persist: bool = None,
+                 backend=None):
+        self.database = database
+        self.backend = backend
+        self.max_messages = max_messages or int(os.getenv("HISTORY_MAX_MESSAGES", "20"))
+        self.max_users = max_users or int(os.getenv("HISTORY_MAX_USERS", "5000"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("HISTORY_TTL", "3600"))
+        self.memory_budget = memory_budget or int(os.getenv("HISTORY_MEMORY_BUDGET", str(32 * 1024 * 1024)))
+        if persist is None:
+            persist = os.getenv("HISTORY_PERSIST", "false").lower() in ("1", "true", "yes")
+        self.persist = persist and database is not None
+        
+        # user_id -> (mensajes, tamaño en bytes, último acceso)
+        self._entries = OrderedDict()
+        self._memory_used = 0
+        self._lock = asyncio.Lock()
+        self.evictions = 0
+        self.hydrations = 0
+    
+    async def get(self, user_id: int) -> list:
+        """
+        Devuelve una copia del historial del usuario (cargándolo de la BD si hace falta)
+        """
+        async with self._lock:
+            entry = self._touch(user_id)
+            if entry is not None:
+                return list(entry[0])
+        
+        messages = await self._hydrate(user_id)
+        async with self._lock:
+            # Otro mensaje pudo haber creado la entrada mientras se consultaba la BD
+            entry = self._touch(user_id)
+            if entry is None:
+                self._store(user_id, messages)
+                return list(messages)
+            return list(entry[0])
+    
+    async def add_exchange(self, user_id: int, user_message: str, assistant_message: str):
+        """
+        Agrega un par pregunta/respuesta al historial del usuario
+        """
+        new_messages = [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": assistant_message},
+        ]
+        
+        async with self._lock:
+            entry = self._touch(user_id)
+            messages = list(entry[0]) if entry is not None else []
+            messages.extend(new_messages)
+            messages = messages[-self.max_messages:]
+            self._store(user_id, messages)
+        
+        if self.backend is not None:
+            try:
+                await self.backend.set('history', str(user_id), messages, ttl=self.ttl or None)
+            except Exception as e:
+                logger.warning("⚠️ No se pudo compartir el historial de %s: %s", user_id, e)
+        
+        if self.persist:
+            try:
+                for message in new_messages:
+                    await self.database.add_bot_conversation_message(user_id, message['role'], message['content'])
+            except Exception as e:
+                logger.warning("⚠️ No se pudo guardar el historial de %s: %s", user_id, e)
+    
+    async def clear(self, user_id: int):
+        """
+        Limpia el historial del usuario (en memoria y, si aplica, en la BD)
+        """
+        async with self._lock:
+            self._store(user_id, [])
+        
+        if self.backend is not None:
+            try:
+                await self.backend.delete('history', str(user_id))
+            except Exception as e:
+                logger.warning("⚠️ No se pudo limpiar el historial compartido de %s: %s", user_id, e)
+        
+        if self.persist:
+            try:
+                await self.database.clear_bot_conversation_history(user_id)
+            except Exception as e:
+                logger.warning("⚠️ No se pudo limpiar el historial de %s en la BD: %s", user_id, e)
+    
+    def stats(self) -> dict:
+        """
+        Estado del almacén (usuarios en memoria, bytes usados, expulsiones)
+        """
+        return {
+            'users': len(self._entries),
+            'memory_used': self._memory_used,
+            'memory_budget': self.memory_budget,
+            'evictions': self.evictions,
+            'hydrations': self.hydrations,
+        }
+    
+    def _touch(self, user_id: int):
+        """
+        Devuelve la entrada del usuario marcándola como usada, o None si no existe o expiró
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        
+        messages, size, last_access = entry
+        now = time.monotonic()
+        if self.ttl and (now - last_access) > self.ttl:
+            self._remove(user_id)
+            return None
+        
+        self._entries[user_id] = (messages, size, now)
+        self._entries.move_to_end(user_id)
+        return self._entries[user_id]
+    
+    def _store(self, user_id: int, messages: list):
+        """
+        Guarda la entrada del usuario y expulsa los menos usados si se exceden los límites
+        """
+        self._remove(user_id)
+        size = sum(_message_size(m) for m in messages)
+        self._entries[user_id] = (messages, size, time.monotonic())
+        self._memory_used += size
+        
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_users or self._memory_used > self.memory_budget
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+    
+    def _remove(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._memory_used -= entry[1]
+    
+    async def _hydrate(self, user_id: int) -> list:
+        """
+        Carga el historial reciente del backend compartido o de la BD para usuarios
+        que no están en memoria
+        """
+        if self.backend is not None:
+            try:
+                messages = await self.backend.get('history', str(user_id))
+                if messages is not None:
+                    self.hydrations += 1
+                    return messages
+            except Exception as e:
+                logger.warning("⚠️ No se pudo leer el historial compartido de %s: %s", user_id, e)
+        
+        if not self.persist:
+            return []
+        try:
+            messages = await self.database.get_bot_conversation_history(user_id, limit=self.max_messages)
+            self.hydrations += 1
+            return messages
+        except Exception as e:
+            logger.warning("⚠️ No se pudo cargar el historial de %s: %s", user_id, e)
+            return []
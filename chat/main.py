@@ -1,4 +1,5 @@
 import os
+import asyncio
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
@@ -7,31 +8,40 @@ import logging
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from servicio.openai import groq_service
+from src.startup import StartupTimer
+from servicio.openai import get_groq_service
+from servicio.streaming import reply_streaming, streaming_enabled
+from servicio.webhook import application_builder, webhook_enabled, webhook_options
 from database.neon import db
+from chat.history import ConversationStore
+from src.state import create_state_backend
+from src.metrics import start_metrics_server, register_pool_gauges, register_scheduler_gauges
+from src.tracing import trace_update, span
+from src.logs import setup_logging, content, SAMPLED
+from src.intents import classifier, INTENT_RECENT_SALES, INTENT_TOP_CUSTOMERS, INTENT_SEARCH
+from src.scheduler import FairScheduler, RateLimitExceeded, PRIORITY_DIRECT, PRIORITY_CHAT
 
 load_dotenv()
 TOKEN = os.getenv('TOKEN_TELEGRAM')
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# Logging asíncrono compartido (src/logs.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Diccionario para almacenar el historial de conversación de cada usuario
-user_conversations = {}
+# Historial de conversación de cada usuario (acotado, con expulsión LRU/TTL)
+# (compartido entre workers si STATE_BACKEND está definido)
+conversation_store = ConversationStore(database=db, backend=create_state_backend(db))
+
+# Cola justa por usuario con límite de mensajes (las consultas de ventas pasan antes que el LLM)
+scheduler = FairScheduler()
+
+startup = StartupTimer('chat')
 
 # Comando /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username or f"user_{user_id}"
-    user_conversations[user_id] = []
+    await conversation_store.clear(user_id)
     await update.message.reply_text(
         f'¡Hola @{username}! Soy un bot de chat con IA. '
         'Puedes hacerme cualquier pregunta y conversaremos.\n\n'
@@ -58,98 +68,38 @@ async def detect_and_handle_sales_query(user_message: str, username: str):
     Detecta si el mensaje es sobre ventas y retorna información relevante de TODA la empresa
     Returns: (is_sales_query: bool, sales_data: dict)
     """
-    message_lower = user_message.lower()
+    # Clasificador de intenciones compartido con el bot principal
+    intent = classifier.classify(user_message)
     
-    # Patrones específicos que realmente indican consulta de ventas
-    sales_patterns = [
-        # Estadísticas de ventas
-        ('venta', 'tenemos'),
-        ('venta', 'hay'),
-        ('venta', 'total'),
-        ('venta', 'cuánta'),
-        ('venta', 'cuanta'),
-        ('factura', 'tenemos'),
-        ('factura', 'total'),
-        ('factura', 'cuánta'),
-        ('estadística', 'venta'),
-        ('estadística', 'empresa'),
-        ('resumen', 'venta'),
-        
-        # Ventas recientes
-        ('última', 'venta'),
-        ('reciente', 'venta'),
-        ('última', 'factura'),
-        
-        # Top clientes
-        ('mejor', 'cliente'),
-        ('top', 'cliente'),
-        ('cliente', 'compra'),
-        
-        # Búsquedas
-        ('busca', 'venta'),
-        ('encuentra', 'venta'),
-        ('buscar', 'factura'),
-    ]
-    
-    # Verificar si el mensaje contiene algún patrón específico
-    is_sales_query = any(
-        word1 in message_lower and word2 in message_lower 
-        for word1, word2 in sales_patterns
-    )
+    if not intent.is_data:
+        return False, None
     
-    # También detectar frases muy específicas
-    specific_phrases = [
-        'cuántas ventas',
-        'cuantas ventas',
-        'total de ventas',
-        'estadísticas de ventas',
-        'últimas ventas',
-        'ventas recientes',
-        'mejores clientes',
-        'top clientes',
-        'busca ventas',
-        'buscar ventas'
-    ]
+    logger.info("✅ Consulta de ventas detectada (%s) en: %s", intent.name, content(user_message, 50), extra=SAMPLED)
+    is_sales_query = True
     
-    if not is_sales_query:
-        is_sales_query = any(phrase in message_lower for phrase in specific_phrases)
+    # Si pregunta por "últimas", "recientes" o similar
+    include_recent = intent.name == INTENT_RECENT_SALES
     
-    if not is_sales_query:
-        return False, None
+    # Si pregunta por clientes o mejores compradores
+    include_top_customers = intent.name == INTENT_TOP_CUSTOMERS
     
-    logger.info(f"✅ Patrón de ventas detectado en: {user_message[:50]}")
-    sales_data = {}
+    # Si menciona búsqueda o una palabra específica
+    keyword = intent.keyword if intent.name == INTENT_SEARCH else None
     
     try:
-        # SIEMPRE obtener estadísticas totales de la empresa
-        stats = await db.get_total_sales_stats()
-        sales_data['stats'] = stats
-        
-        # Si pregunta por "últimas", "recientes" o similar
-        if any(word in message_lower for word in ['última', 'ultimas', 'reciente', 'recientes', 'muestra']):
-            recent_sales = await db.get_recent_sales(limit=5)
-            sales_data['recent_sales'] = recent_sales
-        
-        # Si pregunta por clientes o mejores compradores
-        if any(word in message_lower for word in ['cliente', 'clientes', 'mejor', 'mejores', 'top']):
-            top_customers = await db.get_top_customers(limit=5)
-            sales_data['top_customers'] = top_customers
+        # SIEMPRE obtener estadísticas totales de la empresa, junto con las demás
+        # partes necesarias en una sola operación (consultas en paralelo)
+        # Modo aproximado opcional (APPROX_STATS): conteos en tiempo constante
+        sales_data = await db.get_sales_context(
+            include_recent=include_recent,
+            include_top_customers=include_top_customers,
+            keyword=keyword,
+            limit=5,
+            approximate=db.approx_stats,
+        )
         
-        # Si menciona búsqueda o una palabra específica
-        if any(word in message_lower for word in ['busca', 'buscar', 'encuentra', 'contiene', 'sobre', 'relacionado']):
-            # Palabras a ignorar en la búsqueda
-            ignore_words = ['venta', 'ventas', 'factura', 'facturas', 'busca', 'buscar', 'encuentra', 'sobre', 'de', 'la', 'el', 'los', 'las']
-            search_words = [word for word in user_message.split() if len(word) > 4 and word.lower() not in ignore_words]
-            if search_words:
-                keyword = search_words[0]
-                search_results = await db.search_all_sales_by_keyword(keyword, limit=5)
-                sales_data['search_results'] = search_results
-                sales_data['search_keyword'] = keyword
-            
     except Exception as e:
-        print(f"Error al obtener datos de ventas: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Error al obtener datos de ventas: %s", e, exc_info=True)
         return is_sales_query, None
     
     return is_sales_query, sales_data
@@ -164,11 +114,12 @@ def format_sales_response(sales_data: dict, username: str) -> str:
     if sales_data.get('stats'):
         stats = sales_data['stats']
         if stats.get('total_records', 0) > 0:
+            approx = " (aprox.)" if stats.get('approximate') else ""
             response_parts.append(
-                f"📊 Estadísticas de la empresa:\n\n"
-                f"💰 Total de registros: {stats['total_records']}\n"
-                f"🧾 Facturas únicas: {stats['total_invoices']}\n"
-                f"👥 Clientes totales: {stats['total_customers']}"
+                f"📊 Estadísticas de la empresa{approx}:\n\n"
+                f"💰 Total de registros: {'~' if approx else ''}{stats['total_records']}\n"
+                f"🧾 Facturas únicas: {'~' if approx else ''}{stats['total_invoices']}\n"
+                f"👥 Clientes totales: {'~' if approx else ''}{stats['total_customers']}"
             )
             
             if stats.get('first_sale'):
@@ -252,9 +203,7 @@ async def sales_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
                 f"❌ No se encontraron ventas para el usuario @{username}"
             )
     except Exception as e:
-        print(f"Error al obtener estadísticas de ventas: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Error al obtener estadísticas de ventas: %s", e, exc_info=True)
         await update.message.reply_text("❌ Error al consultar las ventas.")
 
 # Comando /misventas para ver ventas recientes
@@ -286,9 +235,7 @@ async def my_sales_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"❌ No se encontraron ventas para @{username}"
             )
     except Exception as e:
-        print(f"Error al obtener ventas: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Error al obtener ventas: %s", e, exc_info=True)
         await update.message.reply_text("❌ Error al consultar las ventas.")
 
 # Comando /buscar para buscar ventas por palabra clave
@@ -328,41 +275,52 @@ async def search_sales_command(update: Update, context: ContextTypes.DEFAULT_TYP
                 f"❌ No se encontraron ventas con la palabra '{keyword}'"
             )
     except Exception as e:
-        print(f"Error al buscar ventas: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Error al buscar ventas: %s", e, exc_info=True)
         await update.message.reply_text("❌ Error al buscar en las ventas.")
 
 # Comando /clear para limpiar el historial
 async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_conversations[user_id] = []
+    await conversation_store.clear(user_id)
     await update.message.reply_text('Historial de conversación limpiado. ¡Empecemos de nuevo!')
 
-# Manejador de mensajes de texto
+# Manejador de mensajes de texto (cada update abre una traza con id de correlación)
+@trace_update('update.message')
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     start_time = datetime.now()
     user_id = update.effective_user.id
     username = update.effective_user.username or f"user_{user_id}"
     user_message = update.message.text
     
-    logger.info(f"📥 Mensaje recibido de @{username} (ID: {user_id}): {user_message[:100]}")
-    
-    # Inicializar historial si no existe
-    if user_id not in user_conversations:
-        user_conversations[user_id] = []
-        logger.debug(f"🆕 Nuevo usuario: @{username}")
+    logger.info("📥 Mensaje recibido de @%s (ID: %s): %s", username, user_id, content(user_message), extra=SAMPLED)
     
     # Enviar indicador de "escribiendo..."
     await update.message.chat.send_action(action="typing")
     
+    # Las consultas de ventas se resuelven con la BD; el resto requiere una llamada al LLM
+    priority = PRIORITY_DIRECT if classifier.classify(user_message).is_data else PRIORITY_CHAT
+    try:
+        await scheduler.submit(
+            user_id,
+            lambda: respond(update, user_id, username, user_message, start_time),
+            priority=priority,
+        )
+    except RateLimitExceeded as e:
+        logger.warning("⛔ Límite de mensajes superado por @%s (ID: %s)", username, user_id)
+        await update.message.reply_text(
+            f'⏳ Estás enviando muchos mensajes. Intenta de nuevo en {e.retry_after:.0f} segundos.'
+        )
+
+# Procesamiento de un mensaje (se ejecuta desde la cola del planificador)
+async def respond(update: Update, user_id: int, username: str, user_message: str, start_time: datetime):
     try:
         # Primero detectar si es una consulta sobre ventas
-        logger.info(f"🔍 Detectando tipo de consulta...")
-        is_sales_query, sales_data = await detect_and_handle_sales_query(user_message, username)
+        logger.debug("🔍 Detectando tipo de consulta...")
+        with span('chat.sales_query'):
+            is_sales_query, sales_data = await detect_and_handle_sales_query(user_message, username)
         
         if is_sales_query and sales_data:
-            logger.info(f"💰 Consulta de ventas detectada")
+            logger.info("💰 Consulta de ventas detectada", extra=SAMPLED)
             # Si es una consulta de ventas, responder con los datos formateados
             sales_response = format_sales_response(sales_data, username)
             
@@ -371,60 +329,79 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(sales_response)
                 
                 # Guardar en historial
-                user_conversations[user_id].append({"role": "user", "content": user_message})
-                user_conversations[user_id].append({"role": "assistant", "content": sales_response})
+                await conversation_store.add_exchange(user_id, user_message, sales_response)
                 
                 elapsed_time = (datetime.now() - start_time).total_seconds()
-                logger.info(f"✅ Respuesta de ventas enviada en {elapsed_time:.2f}s")
+                logger.info("✅ Respuesta de ventas enviada en %.2fs", elapsed_time, extra=SAMPLED)
                 
                 return
         
         # Si no es sobre ventas, proceder con el flujo normal de IA
-        logger.info(f"🤖 Procesando con IA...")
+        logger.info("🤖 Procesando con IA...", extra=SAMPLED)
         # Buscar contexto de FAQs en la base de datos
-        faq_context = await db.get_faq_context(
-            username=username,
-            question=user_message
-        )
-        
-        # Obtener respuesta del servicio de Groq con contexto de FAQs
-        response = await groq_service.get_chat_response(
-            user_message, 
-            user_conversations[user_id],
-            faq_context=faq_context
-        )
-        
-        # Actualizar historial
-        user_conversations[user_id].append({"role": "user", "content": user_message})
-        user_conversations[user_id].append({"role": "assistant", "content": response})
+        # junto con el historial del usuario (se carga de la BD si no está en memoria)
+        with span('chat.context'):
+            faq_context, history = await asyncio.gather(
+                db.get_faq_context(username=username, question=user_message),
+                conversation_store.get(user_id),
+            )
         
-        # Limitar historial a las últimas 20 interacciones (10 pares)
-        if len(user_conversations[user_id]) > 20:
-            user_conversations[user_id] = user_conversations[user_id][-20:]
+        if streaming_enabled():
+            # Enviar la respuesta progresivamente a medida que llegan los tokens
+            response = await reply_streaming(
+                update.message,
+                get_groq_service().stream_chat_response(
+                    user_message,
+                    history,
+                    faq_context=faq_context
+                )
+            )
+        else:
+            # Obtener respuesta del servicio de Groq con contexto de FAQs
+            response = await get_groq_service().get_chat_response(
+                user_message, 
+                history,
+                faq_context=faq_context
+            )
+            
+            # Enviar respuesta
+            await update.message.reply_text(response)
         
-        # Enviar respuesta
-        await update.message.reply_text(response)
+        # Actualizar historial (el almacén conserva solo los últimos mensajes)
+        await conversation_store.add_exchange(user_id, user_message, response)
         
     except Exception as e:
-        print(f"Error al procesar mensaje: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Error al procesar mensaje: %s", e, exc_info=True)
         await update.message.reply_text(
             'Lo siento, ocurrió un error al procesar tu mensaje. '
             'Por favor, intenta de nuevo.'
         )
 
-def main():
-    # Crear aplicación
-    app = Application.builder().token(TOKEN).build()
+def build_application(token: str = TOKEN, updater: bool = True):
+    # Crear aplicación (updater=False en los workers de src/cluster.py)
+    app = application_builder(token, updater=updater).build()
     
-    # Inicializar base de datos al iniciar
+    # Inicializar base de datos al iniciar (el cliente de OpenAI se prepara en segundo plano)
     async def post_init(application: Application):
-        await db.initialize()
+        with startup.phase('base de datos'):
+            await db.initialize(build_indexes=False)
+        with startup.phase('métricas'):
+            register_pool_gauges(db)
+            register_scheduler_gauges(scheduler)
+            application.bot_data['metrics_server'] = await start_metrics_server()
+        startup.track('índices', db.start_index_build())
+        startup.track('cliente LLM', asyncio.ensure_future(get_groq_service().preload()))
+        startup.ready()
     
     # Cerrar base de datos al detener
     async def post_shutdown(application: Application):
+        if application.bot_data.get('metrics_server') is not None:
+            application.bot_data['metrics_server'].close()
+        await scheduler.close()
+        if conversation_store.backend is not None:
+            await conversation_store.backend.close()
         await db.close()
+        await get_groq_service().close()
     
     app.post_init = post_init
     app.post_shutdown = post_shutdown
@@ -434,12 +411,20 @@ def main():
     app.add_handler(CommandHandler('help', help_command))
     app.add_handler(CommandHandler('clear', clear_history))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return app
+
+def main():
+    app = build_application()
     
     print('🤖 Bot de chat con IA iniciado...')
     print(f'📊 Usando modelo: {os.getenv("MODEL_ID", "openai/gpt-oss-20b")}')
     print(f'💾 Base de datos: Conectada con tabla invoices')
     print(f'💡 Detección automática de consultas de ventas activada')
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if webhook_enabled():
+        print('🌐 Recibiendo updates por webhook')
+        app.run_webhook(allowed_updates=Update.ALL_TYPES, **webhook_options('chat'))
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Diagnóstico de planes de ejecución (EXPLAIN) de las consultas de NeonDatabase
+"""
+import copy
+import logging
+from datetime import date, timedelta
+
+from src.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Consultas que agregan toda la tabla: un Seq Scan es esperado
+FULL_SCAN_EXPECTED = {'get_all_sales_summary', 'get_total_sales_stats', 'get_top_customers'}
+
+
+class _ExplainConnection:
+    """
+    Conexión que, en lugar de ejecutar las consultas, obtiene su plan con EXPLAIN
+    """
+    
+    def __init__(self, conn, plans: list):
+        self._conn = conn
+        self._plans = plans
+    
+    async def _explain(self, query, *args):
+        rows = await self._conn.fetch(f"EXPLAIN {query}", *args)
+        self._plans.append("\n".join(row[0] for row in rows))
+    
+    async def fetch(self, query, *args, **kwargs):
+        await self._explain(query, *args)
+        return []
+    
+    async def fetchrow(self, query, *args, **kwargs):
+        await self._explain(query, *args)
+        return None
+    
+    async def fetchval(self, query, *args, **kwargs):
+        await self._explain(query, *args)
+        return None
+
+
+class _ExplainAcquire:
+    def __init__(self, pool, plans: list):
+        self._pool = pool
+        self._plans = plans
+        self._ctx = None
+    
+    async def __aenter__(self):
+        self._ctx = self._pool.acquire()
+        conn = await self._ctx.__aenter__()
+        return _ExplainConnection(conn, self._plans)
+    
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+
+class _ExplainPool:
+    def __init__(self, pool, plans: list):
+        self._pool = pool
+        self._plans = plans
+    
+    def acquire(self):
+        return _ExplainAcquire(self._pool, self._plans)
+
+
+def _sample_calls(username: str, keyword: str):
+    """
+    Métodos de NeonDatabase a diagnosticar con argumentos de ejemplo
+    """
+    today = date.today()
+    return [
+        ('search_invoices_by_username', (username, 10)),
+        ('search_similar_questions', (f"¿qué pasó con {keyword}?", 5)),
+        ('get_sales_count_by_username', (username,)),
+        ('get_sales_stats_by_username', (username,)),
+        ('get_recent_sales_by_username', (username, 10)),
+        ('search_sales_by_keyword', (username, keyword, 10)),
+        ('get_all_sales_summary', ()),
+        ('get_total_sales_stats', ()),
+        ('get_recent_sales', (10,)),
+        ('search_all_sales_by_keyword', (keyword, 10)),
+        ('get_sales_by_date_range', (today - timedelta(days=7), today, 50)),
+        ('get_top_customers', (10,)),
+        ('get_bot_conversation_history', (0, 20)),
+    ]
+
+
+async def explain_queries(db, username: str = "demo", keyword: str = "factura"):
+    """
+    Obtiene el plan de cada consulta de NeonDatabase sin ejecutarla
+    
+    Returns:
+        Lista de dicts con method, plans, seq_scan y expected_seq_scan
+    """
+    report = []
+    for method_name, args in _sample_calls(username, keyword):
+        plans = []
+        # Copia del objeto para no interferir con las consultas en curso
+        probe = copy.copy(db)
+        probe.pool = _ExplainPool(db.pool, plans)
+        # Sin coalescencia con las consultas reales en curso
+        probe._singleflight = SingleFlight()
+        if db.search is not None:
+            probe.search = copy.copy(db.search)
+            probe.search.pool = probe.pool
+        
+        error = None
+        try:
+            await getattr(probe, method_name)(*args)
+        except Exception as e:
+            error = str(e)
+        
+        seq_scan = any("Seq Scan on invoices" in plan for plan in plans)
+        report.append({
+            'method': method_name,
+            'plans': plans,
+            'seq_scan': seq_scan,
+            'expected_seq_scan': method_name in FULL_SCAN_EXPECTED,
+            'error': error,
+        })
+        if seq_scan and method_name not in FULL_SCAN_EXPECTED:
+            logger.warning("🐢 %s usa Seq Scan sobre invoices", method_name)
+    
+    return report
+
+
+def format_explain_report(report: list, verbose: bool = False) -> str:
+    """
+    Formatea el reporte de explain_queries como texto
+    """
+    lines = []
+    for item in report:
+        if item['error']:
+            status = f"⚠️ error: {item['error']}"
+        elif item['seq_scan'] and not item['expected_seq_scan']:
+            status = "🐢 Seq Scan"
+        elif item['seq_scan']:
+            status = "ℹ️ Seq Scan (esperado)"
+        else:
+            status = "✅ índice"
+        lines.append(f"{item['method']}: {status}")
+        if verbose:
+            for plan in item['plans']:
+                lines.append(plan)
+            lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,34 @@
+"""
+Creación de índices sin bloquear la tabla (CREATE INDEX CONCURRENTLY)
+
+Un CREATE INDEX CONCURRENTLY interrumpido (reinicio, timeout, conflicto) deja el
+índice marcado como inválido en pg_index.indisvalid: el planificador lo ignora,
+se sigue manteniendo en cada escritura y IF NOT EXISTS no lo vuelve a construir.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_VALID_QUERY = 'SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)'
+
+
+async def ensure_index(conn, name: str, statement: str) -> bool:
+    """
+    Crea el índice si no existe y reconstruye el que quedó inválido
+    
+    Args:
+        conn: Conexión asyncpg (fuera de una transacción)
+        name: Nombre del índice creado por statement
+        statement: CREATE INDEX CONCURRENTLY IF NOT EXISTS ...
+    
+    Returns:
+        True si al terminar el índice existe y es válido
+    """
+    valid = await conn.fetchval(INDEX_VALID_QUERY, name)
+    if valid:
+        return True
+    if valid is False:
+        logger.warning("⚠️ Índice %s inválido (creación interrumpida), se reconstruye", name)
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    await conn.execute(statement)
+    return bool(await conn.fetchval(INDEX_VALID_QUERY, name))
@@ -1,40 +1,189 @@
 import os
 import asyncpg
 import asyncio
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 import json
 import logging
 
+from database.indexes import ensure_index
+from database.search import SearchEngine
+from database.sketch import HyperLogLog
+from src.singleflight import SingleFlight, coalesce
+from src.metrics import DB_QUERY_SECONDS, timed
+
 load_dotenv()
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Índices de soporte para las consultas de NeonDatabase (se crean en segundo plano al
+# iniciar si no existen): nombre -> sentencia
+INVOICE_INDEXES = {
+    'idx_created_at':
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_created_at ON invoices (created_at)",
+    'idx_invoices_username_lower':
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_invoices_username_lower ON invoices (LOWER(username), created_at DESC)",
+    'idx_invoices_invoice_number':
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_invoices_invoice_number ON invoices (invoice_number)",
+}
+
+
+def _to_date(value):
+    """Convierte 'YYYY-MM-DD', date o datetime a date"""
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+def _date_bounds(start_date, end_date):
+    """
+    Convierte un rango de fechas (ambos extremos incluidos) en límites
+    semiabiertos de created_at: [inicio 00:00, día siguiente al fin 00:00)
+    """
+    start_date = _to_date(start_date)
+    end_date = _to_date(end_date)
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    return start, end
+
+
 class NeonDatabase:
     def __init__(self):
         self.conn_string = os.environ.get("STR_DB")
         self.pool = None
+        # Lecturas idénticas concurrentes comparten una sola consulta
+        self._singleflight = SingleFlight()
+        self.pool_min_size = int(os.environ.get("DB_POOL_MIN", "1"))
+        self.pool_max_size = int(os.environ.get("DB_POOL_MAX", "10"))
+        self.search = None
+        
+        # Sketches para estadísticas aproximadas (se actualizan de forma incremental por id)
+        self._hll_customers = HyperLogLog()
+        self._hll_invoices = HyperLogLog()
+        self._sketch_last_id = 0
+        self._sketch_rows = 0
+        # Hasta que termine la primera construcción los conteos usan pg_stats
+        self._sketch_ready = False
+        self._sketch_lock = asyncio.Lock()
+        self.sketch_batch_size = int(os.environ.get("APPROX_SKETCH_BATCH", "50000"))
+        self.approx_stats = os.environ.get("APPROX_STATS", "false").lower() in ("1", "true", "yes")
+        self._sketch_task = None
+        self._index_task = None
     
-    async def initialize(self):
-        """Inicializa el pool de conexiones y crea las tablas"""
+    async def initialize(self, build_indexes: bool = True):
+        """
+        Inicializa el pool de conexiones
+        
+        Args:
+            build_indexes: False si quien inicializa lanza después start_index_build()
+                           (los bots lo hacen en su etapa de arranque en segundo plano)
+        """
         try:
             logger.info("🔌 Intentando conectar a Neon Database...")
-            self.pool = await asyncpg.create_pool(self.conn_string, min_size=1, max_size=10)
+            self.pool = await asyncpg.create_pool(
+                self.conn_string,
+                min_size=self.pool_min_size,
+                max_size=self.pool_max_size,
+            )
+            
+            # Índices de soporte y de búsqueda en segundo plano: hasta que estén
+            # listos las consultas funcionan igual (las búsquedas usan ILIKE)
+            self.search = SearchEngine(self.pool)
+            if build_indexes:
+                self.start_index_build()
+            
+            # Construir los sketches de estadísticas aproximadas en segundo plano
+            if self.approx_stats:
+                self._sketch_task = asyncio.create_task(self.build_stats_sketches())
             logger.info("✅ Base de datos inicializada correctamente")
-            print("✓ Base de datos inicializada correctamente")
         except Exception as e:
-            logger.error(f"❌ Error al inicializar base de datos: {e}")
-            print(f"✗ Error al inicializar base de datos: {e}")
+            logger.error("❌ Error al inicializar base de datos: %s", e, exc_info=True)
             raise
+    
+    def start_index_build(self) -> asyncio.Task:
+        """
+        Lanza (una sola vez) la creación de los índices en segundo plano
+        
+        Returns:
+            La tarea que crea los índices de soporte y luego los de búsqueda
+        """
+        if self._index_task is None:
+            self._index_task = asyncio.create_task(self._build_indexes())
+        return self._index_task
+    
+    async def _build_indexes(self):
+        # Uno a la vez: cada CREATE INDEX CONCURRENTLY recorre toda la tabla
+        if os.environ.get("MANAGE_INDEXES", "true").lower() in ("1", "true", "yes"):
+            await self.ensure_indexes()
+        if os.environ.get("SEARCH_INDEXES", "true").lower() in ("1", "true", "yes"):
+            await self.search.bootstrap()
+    
+    async def ensure_indexes(self):
+        """
+        Crea los índices de soporte de invoices (created_at, LOWER(username), invoice_number)
+        y reconstruye los que quedaron inválidos
+        """
+        valid = 0
+        async with self.pool.acquire() as conn:
+            for name, statement in INVOICE_INDEXES.items():
+                try:
+                    if await ensure_index(conn, name, statement):
+                        valid += 1
+                    else:
+                        logger.warning("⚠️ Índice %s inválido tras crearlo", name)
+                except Exception as e:
+                    logger.warning("⚠️ No se pudo crear índice %s: %s", name, e)
+        logger.info("🗂️ Índices de invoices verificados (%s/%s válidos)", valid, len(INVOICE_INDEXES))
+    
+    def pool_stats(self) -> dict:
+        """
+        Estado del pool de conexiones (único pool de la aplicación)
+        """
+        if not self.pool:
+            return {'size': 0, 'idle': 0, 'min_size': self.pool_min_size, 'max_size': self.pool_max_size}
+        return {
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'min_size': self.pool.get_min_size(),
+            'max_size': self.pool.get_max_size(),
+        }
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def count_invoices(self) -> int:
+        """
+        Número total de registros en invoices
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval('SELECT COUNT(*) FROM invoices')
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def count_customers(self) -> int:
+        """
+        Número de clientes (usernames) distintos
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval('''
+                SELECT COUNT(DISTINCT username)
+                FROM invoices
+                WHERE username IS NOT NULL
+            ''')
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def get_invoices_watermark(self):
+        """
+        Marca de datos de invoices: (máximo id, máxima fecha de creación)
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('SELECT MAX(id), MAX(created_at) FROM invoices')
+            return (row[0], row[1]) if row else (None, None)
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def search_invoices_by_username(self, username: str, limit: int = 10):
         """
         Busca facturas (invoices) por username para encontrar preguntas y respuestas frecuentes
@@ -58,10 +207,15 @@ class NeonDatabase:
             
             return [dict(row) for row in rows] if rows else []
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def search_similar_questions(self, question: str, limit: int = 5):
         """
         Busca preguntas similares en la tabla invoices usando búsqueda de texto
         """
+        if self.search and self.search.enabled:
+            return await self.search.similar_questions(question, limit)
+        
         async with self.pool.acquire() as conn:
             # Búsqueda usando ILIKE para encontrar texto similar
             search_pattern = f"%{question}%"
@@ -82,22 +236,62 @@ class NeonDatabase:
     async def get_faq_context(self, username: str = None, question: str = None):
         """
         Obtiene contexto de FAQs basado en username y/o pregunta similar
+        
+        Ambas búsquedas se ejecutan en paralelo, en conexiones distintas del pool.
         """
         context = {
             'user_history': [],
             'similar_questions': []
         }
         
+        tasks = {}
         # Buscar historial del usuario si se proporciona username
         if username:
-            context['user_history'] = await self.search_invoices_by_username(username, limit=5)
+            tasks['user_history'] = self.search_invoices_by_username(username, limit=5)
         
         # Buscar preguntas similares si se proporciona pregunta
         if question:
-            context['similar_questions'] = await self.search_similar_questions(question, limit=3)
+            tasks['similar_questions'] = self.search_similar_questions(question, limit=3)
+        
+        context.update(await self._gather_dict(tasks))
+        return context
+    
+    async def get_sales_context(self, include_recent: bool = False, include_top_customers: bool = False,
+                                keyword: str = None, limit: int = 5, approximate: bool = False):
+        """
+        Obtiene en una sola operación todo el contexto de ventas que necesita un mensaje
+        
+        Las partes se consultan en paralelo, así el tiempo total es el de una sola
+        ida y vuelta a la base de datos en lugar de una por cada parte.
+        
+        Returns:
+            dict con 'stats' y, según lo pedido, 'recent_sales', 'top_customers',
+            'search_results' y 'search_keyword'
+        """
+        tasks = {'stats': self.get_total_sales_stats(approximate=approximate)}
+        if include_recent:
+            tasks['recent_sales'] = self.get_recent_sales(limit)
+        if include_top_customers:
+            tasks['top_customers'] = self.get_top_customers(limit)
+        if keyword:
+            tasks['search_results'] = self.search_all_sales_by_keyword(keyword, limit)
         
+        context = await self._gather_dict(tasks)
+        if keyword:
+            context['search_keyword'] = keyword
         return context
     
+    async def _gather_dict(self, tasks: dict) -> dict:
+        """
+        Ejecuta en paralelo un dict de corrutinas y devuelve un dict con los resultados
+        """
+        if not tasks:
+            return {}
+        results = await asyncio.gather(*tasks.values())
+        return dict(zip(tasks.keys(), results))
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def get_sales_count_by_username(self, username: str):
         """
         Obtiene el número total de ventas (invoices) de un usuario
@@ -113,6 +307,8 @@ class NeonDatabase:
             
             return dict(result) if result else {'total_sales': 0, 'unique_invoices': 0}
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def get_sales_stats_by_username(self, username: str):
         """
         Obtiene estadísticas detalladas de ventas de un usuario
@@ -130,6 +326,8 @@ class NeonDatabase:
             
             return dict(stats) if stats else None
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def get_recent_sales_by_username(self, username: str, limit: int = 10):
         """
         Obtiene las ventas más recientes de un usuario
@@ -149,10 +347,15 @@ class NeonDatabase:
             
             return [dict(row) for row in rows] if rows else []
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def search_sales_by_keyword(self, username: str, keyword: str, limit: int = 10):
         """
         Busca ventas de un usuario que contengan una palabra clave específica
         """
+        if self.search and self.search.enabled:
+            return await self.search.search_by_username(username, keyword, limit)
+        
         async with self.pool.acquire() as conn:
             search_pattern = f"%{keyword}%"
             rows = await conn.fetch('''
@@ -170,10 +373,24 @@ class NeonDatabase:
             
             return [dict(row) for row in rows] if rows else []
     
-    async def get_all_sales_summary(self):
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def get_all_sales_summary(self, approximate: bool = False):
         """
         Obtiene un resumen de todas las ventas en el sistema
+        
+        Si approximate=True responde en tiempo constante usando estadísticas
+        del planner y sketches HyperLogLog (resultado marcado como aproximado).
         """
+        if approximate:
+            approx = await self._get_approximate_counts()
+            return {
+                'total_invoices': approx['total_records'],
+                'total_users': approx['total_customers'],
+                'unique_invoices': approx['total_invoices'],
+                'approximate': True,
+            }
+        
         async with self.pool.acquire() as conn:
             result = await conn.fetchrow('''
                 SELECT 
@@ -185,10 +402,30 @@ class NeonDatabase:
             
             return dict(result) if result else None
     
-    async def get_total_sales_stats(self):
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def get_total_sales_stats(self, approximate: bool = False):
         """
         Obtiene estadísticas completas de TODAS las ventas de la empresa
+        
+        Si approximate=True los conteos son estimaciones en tiempo constante
+        (se agrega la clave 'approximate': True). MIN/MAX de created_at se
+        resuelven con el índice de created_at en ambos modos.
         """
+        if approximate:
+            approx = await self._get_approximate_counts()
+            async with self.pool.acquire() as conn:
+                bounds = await conn.fetchrow('''
+                    SELECT 
+                        MIN(created_at) as first_sale,
+                        MAX(created_at) as last_sale
+                    FROM invoices
+                ''')
+            stats = dict(approx)
+            stats.update(dict(bounds) if bounds else {'first_sale': None, 'last_sale': None})
+            stats['approximate'] = True
+            return stats
+        
         async with self.pool.acquire() as conn:
             stats = await conn.fetchrow('''
                 SELECT 
@@ -202,6 +439,107 @@ class NeonDatabase:
             
             return dict(stats) if stats else None
     
+    async def _get_approximate_counts(self):
+        """
+        Conteos aproximados de registros, facturas únicas y clientes
+        
+        - Registros: reltuples de pg_class (o n_live_tup si la tabla no fue analizada)
+        - Distintos: sketches HyperLogLog si ya están construidos, si no n_distinct de pg_stats
+        
+        Las filas nuevas se incorporan a los sketches en segundo plano: la respuesta
+        nunca espera a recorrer la tabla.
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT 
+                    GREATEST(c.reltuples, 0)::bigint as reltuples,
+                    COALESCE(s.n_live_tup, 0) as live_tuples
+                FROM pg_class c
+                LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                WHERE c.oid = 'invoices'::regclass
+            ''')
+            total_records = (row['reltuples'] or row['live_tuples']) if row else 0
+            
+            if self._sketch_ready:
+                # Incorporar las filas nuevas desde la última actualización para la próxima consulta
+                self._schedule_sketch_update()
+                total_records = max(total_records, self._sketch_rows)
+                return {
+                    'total_records': total_records,
+                    'total_invoices': self._hll_invoices.count(),
+                    'total_customers': self._hll_customers.count(),
+                }
+            
+            distinct_rows = await conn.fetch('''
+                SELECT attname, n_distinct
+                FROM pg_stats
+                WHERE tablename = 'invoices'
+                  AND attname IN ('invoice_number', 'username')
+            ''')
+        
+        distinct = {}
+        for item in distinct_rows:
+            n_distinct = item['n_distinct']
+            # n_distinct negativo indica una fracción del total de filas
+            distinct[item['attname']] = int(-n_distinct * total_records) if n_distinct < 0 else int(n_distinct)
+        
+        return {
+            'total_records': total_records,
+            'total_invoices': distinct.get('invoice_number', 0),
+            'total_customers': distinct.get('username', 0),
+        }
+    
+    async def build_stats_sketches(self):
+        """
+        Construye los sketches HyperLogLog recorriendo invoices por lotes de id.
+        Pensado para ejecutarse una vez en segundo plano al iniciar.
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                await self._update_sketches(conn)
+            self._sketch_ready = True
+            logger.info("📐 Sketches de estadísticas construidos (%s registros)", self._sketch_rows)
+        except Exception as e:
+            logger.error("❌ Error al construir sketches de estadísticas: %s", e, exc_info=True)
+    
+    def _schedule_sketch_update(self):
+        """Lanza una actualización incremental de los sketches si no hay otra en curso"""
+        if (self._sketch_task and not self._sketch_task.done()) or self._sketch_lock.locked():
+            return
+        self._sketch_task = asyncio.create_task(self._catch_up_sketches())
+    
+    async def _catch_up_sketches(self):
+        try:
+            async with self.pool.acquire() as conn:
+                await self._update_sketches(conn, max_rows=self.sketch_batch_size)
+        except Exception as e:
+            logger.warning("⚠️ No se pudieron actualizar los sketches de estadísticas: %s", e)
+    
+    async def _update_sketches(self, conn, max_rows: int = None):
+        """
+        Agrega a los sketches las filas con id mayor al último procesado
+        """
+        async with self._sketch_lock:
+            processed = 0
+            while max_rows is None or processed < max_rows:
+                rows = await conn.fetch('''
+                    SELECT id, username, invoice_number
+                    FROM invoices
+                    WHERE id > $1
+                    ORDER BY id
+                    LIMIT $2
+                ''', self._sketch_last_id, self.sketch_batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    self._hll_customers.add(row['username'])
+                    self._hll_invoices.add(row['invoice_number'])
+                self._sketch_last_id = rows[-1]['id']
+                self._sketch_rows += len(rows)
+                processed += len(rows)
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def get_recent_sales(self, limit: int = 10):
         """
         Obtiene las ventas más recientes de TODA la empresa
@@ -221,10 +559,15 @@ class NeonDatabase:
             
             return [dict(row) for row in rows] if rows else []
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def search_all_sales_by_keyword(self, keyword: str, limit: int = 10):
         """
         Busca en TODAS las ventas de la empresa que contengan una palabra clave
         """
+        if self.search and self.search.enabled:
+            return await self.search.search_all(keyword, limit)
+        
         async with self.pool.acquire() as conn:
             search_pattern = f"%{keyword}%"
             rows = await conn.fetch('''
@@ -242,10 +585,18 @@ class NeonDatabase:
             
             return [dict(row) for row in rows] if rows else []
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def get_sales_by_date_range(self, start_date: str = None, end_date: str = None, limit: int = 50):
         """
-        Obtiene ventas en un rango de fechas
+        Obtiene ventas en un rango de fechas (ambos extremos incluidos)
+        
+        Las fechas se convierten a un rango semiabierto sobre created_at
+        (>= inicio y < día siguiente al fin) para poder usar el índice de created_at.
         """
+        start_date = _to_date(start_date)
+        end_date = _to_date(end_date)
+        
         async with self.pool.acquire() as conn:
             if start_date and end_date:
                 rows = await conn.fetch('''
@@ -255,10 +606,10 @@ class NeonDatabase:
                         message_text,
                         created_at
                     FROM invoices
-                    WHERE created_at::date BETWEEN $1::date AND $2::date
+                    WHERE created_at >= $1 AND created_at < $2
                     ORDER BY created_at DESC
                     LIMIT $3
-                ''', start_date, end_date, limit)
+                ''', *_date_bounds(start_date, end_date), limit)
             elif start_date:
                 rows = await conn.fetch('''
                     SELECT 
@@ -267,10 +618,10 @@ class NeonDatabase:
                         message_text,
                         created_at
                     FROM invoices
-                    WHERE created_at::date >= $1::date
+                    WHERE created_at >= $1
                     ORDER BY created_at DESC
                     LIMIT $2
-                ''', start_date, limit)
+                ''', datetime.combine(start_date, datetime.min.time()), limit)
             else:
                 rows = await conn.fetch('''
                     SELECT 
@@ -285,6 +636,8 @@ class NeonDatabase:
             
             return [dict(row) for row in rows] if rows else []
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def get_top_customers(self, limit: int = 10):
         """
         Obtiene los clientes con más ventas
@@ -305,6 +658,70 @@ class NeonDatabase:
             
             return [dict(row) for row in rows] if rows else []
     
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def get_sales_summary_by_date_range(self, start_date, end_date):
+        """
+        Registros, facturas únicas y clientes en un rango de fechas (ambos incluidos)
+        """
+        start, end = _date_bounds(start_date, end_date)
+        async with self.pool.acquire() as conn:
+            result = await conn.fetchrow('''
+                SELECT 
+                    COUNT(*) as total_records,
+                    COUNT(DISTINCT invoice_number) as total_invoices,
+                    COUNT(DISTINCT username) as total_customers
+                FROM invoices
+                WHERE created_at >= $1 AND created_at < $2
+            ''', start, end)
+            
+            return dict(result) if result else {'total_records': 0, 'total_invoices': 0, 'total_customers': 0}
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def get_top_customers_by_date_range(self, start_date, end_date, limit: int = 10):
+        """
+        Obtiene los clientes con más ventas en un rango de fechas (ambos incluidos)
+        """
+        start, end = _date_bounds(start_date, end_date)
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT 
+                    username,
+                    COUNT(*) as total_purchases,
+                    COUNT(DISTINCT invoice_number) as unique_invoices,
+                    MAX(created_at) as last_purchase
+                FROM invoices
+                WHERE username IS NOT NULL
+                  AND created_at >= $1 AND created_at < $2
+                GROUP BY username
+                ORDER BY total_purchases DESC
+                LIMIT $3
+            ''', start, end, limit)
+            
+            return [dict(row) for row in rows] if rows else []
+    
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
+    async def get_recent_customers(self, limit: int = 10):
+        """
+        Obtiene los últimos clientes distintos que compraron
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT 
+                    username,
+                    MAX(created_at) as last_purchase
+                FROM invoices
+                WHERE username IS NOT NULL
+                GROUP BY username
+                ORDER BY last_purchase DESC
+                LIMIT $1
+            ''', limit)
+            
+            return [dict(row) for row in rows] if rows else []
+    
+    @timed(DB_QUERY_SECONDS)
     async def query_sales_data(self, query_type: str, **kwargs):
         """
         Método unificado para consultar datos de ventas
@@ -336,6 +753,8 @@ class NeonDatabase:
         else:
             return None
         
+    @coalesce
+    @timed(DB_QUERY_SECONDS)
     async def get_bot_conversation_history(self, user_id: int, limit: int = 20):
         """Obtiene el historial de conversación del bot para un usuario"""
         async with self.pool.acquire() as conn:
@@ -356,11 +775,48 @@ class NeonDatabase:
                 })
             return messages
     
+    @timed(DB_QUERY_SECONDS)
+    async def fetch_readonly(self, query: str, *args, max_rows: int = 50):
+        """
+        Ejecuta una consulta de solo lectura (plantillas SQL aprendidas) en una
+        transacción READ ONLY con timeout
+        
+        Las filas se leen con un cursor: solo se traen max_rows aunque la consulta
+        no tenga LIMIT.
+        """
+        timeout = float(os.environ.get("READONLY_QUERY_TIMEOUT", "5"))
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(query, *args, timeout=timeout)
+                rows = await cursor.fetch(max_rows, timeout=timeout)
+            return [dict(row) for row in rows]
+    
+    @timed(DB_QUERY_SECONDS)
+    async def add_bot_conversation_message(self, user_id: int, role: str, content: str):
+        """Guarda un mensaje del historial de conversación del bot"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO bot_conversations (user_id, role, content)
+                VALUES ($1, $2, $3)
+            ''', user_id, role, content)
+    
+    @timed(DB_QUERY_SECONDS)
+    async def clear_bot_conversation_history(self, user_id: int):
+        """Elimina el historial de conversación del bot de un usuario"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                DELETE FROM bot_conversations
+                WHERE user_id = $1
+            ''', user_id)
+    
     async def close(self):
         """Cierra el pool de conexiones"""
+        for task in (self._sketch_task, self._index_task):
+            if task and not task.done():
+                task.cancel()
         if self.pool:
             await self.pool.close()
-            print("✓ Conexión a base de datos cerrada")
+            logger.info("✓ Conexión a base de datos cerrada")
 
 # Instancia global de la base de datos
 db = NeonDatabase()
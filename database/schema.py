@@ -0,0 +1,220 @@
+"""
+Caché de metadatos del esquema (columnas, clave primaria y filas de ejemplo)
+
+La comparten /schema y la herramienta sql_db_schema del SQL Agent, que antes
+reflejaban todas las tablas y leían filas de ejemplo en cada llamada. Se llena una
+vez al iniciar, solo con las tablas permitidas (SCHEMA_TABLES), y se reconstruye
+con invalidate() o cuando cambia la huella de las columnas (DDL detectado).
+"""
+import os
+import time
+import asyncio
+import logging
+
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLES = "invoices,bot_conversations"
+
+# Huella de las columnas de las tablas permitidas: cambia con cualquier DDL sobre ellas
+FINGERPRINT_QUERY = '''
+    SELECT md5(string_agg(
+        table_name || '.' || column_name || ':' || data_type || ':' || is_nullable,
+        ',' ORDER BY table_name, ordinal_position
+    ))
+    FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = ANY($1::text[])
+'''
+
+COLUMNS_QUERY = '''
+    SELECT table_name, column_name, data_type, is_nullable, column_default
+    FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = ANY($1::text[])
+    ORDER BY table_name, ordinal_position
+'''
+
+PRIMARY_KEYS_QUERY = '''
+    SELECT tc.table_name, tc.constraint_name,
+           array_agg(kcu.column_name::text ORDER BY kcu.ordinal_position) AS columns
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+      ON kcu.constraint_name = tc.constraint_name AND kcu.table_schema = tc.table_schema
+    WHERE tc.table_schema = current_schema() AND tc.constraint_type = 'PRIMARY KEY'
+      AND tc.table_name = ANY($1::text[])
+    GROUP BY tc.table_name, tc.constraint_name
+'''
+
+# Longitud máxima de cada valor en las filas de ejemplo
+SAMPLE_VALUE_CHARS = 100
+
+
+def _format_value(value) -> str:
+    text = str(value)
+    return text if len(text) <= SAMPLE_VALUE_CHARS else text[:SAMPLE_VALUE_CHARS] + "..."
+
+
+def format_table_info(table: str, columns: list, primary_key: tuple = None, samples: list = None) -> str:
+    """
+    Descripción de una tabla con el formato de SQLDatabase.get_table_info de LangChain
+    (CREATE TABLE y un bloque con filas de ejemplo)
+    """
+    lines = []
+    for column in columns:
+        definition = f"\t{column['column_name']} {column['data_type'].upper()}"
+        if column['is_nullable'] == 'NO':
+            definition += " NOT NULL"
+        if column['column_default'] is not None:
+            definition += f" DEFAULT {column['column_default']}"
+        lines.append(definition)
+    if primary_key:
+        name, key_columns = primary_key
+        lines.append(f"\tCONSTRAINT {name} PRIMARY KEY ({', '.join(key_columns)})")
+    info = f"CREATE TABLE {table} (\n" + ",\n".join(lines) + "\n)"
+    
+    if samples is not None:
+        header = "\t".join(column['column_name'] for column in columns)
+        rows = "\n".join("\t".join(_format_value(value) for value in row) for row in samples)
+        info += f"\n\n/*\n{len(samples)} rows from {table} table:\n{header}\n{rows}\n*/"
+    return info
+
+
+class SchemaCache:
+    """
+    Metadatos de las tablas permitidas, leídos con el pool asyncpg de NeonDatabase
+    
+    - get(): descripción de las tablas (todas o las pedidas), desde la caché
+    - invalidate(): fuerza la reconstrucción en la próxima lectura
+    - Cada SCHEMA_CHECK_INTERVAL segundos se compara la huella de las columnas y,
+      si cambió, se reconstruye
+    """
+    
+    def __init__(self, database, tables: list = None, sample_rows: int = None, check_interval: float = None):
+        self.database = database
+        self.tables = tables or [
+            t.strip() for t in os.getenv("SCHEMA_TABLES", DEFAULT_TABLES).split(",") if t.strip()
+        ]
+        self.sample_rows = sample_rows if sample_rows is not None else int(os.getenv("SCHEMA_SAMPLE_ROWS", "3"))
+        self.check_interval = (
+            check_interval if check_interval is not None
+            else float(os.getenv("SCHEMA_CHECK_INTERVAL", "60"))
+        )
+        
+        # tabla -> descripción formateada
+        self._info = {}
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._valid = False
+        self._lock = asyncio.Lock()
+        
+        self.refreshes = 0
+        self.ddl_changes = 0
+        self.hits = 0
+    
+    @property
+    def table_names(self) -> list:
+        """Tablas permitidas que existen en la base de datos (tras la primera carga)"""
+        return list(self._info) if self._valid else list(self.tables)
+    
+    def invalidate(self):
+        """Descarta los metadatos: la próxima lectura los vuelve a cargar"""
+        self._valid = False
+        logger.info("🗄️ Caché de esquema invalidada")
+    
+    async def refresh(self):
+        """Carga columnas, claves primarias y filas de ejemplo de las tablas permitidas"""
+        async with self._lock:
+            await self._load()
+    
+    async def _load(self):
+        start = time.perf_counter()
+        with span("schema.refresh", tables=len(self.tables)):
+            async with self.database.pool.acquire() as conn:
+                fingerprint = await conn.fetchval(FINGERPRINT_QUERY, self.tables)
+                columns = await conn.fetch(COLUMNS_QUERY, self.tables)
+                keys = await conn.fetch(PRIMARY_KEYS_QUERY, self.tables)
+                
+                by_table = {}
+                for column in columns:
+                    by_table.setdefault(column['table_name'], []).append(column)
+                primary_keys = {row['table_name']: (row['constraint_name'], row['columns']) for row in keys}
+                
+                info = {}
+                # Se respeta el orden de SCHEMA_TABLES; las tablas inexistentes se omiten
+                for table in self.tables:
+                    if table not in by_table:
+                        logger.debug("Tabla %s no encontrada, se omite del esquema", table)
+                        continue
+                    samples = None
+                    if self.sample_rows > 0:
+                        # El nombre viene de la lista permitida y existe en information_schema
+                        rows = await conn.fetch(f'SELECT * FROM "{table}" LIMIT {int(self.sample_rows)}')
+                        samples = [tuple(row.values()) for row in rows]
+                    info[table] = format_table_info(table, by_table[table], primary_keys.get(table), samples)
+        
+        self._info = info
+        self._fingerprint = fingerprint
+        self._checked_at = time.monotonic()
+        self._valid = True
+        self.refreshes += 1
+        logger.info(
+            "🗄️ Esquema cargado: %s (%s filas de ejemplo, %.2fs)",
+            ', '.join(info) or 'sin tablas', self.sample_rows, time.perf_counter() - start
+        )
+    
+    async def _check_ddl(self):
+        """Compara la huella de las columnas como mucho una vez por intervalo"""
+        now = time.monotonic()
+        if (now - self._checked_at) < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            async with self.database.pool.acquire() as conn:
+                fingerprint = await conn.fetchval(FINGERPRINT_QUERY, self.tables)
+        except Exception as e:
+            logger.warning("⚠️ No se pudo verificar el esquema: %s", e)
+            return
+        if fingerprint != self._fingerprint:
+            self.ddl_changes += 1
+            logger.info("🗄️ Cambio de esquema detectado, se recargan los metadatos")
+            self._valid = False
+    
+    async def get(self, table_names: list = None) -> str:
+        """
+        Descripción de las tablas pedidas (por defecto todas las permitidas)
+        
+        Raises:
+            ValueError: si se pide una tabla fuera de la lista permitida
+        """
+        if self._valid:
+            await self._check_ddl()
+        if not self._valid:
+            async with self._lock:
+                # Otra tarea pudo haberla recargado mientras se esperaba el lock
+                if not self._valid:
+                    await self._load()
+        else:
+            self.hits += 1
+        return self.cached_info(table_names)
+    
+    def cached_info(self, table_names: list = None) -> str:
+        """
+        Descripción desde la caché sin consultar la base de datos (para código síncrono)
+        
+        Raises:
+            ValueError: si se pide una tabla fuera de la lista permitida
+        """
+        names = table_names or list(self._info)
+        unknown = [name for name in names if name not in self._info]
+        if unknown:
+            raise ValueError(f"table_names {set(unknown)} not found in database")
+        return "\n\n".join(self._info[name] for name in names)
+    
+    def stats(self) -> dict:
+        return {
+            'tables': list(self._info),
+            'sample_rows': self.sample_rows,
+            'refreshes': self.refreshes,
+            'ddl_changes': self.ddl_changes,
+            'hits': self.hits,
+        }
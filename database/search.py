@@ -0,0 +1,151 @@
+"""
+Motor de búsqueda sobre invoices con índices de texto completo (tsvector en español)
+y trigramas (pg_trgm), con resultados ordenados por relevancia
+"""
+import os
+import re
+import logging
+
+from database.indexes import ensure_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_CONFIG = "spanish"
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)?')
+
+
+def _search_config() -> str:
+    """
+    Configuración de texto (SEARCH_TS_CONFIG); va literal en la expresión del índice,
+    por lo que solo se aceptan identificadores
+    """
+    value = os.environ.get("SEARCH_TS_CONFIG", DEFAULT_SEARCH_CONFIG).strip()
+    if not _IDENTIFIER_RE.fullmatch(value):
+        logger.warning("⚠️ SEARCH_TS_CONFIG inválido (%r), se usa %s", value, DEFAULT_SEARCH_CONFIG)
+        return DEFAULT_SEARCH_CONFIG
+    return value
+
+
+# Configuración de texto de PostgreSQL usada para el índice de texto completo
+SEARCH_CONFIG = _search_config()
+
+# Expresión indexada: las consultas deben usar exactamente la misma expresión
+TSV_EXPRESSION = (
+    f"to_tsvector('{SEARCH_CONFIG}'::regconfig, "
+    "coalesce(message_text, '') || ' ' || coalesce(gpt_response, ''))"
+)
+
+# Migración idempotente: puede ejecutarse en cada arranque
+BOOTSTRAP_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+]
+
+# Nombre del índice -> sentencia que lo crea
+SEARCH_INDEXES = {
+    'idx_invoices_fts':
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_invoices_fts ON invoices USING GIN ({TSV_EXPRESSION})",
+    'idx_invoices_message_trgm':
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_invoices_message_trgm ON invoices USING GIN (message_text gin_trgm_ops)",
+    'idx_invoices_number_trgm':
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_invoices_number_trgm ON invoices USING GIN (invoice_number gin_trgm_ops)",
+}
+
+
+class SearchEngine:
+    """
+    Búsquedas indexadas sobre la tabla invoices.
+    
+    Mientras los índices se construyen, o si la migración no se pudo aplicar (por
+    ejemplo, sin permisos para crear la extensión pg_trgm) o algún índice quedó
+    inválido, `enabled` queda en False y NeonDatabase usa ILIKE.
+    """
+    
+    def __init__(self, pool):
+        self.pool = pool
+        self.enabled = False
+    
+    async def bootstrap(self):
+        """
+        Crea la extensión y los índices necesarios si no existen y reconstruye los
+        inválidos; pensado para ejecutarse en segundo plano
+        """
+        self.enabled = False
+        try:
+            async with self.pool.acquire() as conn:
+                for statement in BOOTSTRAP_STATEMENTS:
+                    await conn.execute(statement)
+                invalid = [
+                    name for name, statement in SEARCH_INDEXES.items()
+                    if not await ensure_index(conn, name, statement)
+                ]
+            if invalid:
+                logger.warning("⚠️ Índices de búsqueda inválidos (%s), se usará ILIKE", ', '.join(invalid))
+                return
+            self.enabled = True
+            logger.info("🔎 Índices de búsqueda (tsvector + pg_trgm) listos")
+        except Exception as e:
+            self.enabled = False
+            logger.warning("⚠️ No se pudieron crear los índices de búsqueda, se usará ILIKE: %s", e)
+    
+    async def search_all(self, keyword: str, limit: int = 10):
+        """
+        Busca en TODAS las ventas, ordenando por relevancia y luego por fecha
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(f'''
+                SELECT 
+                    invoice_number,
+                    username,
+                    message_text,
+                    gpt_response,
+                    created_at,
+                    ts_rank({TSV_EXPRESSION}, query) as rank
+                FROM invoices, websearch_to_tsquery($4::regconfig, $1) query
+                WHERE {TSV_EXPRESSION} @@ query
+                   OR invoice_number ILIKE $2
+                ORDER BY rank DESC, created_at DESC
+                LIMIT $3
+            ''', keyword, f"%{keyword}%", limit, SEARCH_CONFIG)
+            
+            return [dict(row) for row in rows] if rows else []
+    
+    async def search_by_username(self, username: str, keyword: str, limit: int = 10):
+        """
+        Busca en las ventas de un usuario, ordenando por relevancia
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(f'''
+                SELECT 
+                    invoice_number,
+                    message_text,
+                    gpt_response,
+                    created_at,
+                    ts_rank({TSV_EXPRESSION}, query) as rank
+                FROM invoices, websearch_to_tsquery($4::regconfig, $2) query
+                WHERE LOWER(username) = LOWER($1)
+                  AND {TSV_EXPRESSION} @@ query
+                ORDER BY rank DESC, created_at DESC
+                LIMIT $3
+            ''', username, keyword, limit, SEARCH_CONFIG)
+            
+            return [dict(row) for row in rows] if rows else []
+    
+    async def similar_questions(self, question: str, limit: int = 5):
+        """
+        Busca preguntas parecidas por similitud de trigramas
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT 
+                    message_text,
+                    gpt_response,
+                    username,
+                    created_at,
+                    similarity(message_text, $1) as score
+                FROM invoices
+                WHERE message_text % $1
+                ORDER BY score DESC, created_at DESC
+                LIMIT $2
+            ''', question, limit)
+            
+            return [dict(row) for row in rows] if rows else []
@@ -0,0 +1,55 @@
+"""
+Estructuras probabilísticas para estadísticas aproximadas en tiempo constante
+"""
+import math
+import hashlib
+
+
+class HyperLogLog:
+    """
+    Sketch HyperLogLog para estimar el número de valores distintos.
+    
+    Con precision=12 usa 4096 registros (~4 KB) y tiene un error típico de ~1.6%.
+    """
+    
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision debe estar entre 4 y 16")
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+        
+        if self.num_registers >= 128:
+            self._alpha = 0.7213 / (1 + 1.079 / self.num_registers)
+        elif self.num_registers == 64:
+            self._alpha = 0.709
+        elif self.num_registers == 32:
+            self._alpha = 0.697
+        else:
+            self._alpha = 0.673
+    
+    def add(self, value):
+        """Agrega un valor al sketch (None se ignora)"""
+        if value is None:
+            return
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        index = x >> (64 - self.precision)
+        width = 64 - self.precision
+        remaining = x & ((1 << width) - 1)
+        # Posición del primer bit en 1 dentro de los bits restantes
+        rank = width - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def count(self) -> int:
+        """Estimación del número de valores distintos"""
+        m = self.num_registers
+        estimate = self._alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        
+        # Corrección para cardinalidades pequeñas (linear counting)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        
+        return int(round(estimate))
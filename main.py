@@ -5,29 +5,37 @@ Punto de entrada principal del programa
 import os
 import asyncio
 import logging
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from dotenv import load_dotenv
 import sys
 
 # Agregar el directorio actual al path para imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Primero: marca el inicio del arranque para medir las fases
+from src.startup import StartupTimer
+
+from telegram import Update
+from telegram.ext import CommandHandler, MessageHandler, filters, ContextTypes
+from dotenv import load_dotenv
+
 from database.neon import NeonDatabase
-from servicio.openai import GroqService
+from database.diagnostics import explain_queries, format_explain_report
+from servicio.openai import GroqService, get_groq_service
+from servicio.streaming import reply_streaming, streaming_enabled
+from servicio.webhook import application_builder, webhook_enabled, webhook_options
 from src.tools import SalesAgent, HybridAssistant
+from src.intents import classifier
+from src.scheduler import FairScheduler, RateLimitExceeded, priority_for_intent
+from src.state import create_state_backend
+from src.tracing import trace_update, current_trace_id, profiler, tracer
+from src.logs import setup_logging, content, SAMPLED
+from src.metrics import (
+    start_metrics_server, register_pool_gauges, register_agent_gauges, register_scheduler_gauges
+)
 
 load_dotenv()
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# Logging asíncrono compartido (src/logs.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Instancias globales
@@ -35,6 +43,15 @@ db: NeonDatabase = None
 groq_service: GroqService = None
 sales_agent: SalesAgent = None
 assistant: HybridAssistant = None
+scheduler: FairScheduler = None
+metrics_server = None
+startup = StartupTimer("sales")
+
+
+def is_admin(update: Update) -> bool:
+    """True si el usuario está en ADMIN_USER_IDS"""
+    admins = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").split(",") if x.strip()}
+    return update.effective_user.id in admins
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -65,9 +82,11 @@ Comandos disponibles:
 /help - Obtener ayuda
 /stats - Estadísticas generales
 /schema - Ver estructura de la base de datos
+/cache - Ver uso de la caché de respuestas
+/queue - Ver la cola de mensajes pendientes
 """
     await update.message.reply_text(welcome_message)
-    logger.info(f"👤 Usuario {update.effective_user.username} inició el bot")
+    logger.info("👤 Usuario %s inició el bot", update.effective_user.username)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -108,30 +127,124 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("📊 Consultando estadísticas...")
     
     try:
-        # Usar el SQL Agent para obtener estadísticas
-        response = await sales_agent.ask(
-            "Dame un resumen completo de estadísticas: total de facturas, total de clientes únicos, "
-            "fecha de la primera y última venta. Formatea la respuesta de manera clara."
-        )
+        # Se resuelve con la plantilla de estadísticas (consulta exacta, sin LLM)
+        response = await sales_agent.ask("Dame las estadísticas generales de ventas")
         await update.message.reply_text(f"📊 **Estadísticas Generales**\n\n{response}")
     except Exception as e:
-        logger.error(f"Error al obtener estadísticas: {e}")
+        logger.error("Error al obtener estadísticas: %s", e, exc_info=True)
         await update.message.reply_text(f"❌ Error al obtener estadísticas: {str(e)}")
 
 
 async def schema_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Comando /schema - Muestra la estructura de la base de datos
+    
+    /schema refresh (solo ADMIN_USER_IDS) descarta la caché y vuelve a leer el esquema
     """
     try:
-        schema_info = sales_agent.get_table_info()
+        if context.args and context.args[0].lower() == "refresh":
+            if not is_admin(update):
+                await update.message.reply_text("⛔ Comando reservado a administradores")
+                return
+            sales_agent.schema.invalidate()
+        schema_info = await sales_agent.get_table_info()
         message = f"🗄️ **Estructura de la Base de Datos:**\n\n```\n{schema_info}\n```"
         await update.message.reply_text(message, parse_mode='Markdown')
     except Exception as e:
-        logger.error(f"Error al obtener schema: {e}")
+        logger.error("Error al obtener schema: %s", e, exc_info=True)
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+
+async def cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /cache - Muestra el uso de la caché y del motor de plantillas del SQL Agent
+    """
+    stats = sales_agent.cache_stats()
+    coverage = sales_agent.coverage_stats()
+    agent = sales_agent.agent_stats()
+    await update.message.reply_text(
+        f"⚡ Caché de respuestas\n\n"
+        f"📦 Entradas: {stats['size']}\n"
+        f"✅ Aciertos: {stats['hits']}\n"
+        f"❌ Fallos: {stats['misses']}\n"
+        f"📈 Tasa de aciertos: {stats['hit_rate']:.0%}\n"
+        f"♻️ Invalidaciones: {stats['invalidations']}\n"
+        f"🔗 Preguntas coalescidas: {stats['coalesced']}\n"
+        f"⏱️ Tiempo de agente ahorrado: {stats['saved_seconds']}s\n\n"
+        f"📐 Respondidas sin LLM (plantillas): {coverage['answered']}/{coverage['attempts']} "
+        f"({coverage['coverage']:.0%})\n"
+        f"🧠 Planes SQL aprendidos: {stats['learned_plans']['plans']} "
+        f"(reutilizados {stats['learned_plans']['hits']} veces)\n"
+        f"🗄️ Esquema: {len(stats['schema']['tables'])} tablas, {stats['schema']['hits']} lecturas "
+        f"desde caché, {stats['schema']['refreshes']} cargas ({stats['schema']['ddl_changes']} por DDL)\n\n"
+        f"🤖 Agente: {agent['running']} en curso, {agent['queue_depth']} en cola, "
+        f"{agent['timeouts']} timeouts, promedio {agent['avg_run_time']}s"
+    )
+
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /queue - Muestra la cola de mensajes del planificador
+    """
+    stats = scheduler.stats()
+    by_priority = stats['queue_by_priority']
+    await update.message.reply_text(
+        f"🚦 Cola de mensajes\n\n"
+        f"📥 En cola: {stats['queue_depth']} "
+        f"(directas {by_priority['direct']}, chat {by_priority['chat']}, agente {by_priority['agent']})\n"
+        f"👥 Usuarios esperando: {stats['waiting_users']}\n"
+        f"⚙️ En proceso: {stats['active']}/{stats['workers']}\n"
+        f"✅ Procesados: {stats['processed']}\n"
+        f"⛔ Rechazados por límite: {stats['rejected']}\n"
+        f"⏱️ Espera promedio: {stats['avg_wait']}s (máx {stats['max_wait']}s)"
+    )
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /profile - Activa el perfilado muestreado (/profile 0.1, /profile off)
+    
+    Solo disponible para los usuarios de ADMIN_USER_IDS
+    """
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Comando reservado a administradores")
+        return
+    
+    if context.args:
+        arg = context.args[0].lower()
+        try:
+            profiler.set_rate(0.0 if arg in ("off", "0") else float(arg))
+        except ValueError:
+            await update.message.reply_text("Uso: /profile <fracción entre 0 y 1> | off")
+            return
+    
+    stats = tracer.stats()
+    await update.message.reply_text(
+        f"🔬 Trazas y perfilado\n\n"
+        f"🧵 Peticiones trazadas: {stats['traces']}\n"
+        f"🐢 Lentas (> {stats['slow_threshold']}s): {stats['slow']}\n"
+        f"📊 Perfilado: {stats['profile_rate']:.0%} de las peticiones ({stats['profiled']} perfiladas)"
+    )
+
+
+async def explain_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /explain - Diagnóstico de planes de ejecución de las consultas
+    """
+    try:
+        verbose = bool(context.args) and context.args[0] == "full"
+        report = await explain_queries(db)
+        text = format_explain_report(report, verbose=verbose)
+        await update.message.reply_text(
+            f"🔬 Planes de ejecución (EXPLAIN)\n\n{text}\n\n"
+            "Nota: con tablas pequeñas el planner puede preferir Seq Scan aunque exista índice."
+        )
+    except Exception as e:
+        logger.error("Error al obtener planes: %s", e, exc_info=True)
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 
+@trace_update("update.message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Maneja mensajes de texto del usuario
@@ -141,22 +254,43 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    logger.info(f"📨 Mensaje de {username} ({user_id}): {user_message}")
+    logger.info("📨 Mensaje de %s (%s): %s", username, user_id, content(user_message), extra=SAMPLED)
     
     # Enviar indicador de "escribiendo..."
     await update.message.chat.send_action(action="typing")
     
+    async def process():
+        if streaming_enabled():
+            # Enviar la respuesta progresivamente editando un mensaje
+            await reply_streaming(
+                update.message,
+                assistant.stream_message(user_message, username)
+            )
+        else:
+            # Usar el asistente híbrido para procesar el mensaje
+            response = await assistant.process_message(user_message, username)
+            
+            # Enviar respuesta (SIN GUARDAR EN BD - SOLO CONSULTAS)
+            await update.message.reply_text(response)
+    
     try:
-        # Usar el asistente híbrido para procesar el mensaje
-        response = await assistant.process_message(user_message, username)
+        # Cola justa por usuario: las consultas directas pasan antes que el agente
+        priority = priority_for_intent(classifier.classify(user_message))
+        await scheduler.submit(user_id, process, priority=priority)
+        logger.info("✅ Respuesta enviada a %s", username, extra=SAMPLED)
         
-        # Enviar respuesta (SIN GUARDAR EN BD - SOLO CONSULTAS)
-        await update.message.reply_text(response)
-        logger.info(f"✅ Respuesta enviada a {username}")
+    except RateLimitExceeded as e:
+        logger.warning("⛔ Límite de mensajes superado por %s (%s)", username, user_id)
+        await update.message.reply_text(
+            f"⏳ Estás enviando muchos mensajes. Intenta de nuevo en {e.retry_after:.0f} segundos."
+        )
         
     except Exception as e:
-        error_msg = f"❌ Lo siento, ocurrió un error al procesar tu mensaje: {str(e)}"
-        logger.error(f"Error al procesar mensaje: {e}", exc_info=True)
+        error_msg = (
+            f"❌ Lo siento, ocurrió un error al procesar tu mensaje: {str(e)}\n"
+            f"(referencia: {current_trace_id()})"
+        )
+        logger.error("Error al procesar mensaje: %s", e, exc_info=True)
         await update.message.reply_text(error_msg)
 
 
@@ -164,7 +298,7 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Maneja errores
     """
-    logger.error(f"Error del bot: {context.error}", exc_info=context.error)
+    logger.error("Error del bot: %s", context.error, exc_info=context.error)
     
     if update and update.effective_message:
         await update.effective_message.reply_text(
@@ -174,31 +308,111 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def initialize_services():
     """
-    Inicializa todos los servicios necesarios
+    Inicializa los servicios necesarios en etapas
+    
+    Antes de recibir updates solo se conecta la base de datos y se crean los servicios
+    livianos: las consultas directas (plantillas SQL) y el chat responden de inmediato.
+    Los índices de la base de datos, el SQL Agent de LangChain y el cliente de OpenAI se
+    construyen en segundo plano; las preguntas que necesitan el agente esperan a que esté listo.
     """
-    global db, groq_service, sales_agent, assistant
+    global db, groq_service, sales_agent, assistant, scheduler, metrics_server
     
     logger.info("🚀 Iniciando servicios...")
     
     # 1. Inicializar base de datos
     logger.info("1️⃣ Inicializando base de datos...")
-    db = NeonDatabase()
-    await db.initialize()
+    with startup.phase("base de datos"):
+        db = NeonDatabase()
+        await db.initialize(build_indexes=False)
     
-    # 2. Inicializar servicio de Groq
-    logger.info("2️⃣ Inicializando servicio Groq...")
-    groq_service = GroqService()
+    with startup.phase("servicios"):
+        # 2. Servicio de Groq (el cliente de OpenAI se crea en segundo plano)
+        logger.info("2️⃣ Inicializando servicio Groq...")
+        groq_service = get_groq_service()
+        
+        # 3. SQL Agent: plantillas y cachés ahora, LangChain en segundo plano
+        # con la caché de respuestas compartida entre workers si STATE_BACKEND está definido
+        logger.info("3️⃣ Inicializando SQL Agent con LangChain (en segundo plano)...")
+        state = create_state_backend(db)
+        sales_agent = SalesAgent(db, state=state)
+        
+        # 4. Inicializar asistente híbrido
+        logger.info("4️⃣ Inicializando asistente híbrido...")
+        assistant = HybridAssistant(sales_agent, groq_service)
+        
+        # 5. Planificador justo de mensajes por usuario
+        logger.info("5️⃣ Inicializando planificador de mensajes...")
+        scheduler = FairScheduler()
     
-    # 3. Inicializar SQL Agent (se ejecuta en un thread separado para evitar conflictos)
-    logger.info("3️⃣ Inicializando SQL Agent con LangChain...")
-    loop = asyncio.get_event_loop()
-    sales_agent = await loop.run_in_executor(None, SalesAgent)
+    # 6. Metadatos de las tablas permitidas (/schema y sql_db_schema del agente);
+    # el agente se construye después para limitarse a las tablas existentes
+    with startup.phase("esquema"):
+        try:
+            await sales_agent.schema.refresh()
+        except Exception as e:
+            logger.warning("⚠️ No se pudo cargar el esquema, se reintentará al usarlo: %s", e)
     
-    # 4. Inicializar asistente híbrido
-    logger.info("4️⃣ Inicializando asistente híbrido...")
-    assistant = HybridAssistant(sales_agent, groq_service)
+    # 7. Endpoint de métricas (METRICS_PORT)
+    with startup.phase("métricas"):
+        register_pool_gauges(db)
+        register_agent_gauges(sales_agent.runner)
+        register_scheduler_gauges(scheduler)
+        metrics_server = await start_metrics_server()
     
-    logger.info("✅ Todos los servicios iniciados correctamente")
+    # Etapa en segundo plano: lo que no hace falta para el primer mensaje
+    # (mientras se crean los índices las consultas funcionan igual, más lentas)
+    startup.track("índices", db.start_index_build())
+    startup.track("cliente LLM", asyncio.ensure_future(groq_service.preload()))
+    startup.track("SQL Agent", sales_agent.start_build())
+    
+    logger.info("✅ Servicios iniciados (SQL Agent construyéndose en segundo plano)")
+
+
+async def shutdown_services():
+    """
+    Libera los recursos de los servicios
+    """
+    if metrics_server is not None:
+        metrics_server.close()
+    await scheduler.close()
+    await groq_service.close()
+    if sales_agent.state is not None:
+        await sales_agent.state.close()
+    await db.close()
+    sales_agent.runner.shutdown()
+
+
+def build_application(token: str, updater: bool = True):
+    """
+    Crea la aplicación de Telegram con todos los handlers registrados
+    
+    Los servicios se inicializan en post_init y se liberan en post_shutdown, de modo
+    que el mismo armado sirve para el proceso único y para los workers de src/cluster.py
+    
+    Args:
+        token: Token del bot
+        updater: False si los updates llegan desde otro proceso (modo multi-worker)
+    """
+    app = application_builder(token, updater=updater).build()
+    app.post_init = lambda application: initialize_services()
+    app.post_shutdown = lambda application: shutdown_services()
+    
+    # Registrar comandos
+    app.add_handler(CommandHandler("start", start_command))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("schema", schema_command))
+    app.add_handler(CommandHandler("cache", cache_command))
+    app.add_handler(CommandHandler("explain", explain_command))
+    app.add_handler(CommandHandler("queue", queue_command))
+    app.add_handler(CommandHandler("profile", profile_command))
+    
+    # Registrar handler de mensajes
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    # Registrar handler de errores
+    app.add_error_handler(error_handler)
+    return app
 
 
 async def main():
@@ -215,39 +429,35 @@ async def main():
         logger.error("❌ TELEGRAM_TOKEN no está configurado")
         return
     
+    # Crear aplicación de Telegram
+    logger.info("🔧 Configurando handlers del bot...")
+    app = build_application(token)
+    
     # Inicializar servicios
     try:
-        await initialize_services()
+        await app.post_init(app)
     except Exception as e:
-        logger.error(f"❌ Error al inicializar servicios: {e}", exc_info=True)
+        logger.error("❌ Error al inicializar servicios: %s", e, exc_info=True)
         return
     
-    # Crear aplicación de Telegram
-    logger.info("🔧 Configurando handlers del bot...")
-    app = Application.builder().token(token).build()
-    
-    # Registrar comandos
-    app.add_handler(CommandHandler("start", start_command))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("stats", stats_command))
-    app.add_handler(CommandHandler("schema", schema_command))
-    
-    # Registrar handler de mensajes
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    
-    # Registrar handler de errores
-    app.add_error_handler(error_handler)
-    
     # Iniciar bot
-    logger.info("🚀 Bot iniciado y escuchando mensajes...")
-    logger.info("Presiona Ctrl+C para detener el bot")
-    logger.info("=" * 60)
-    
     # Usar initialize y start en lugar de run_polling para evitar conflictos de event loop
     async with app:
         await app.initialize()
         await app.start()
-        await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        if webhook_enabled():
+            # Servidor HTTP embebido que recibe los updates de Telegram
+            await app.updater.start_webhook(
+                allowed_updates=Update.ALL_TYPES,
+                **webhook_options("sales"),
+            )
+        else:
+            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        
+        startup.ready()
+        logger.info("🚀 Bot iniciado y escuchando mensajes...")
+        logger.info("Presiona Ctrl+C para detener el bot")
+        logger.info("=" * 60)
         
         # Mantener el bot corriendo
         try:
@@ -258,6 +468,7 @@ async def main():
             await app.updater.stop()
             await app.stop()
             await app.shutdown()
+            await app.post_shutdown(app)
 
 
 if __name__ == "__main__":
@@ -277,4 +488,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("\n👋 Bot detenido por el usuario")
     except Exception as e:
-        logger.error(f"❌ Error fatal: {e}", exc_info=True)
+        logger.error("❌ Error fatal: %s", e, exc_info=True)
@@ -1,30 +1,43 @@
-from openai import OpenAI
+import httpx
 import os
+import asyncio
+import importlib
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
 
+from servicio.prompt import PromptBuilder, count_tokens
+from src.metrics import LLM_REQUEST_SECONDS, LLM_TOKENS_TOTAL
+from src.tracing import span, current_span
+from src.logs import content, SAMPLED
+
 load_dotenv()
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 class GroqService:
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.environ.get("GROQ_API_KEY"),
-            base_url="https://api.groq.com/openai/v1"
+        # Límites configurables del cliente HTTP y de concurrencia
+        self.timeout = float(os.environ.get("GROQ_TIMEOUT", "30"))
+        self.max_concurrency = int(os.environ.get("GROQ_MAX_CONCURRENCY", "8"))
+        max_connections = int(os.environ.get("GROQ_MAX_CONNECTIONS", "20"))
+        max_keepalive = int(os.environ.get("GROQ_MAX_KEEPALIVE", "10"))
+        
+        # Pool HTTP compartido con conexiones keep-alive (una sola instancia por proceso)
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
         )
+        # Cliente de OpenAI: se crea en el primer uso (importar openai es lento)
+        self._client = None
         self.model = os.environ.get("MODEL_ID", "openai/gpt-oss-20b")
         
+        # Límite de llamadas simultáneas al LLM
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
         # System prompt que define el comportamiento del asistente
         self.system_prompt = """Eres un asistente virtual inteligente de una empresa de ventas. 
 
@@ -47,66 +60,172 @@ Cuando respondas:
 - Sé específico y basado en datos reales
 - Ofrece ayuda adicional cuando sea apropiado
 - Mantén las respuestas relevantes y al punto"""
+        
+        # Armado del prompt con presupuesto de tokens (PROMPT_TOKEN_BUDGET)
+        self.prompt_builder = PromptBuilder(self.system_prompt)
     
-    async def get_chat_response(self, user_message: str, conversation_history: list = None, faq_context: dict = None) -> str:
+    async def get_chat_response(self, user_message: str, conversation_history: list = None, faq_context: dict = None, timeout: float = None) -> str:
         """
-        Obtiene una respuesta del modelo de Groq
+        Obtiene una respuesta del modelo de Groq sin bloquear el event loop
         
         Args:
             user_message: El mensaje del usuario
             conversation_history: Historial de la conversación (opcional)
             faq_context: Contexto de preguntas frecuentes de la base de datos (opcional)
+            timeout: Timeout en segundos para esta llamada (opcional, por defecto GROQ_TIMEOUT)
         
         Returns:
             La respuesta del modelo
         """
         start_time = datetime.now()
-        logger.info(f"🔵 Nueva consulta LLM iniciada")
-        logger.info(f"📝 Mensaje usuario: {user_message[:100]}...")
+        logger.info("🔵 Nueva consulta LLM: %s", content(user_message), extra=SAMPLED)
         
+        outcome = 'ok'
         try:
-            # Iniciar con el system prompt
-            messages = [{"role": "system", "content": self.system_prompt}]
-            logger.debug(f"✅ System prompt agregado")
-            
-            # Agregar contexto de FAQs si está disponible
-            if faq_context:
-                context_message = self._build_faq_context_message(faq_context)
-                if context_message:
-                    messages.append({"role": "system", "content": context_message})
-                    logger.info(f"📚 Contexto FAQ agregado: {len(context_message)} caracteres")
-            
-            # Agregar historial de conversación
-            if conversation_history:
-                messages.extend(conversation_history)
-                logger.info(f"💬 Historial agregado: {len(conversation_history)} mensajes")
+            messages, prompt_tokens = self._build_messages(user_message, conversation_history, faq_context)
             
-            # Agregar mensaje actual del usuario
-            messages.append({"role": "user", "content": user_message})
+            logger.debug("🚀 Enviando %d mensajes al LLM (modelo: %s)", len(messages), self.model)
             
-            logger.info(f"🚀 Enviando {len(messages)} mensajes al LLM (modelo: {self.model})")
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.5,
-                max_tokens=1024,
-            )
+            call_timeout = timeout or self.timeout
+            with span("llm.chat", model=self.model):
+                async with self._semaphore:
+                    response = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            temperature=0.5,
+                            max_tokens=1024,
+                            timeout=call_timeout,
+                        ),
+                        timeout=call_timeout,
+                    )
             
             response_text = response.choices[0].message.content
             elapsed_time = (datetime.now() - start_time).total_seconds()
             
-            logger.info(f"✅ Respuesta LLM recibida en {elapsed_time:.2f}s")
-            logger.info(f"📤 Respuesta ({len(response_text)} caracteres): {response_text[:100]}...")
+            # Tokens reportados por la API (o estimados si no vienen en la respuesta)
+            usage = getattr(response, 'usage', None)
+            LLM_TOKENS_TOTAL.inc(getattr(usage, 'prompt_tokens', None) or prompt_tokens, kind='prompt')
+            LLM_TOKENS_TOTAL.inc(getattr(usage, 'completion_tokens', None) or count_tokens(response_text or ''), kind='completion')
+            
+            logger.info("✅ Respuesta LLM en %.2fs: %s", elapsed_time, content(response_text), extra=SAMPLED)
             
             return response_text
             
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            elapsed_time = (datetime.now() - start_time).total_seconds()
+            logger.error("⏱️ Timeout al obtener respuesta de Groq después de %.2fs", elapsed_time)
+            return "Lo siento, el servicio tardó demasiado en responder. Por favor, intenta de nuevo."
+            
         except Exception as e:
+            outcome = 'error'
             elapsed_time = (datetime.now() - start_time).total_seconds()
-            logger.error(f"❌ Error al obtener respuesta de Groq después de {elapsed_time:.2f}s: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.error("❌ Error al obtener respuesta de Groq después de %.2fs: %s", elapsed_time, e, exc_info=True)
             return "Lo siento, ocurrió un error al procesar tu mensaje."
+        
+        finally:
+            LLM_REQUEST_SECONDS.observe(
+                (datetime.now() - start_time).total_seconds(), call='chat', outcome=outcome
+            )
+    
+    async def stream_chat_response(self, user_message: str, conversation_history: list = None, faq_context: dict = None, timeout: float = None):
+        """
+        Obtiene la respuesta del modelo de Groq en modo streaming
+        
+        Args:
+            user_message: El mensaje del usuario
+            conversation_history: Historial de la conversación (opcional)
+            faq_context: Contexto de preguntas frecuentes de la base de datos (opcional)
+            timeout: Timeout en segundos para abrir el stream (opcional)
+        
+        Yields:
+            Fragmentos de texto a medida que llegan los tokens
+        """
+        start_time = datetime.now()
+        logger.info("🔵 Nueva consulta LLM (streaming): %s", content(user_message), extra=SAMPLED)
+        
+        messages, prompt_tokens = self._build_messages(user_message, conversation_history, faq_context)
+        call_timeout = timeout or self.timeout
+        total_chars = 0
+        first_token_time = None
+        completion = []
+        outcome = 'error'
+        # Span sin activar en el contexto: el generador cede el control entre fragmentos
+        parent = current_span()
+        stream_span = parent.child("llm.stream", model=self.model) if parent else None
+        error = None
+        
+        try:
+            async with self._semaphore:
+                stream = await asyncio.wait_for(
+                    self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.5,
+                        max_tokens=1024,
+                        stream=True,
+                        timeout=call_timeout,
+                    ),
+                    timeout=call_timeout,
+                )
+                try:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not delta:
+                            continue
+                        if first_token_time is None:
+                            first_token_time = (datetime.now() - start_time).total_seconds()
+                            logger.info("⚡ Primer token recibido en %.2fs", first_token_time, extra=SAMPLED)
+                        total_chars += len(delta)
+                        completion.append(delta)
+                        yield delta
+                finally:
+                    await stream.close()
+            outcome = 'ok'
+        except asyncio.TimeoutError as e:
+            outcome = 'timeout'
+            error = e
+            raise
+        finally:
+            if stream_span is not None:
+                stream_span.finish(error)
+            # En streaming la API no informa el uso: los tokens se estiman
+            LLM_REQUEST_SECONDS.observe(
+                (datetime.now() - start_time).total_seconds(), call='stream', outcome=outcome
+            )
+            LLM_TOKENS_TOTAL.inc(prompt_tokens, kind='prompt')
+            LLM_TOKENS_TOTAL.inc(count_tokens(''.join(completion)), kind='completion')
+        
+        elapsed_time = (datetime.now() - start_time).total_seconds()
+        logger.info("✅ Streaming LLM completado en %.2fs (%d caracteres)", elapsed_time, total_chars, extra=SAMPLED)
+    
+    def _build_messages(self, user_message: str, conversation_history: list = None, faq_context: dict = None) -> tuple:
+        """
+        Construye la lista de mensajes a enviar al LLM dentro del presupuesto de tokens
+        
+        Returns:
+            (mensajes, tokens del prompt)
+        """
+        context_message = None
+        if faq_context:
+            context_message = self._build_faq_context_message(faq_context) or None
+        
+        messages, total_tokens = self.prompt_builder.build(
+            user_message,
+            history=conversation_history,
+            context_message=context_message,
+        )
+        
+        history_count = len(conversation_history or [])
+        kept_history = sum(1 for m in messages[1:-1] if m['role'] != 'system')
+        logger.debug(
+            "🧮 Prompt: %d tokens (presupuesto %d), historial %d/%d mensajes",
+            total_tokens, self.prompt_builder.budget, kept_history, history_count
+        )
+        return messages, total_tokens
     
     def _build_faq_context_message(self, faq_context: dict) -> str:
         """
@@ -134,6 +253,46 @@ Cuando respondas:
             return "\n".join(context_parts)
         
         return ""
+    
+    @property
+    def client(self):
+        """Cliente AsyncOpenAI sobre el pool HTTP compartido"""
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(
+                api_key=os.environ.get("GROQ_API_KEY"),
+                # Endpoint compatible con OpenAI (LLM_BASE_URL permite usar benchmarks/llm_stub.py)
+                base_url=os.environ.get("LLM_BASE_URL", "https://api.groq.com/openai/v1"),
+                http_client=self.http_client,
+                max_retries=1,
+            )
+        return self._client
+    
+    @client.setter
+    def client(self, value):
+        self._client = value
+    
+    async def preload(self):
+        """
+        Importa openai en un hilo y crea el cliente, para que la primera
+        respuesta no pague la importación en el event loop
+        """
+        await asyncio.to_thread(importlib.import_module, "openai")
+        return self.client
+    
+    async def close(self):
+        """Cierra el pool de conexiones HTTP"""
+        if self._client is not None:
+            await self._client.close()
+        await self.http_client.aclose()
+
+# Instancia compartida del servicio (se crea en el primer uso)
+_groq_service = None
+
 
-# Instancia global del servicio
-groq_service = GroqService()
+def get_groq_service() -> GroqService:
+    """Devuelve la instancia compartida de GroqService, creándola si no existe"""
+    global _groq_service
+    if _groq_service is None:
+        _groq_service = GroqService()
+    return _groq_service
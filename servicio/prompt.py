@@ -0,0 +1,122 @@
+"""
+Armado del prompt del LLM dentro de un presupuesto de tokens
+"""
+import os
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken es opcional: sin él se usa una estimación por caracteres
+    _ENCODING = None
+
+# Tokens extra que agrega el formato chat por cada mensaje (rol, separadores)
+MESSAGE_OVERHEAD = 4
+
+# Mensajes de historial recientes que se intentan conservar antes de recortar el contexto FAQ
+MIN_HISTORY_MESSAGES = 2
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cuenta (o estima, sin tiktoken) los tokens de un texto
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    # Aproximación para español: ~4 caracteres por token
+    return (len(text) + 3) // 4
+
+
+@lru_cache(maxsize=32)
+def count_tokens_cached(text: str) -> int:
+    """
+    Igual que count_tokens pero cacheado, para textos estáticos (system prompt)
+    """
+    return count_tokens(text)
+
+
+def message_tokens(message: dict) -> int:
+    """Tokens de un mensaje del formato chat"""
+    return count_tokens(message.get('content') or '') + MESSAGE_OVERHEAD
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Recorta un texto para que no supere max_tokens
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(text)[:max_tokens]) + "…"
+    return text[:max_tokens * 4] + "…"
+
+
+class PromptBuilder:
+    """
+    Construye la lista de mensajes respetando un presupuesto de tokens.
+    
+    Orden de recorte (de menor a mayor valor):
+    1. Mensajes más antiguos del historial (conservando el último intercambio)
+    2. Contexto de FAQs (se recorta y luego se elimina)
+    3. El resto del historial
+    4. El mensaje del usuario (se trunca como último recurso)
+    """
+    
+    def __init__(self, system_prompt: str, budget: int = None):
+        self.system_prompt = system_prompt
+        self.budget = budget or int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+    
+    def build(self, user_message: str, history: list = None, context_message: str = None):
+        """
+        Returns:
+            (messages, total_tokens)
+        """
+        system_tokens = count_tokens_cached(self.system_prompt) + MESSAGE_OVERHEAD
+        user_tokens = count_tokens(user_message) + MESSAGE_OVERHEAD
+        history = list(history or [])
+        history_tokens = [message_tokens(m) for m in history]
+        context_tokens = (count_tokens(context_message) + MESSAGE_OVERHEAD) if context_message else 0
+        
+        def total():
+            return system_tokens + user_tokens + context_tokens + sum(history_tokens)
+        
+        # 1. Quitar historial antiguo
+        while total() > self.budget and len(history) > MIN_HISTORY_MESSAGES:
+            history.pop(0)
+            history_tokens.pop(0)
+        
+        # 2. Recortar o eliminar el contexto FAQ
+        if context_message and total() > self.budget:
+            available = self.budget - (total() - context_tokens) - MESSAGE_OVERHEAD
+            if available > 50:
+                context_message = truncate_to_tokens(context_message, available)
+                context_tokens = count_tokens(context_message) + MESSAGE_OVERHEAD
+            else:
+                context_message = None
+                context_tokens = 0
+        
+        # 3. Quitar el resto del historial
+        while total() > self.budget and history:
+            history.pop(0)
+            history_tokens.pop(0)
+        
+        # 4. Truncar el mensaje del usuario
+        if total() > self.budget:
+            available = self.budget - system_tokens - MESSAGE_OVERHEAD
+            user_message = truncate_to_tokens(user_message, available)
+            user_tokens = count_tokens(user_message) + MESSAGE_OVERHEAD
+        
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if context_message:
+            messages.append({"role": "system", "content": context_message})
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_message})
+        return messages, total()
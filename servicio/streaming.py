@@ -0,0 +1,125 @@
+"""
+Envío progresivo de respuestas a Telegram editando un mensaje a medida que llegan tokens
+"""
+import os
+import time
+import logging
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Límite de caracteres por mensaje de Telegram
+TELEGRAM_MAX_LENGTH = 4096
+
+# Intervalo mínimo entre ediciones (Telegram limita ~1 edición/segundo por chat)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+
+# Caracteres nuevos mínimos antes de volver a editar
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "40"))
+
+PLACEHOLDER_TEXT = "✍️ ..."
+
+
+def streaming_enabled() -> bool:
+    """
+    Indica si el modo streaming está activado (variable STREAM_RESPONSES)
+    """
+    return os.getenv("STREAM_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+
+def _split_text(text: str, size: int = TELEGRAM_MAX_LENGTH) -> list:
+    """
+    Divide un texto en bloques que caben en un mensaje de Telegram
+    """
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+async def reply_streaming(message, chunks) -> str:
+    """
+    Envía un placeholder y lo edita progresivamente con los fragmentos recibidos
+    
+    Args:
+        message: Mensaje de Telegram al que se responde
+        chunks: Generador asíncrono de fragmentos de texto
+        
+    Returns:
+        El texto completo enviado
+    """
+    text = ""
+    sent_text = ""
+    placeholder = None
+    editing = True
+    last_edit = 0.0
+    
+    try:
+        placeholder = await message.reply_text(PLACEHOLDER_TEXT)
+    except TelegramError as e:
+        logger.warning("⚠️ No se pudo enviar el placeholder, se usará un solo mensaje: %s", e)
+    
+    try:
+        async for chunk in chunks:
+            text += chunk
+            if placeholder is None or not editing:
+                continue
+            
+            now = time.monotonic()
+            if (now - last_edit) < STREAM_EDIT_INTERVAL or (len(text) - len(sent_text)) < STREAM_MIN_CHARS:
+                continue
+            if len(text) > TELEGRAM_MAX_LENGTH:
+                # El resto se enviará al final en mensajes adicionales
+                continue
+            
+            try:
+                await placeholder.edit_text(text)
+                sent_text = text
+            except RetryAfter as e:
+                logger.warning("⏳ Límite de ediciones alcanzado, esperando %ss", e.retry_after)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    logger.warning("⚠️ Error al editar mensaje, se continúa sin streaming: %s", e)
+                    editing = False
+            last_edit = time.monotonic()
+    except Exception as e:
+        logger.error("❌ Error durante el streaming: %s", e, exc_info=True)
+        if not text:
+            if placeholder is not None:
+                try:
+                    await placeholder.delete()
+                except TelegramError:
+                    pass
+            raise
+    
+    if placeholder is not None and not editing:
+        # Fallback: eliminar el mensaje parcial y enviar todo en un solo mensaje
+        try:
+            await placeholder.delete()
+        except TelegramError:
+            pass
+        placeholder = None
+    
+    await _finalize(message, placeholder, text, sent_text)
+    return text
+
+
+async def _finalize(message, placeholder, text: str, sent_text: str):
+    """
+    Envía el texto final: edita el placeholder y manda el resto en mensajes nuevos
+    """
+    if not text:
+        text = "Lo siento, no pude generar una respuesta."
+    
+    parts = _split_text(text)
+    first, rest = parts[0], parts[1:]
+    
+    if placeholder is not None:
+        if first != sent_text:
+            try:
+                await placeholder.edit_text(first)
+            except TelegramError as e:
+                logger.warning("⚠️ No se pudo editar el mensaje final: %s", e)
+                await message.reply_text(first)
+    else:
+        await message.reply_text(first)
+    
+    for part in rest:
+        await message.reply_text(part)
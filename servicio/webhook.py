@@ -0,0 +1,156 @@
+"""
+Modo de recepción de updates: long polling (por defecto) o webhook con servidor HTTP embebido
+"""
+import os
+import time
+import asyncio
+import secrets
+import logging
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+from telegram.request import HTTPXRequest
+
+from src.metrics import TELEGRAM_SEND_SECONDS
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_enabled() -> bool:
+    """
+    Indica si el bot debe recibir updates por webhook (BOT_MODE=webhook)
+    """
+    return os.getenv("BOT_MODE", "polling").lower() == "webhook"
+
+
+class TimedRequest(HTTPXRequest):
+    """
+    Cliente HTTP de la Bot API que mide la latencia de cada llamada (sendMessage,
+    editMessageText, sendChatAction, ...)
+    """
+    
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            with span(f"telegram.{api_method}"):
+                result = await super().do_request(url, method, *args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            TELEGRAM_SEND_SECONDS.observe(
+                time.perf_counter() - start, method=api_method, outcome=outcome
+            )
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa en paralelo los updates de chats distintos y de a uno, en orden de
+    llegada, los de un mismo chat
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat -> [lock, updates en espera o en curso]
+        self._chats = {}
+    
+    @staticmethod
+    def _chat_key(update):
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return update.effective_user.id
+        return None
+    
+    async def do_process_update(self, update, coroutine):
+        key = self._chat_key(update)
+        if key is None:
+            await coroutine
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+
+def application_builder(token: str, updater: bool = True):
+    """
+    Builder de la aplicación de Telegram con updates concurrentes
+    
+    Si TELEGRAM_API_URL está definido, las llamadas a la Bot API se envían a esa URL
+    (por ejemplo, la API simulada de benchmarks/webhook_harness.py)
+    
+    Args:
+        token: Token del bot
+        updater: False para aplicaciones que reciben los updates de otro proceso
+                 (workers de src/cluster.py). En ese caso los updates de un mismo
+                 chat se procesan en el orden en que los reparte el frontal.
+    """
+    builder = Application.builder().token(token).request(
+        # Mismo tamaño de pool que usa python-telegram-bot por defecto para la Bot API
+        TimedRequest(connection_pool_size=int(os.getenv("TELEGRAM_POOL_SIZE", "256")))
+    )
+    if updater:
+        builder = builder.concurrent_updates(True)
+    else:
+        builder = builder.updater(None).concurrent_updates(
+            ChatOrderedUpdateProcessor(int(os.getenv("WORKER_CONCURRENT_UPDATES", "256")))
+        )
+    api_url = os.getenv("TELEGRAM_API_URL")
+    if api_url:
+        logger.info("🔁 Bot API redirigida a %s", api_url)
+        builder = builder.base_url(api_url)
+    return builder
+
+
+def webhook_options(default_path: str) -> dict:
+    """
+    Parámetros para Updater.start_webhook / Application.run_webhook
+    
+    Args:
+        default_path: Ruta del webhook si WEBHOOK_PATH no está definido
+                      (permite servir varios bots detrás del mismo host)
+    
+    Returns:
+        Diccionario con listen, port, url_path, webhook_url, secret_token y max_connections
+    """
+    # WEBHOOK_PATH vacío (como en .env.example) equivale a no definido
+    url_path = (os.getenv("WEBHOOK_PATH") or default_path).strip("/")
+    
+    # Telegram envía el secreto en la cabecera X-Telegram-Bot-Api-Secret-Token;
+    # los updates sin él se rechazan con 403
+    secret_token = os.getenv("WEBHOOK_SECRET")
+    if not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("⚠️ WEBHOOK_SECRET no configurado, se generó un secreto aleatorio")
+    
+    public_url = os.getenv("WEBHOOK_URL")
+    webhook_url = f"{public_url.rstrip('/')}/{url_path}" if public_url else None
+    if not webhook_url:
+        logger.warning("⚠️ WEBHOOK_URL no configurado, se registrará la dirección local de escucha")
+    
+    options = {
+        'listen': os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        'port': int(os.getenv("WEBHOOK_PORT", "8443")),
+        'url_path': url_path,
+        'webhook_url': webhook_url,
+        'secret_token': secret_token,
+        'max_connections': int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+    }
+    logger.info("🌐 Webhook escuchando en %s:%s/%s", options['listen'], options['port'], url_path)
+    return options
@@ -0,0 +1,114 @@
+"""
+Clases de LangChain del SQL Agent (herramientas asíncronas y trazas)
+
+Se importan solo al construir el agente: LangChain tarda varios segundos en
+cargarse y no se necesita para las consultas directas ni el chat.
+"""
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import InfoSQLDatabaseTool, QuerySQLDataBaseTool
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class AsyncQuerySQLTool(QuerySQLDataBaseTool):
+    """
+    Herramienta sql_db_query con ejecución asíncrona sobre el pool asyncpg
+    (transacción de solo lectura), para que la corrida del agente sea cancelable
+    """
+    
+    database: object = None
+    
+    async def _arun(self, query: str, run_manager=None) -> str:
+        try:
+            rows = await self.database.fetch_readonly(query)
+            return str([tuple(row.values()) for row in rows])
+        except Exception as e:
+            return f"Error: {e}"
+
+
+class CachedInfoSQLTool(InfoSQLDatabaseTool):
+    """
+    Herramienta sql_db_schema que responde desde la caché de esquema
+    (database/schema.py) en lugar de reflejar tablas y leer filas en cada corrida
+    """
+    
+    schema: object = None
+    
+    @staticmethod
+    def _names(table_names: str) -> list:
+        return [name.strip() for name in table_names.split(",") if name.strip()]
+    
+    def _run(self, table_names: str, run_manager=None) -> str:
+        # Corridas síncronas (en un hilo): solo lo ya cargado, sin tocar el event loop
+        try:
+            return self.schema.cached_info(self._names(table_names))
+        except Exception as e:
+            return f"Error: {e}"
+    
+    async def _arun(self, table_names: str, run_manager=None) -> str:
+        try:
+            return await self.schema.get(self._names(table_names))
+        except Exception as e:
+            return f"Error: {e}"
+
+
+class AsyncSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """
+    Toolkit que reemplaza sql_db_query por su versión asíncrona y sql_db_schema
+    por la versión con caché
+    """
+    
+    database: object = None
+    schema: object = None
+    
+    def get_tools(self):
+        tools = []
+        for tool in super().get_tools():
+            if isinstance(tool, QuerySQLDataBaseTool):
+                tool = AsyncQuerySQLTool(db=self.db, database=self.database, description=tool.description)
+            elif isinstance(tool, InfoSQLDatabaseTool) and self.schema is not None:
+                tool = CachedInfoSQLTool(db=self.db, schema=self.schema, description=tool.description)
+            tools.append(tool)
+        return tools
+
+
+class AgentTraceHandler(BaseCallbackHandler):
+    """
+    Registra cada llamada al LLM y a las herramientas del agente como spans hijos
+    
+    El span padre se guarda explícitamente porque las corridas síncronas se
+    ejecutan en otro hilo, fuera del contexto de la petición.
+    """
+    
+    def __init__(self, parent):
+        self.parent = parent
+        self.spans = {}
+    
+    def _open(self, run_id, name: str):
+        if self.parent is not None:
+            self.spans[run_id] = self.parent.child(name)
+    
+    def _close(self, run_id, error=None):
+        child = self.spans.pop(run_id, None)
+        if child is not None:
+            child.finish(error)
+    
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._open(run_id, "agent.llm")
+    
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._open(run_id, "agent.llm")
+    
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._close(run_id)
+    
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._close(run_id, error)
+    
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._open(run_id, f"agent.tool.{(serialized or {}).get('name', 'tool')}")
+    
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._close(run_id)
+    
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._close(run_id, error)
@@ -0,0 +1,126 @@
+"""
+Caché de respuestas del agente de ventas con expulsión LRU/TTL
+"""
+import os
+import re
+import time
+import unicodedata
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Números escritos en palabras que se normalizan a dígitos
+NUMBER_WORDS = {
+    'un': '1', 'uno': '1', 'una': '1', 'dos': '2', 'tres': '3', 'cuatro': '4',
+    'cinco': '5', 'seis': '6', 'siete': '7', 'ocho': '8', 'nueve': '9',
+    'diez': '10', 'once': '11', 'doce': '12', 'quince': '15', 'veinte': '20',
+    'treinta': '30', 'cincuenta': '50', 'cien': '100',
+}
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def strip_accents(text: str) -> str:
+    """
+    Elimina tildes y diacríticos (á -> a, ñ -> n)
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normaliza una pregunta para usarla como clave de caché
+    
+    Convierte a minúsculas, elimina tildes, signos de puntuación y espacios
+    repetidos, y reemplaza números escritos en palabras por dígitos.
+    """
+    text = strip_accents(question.lower())
+    text = _PUNCTUATION_RE.sub(' ', text)
+    words = [NUMBER_WORDS.get(word, word) for word in _SPACES_RE.split(text) if word]
+    return ' '.join(words)
+
+
+class AnswerCache:
+    """
+    Caché LRU con TTL para respuestas, invalidada cuando cambia la marca de datos
+    (watermark) de la tabla invoices.
+    """
+    
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size or int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("ANSWER_CACHE_TTL", "600"))
+        self._entries = OrderedDict()
+        self._watermark = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+    
+    @property
+    def watermark(self):
+        """Marca de datos de invoices con la que se generaron las respuestas actuales"""
+        return self._watermark
+    
+    def check_watermark(self, watermark):
+        """
+        Vacía la caché si la marca de datos cambió desde la última consulta
+        """
+        if watermark != self._watermark:
+            if self._entries:
+                logger.info("♻️ Datos de invoices cambiaron, invalidando %s respuestas en caché", len(self._entries))
+                self.invalidations += 1
+            self._entries.clear()
+            self._watermark = watermark
+    
+    def get(self, key: str):
+        """
+        Devuelve la respuesta cacheada o None si no existe o expiró
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        answer, stored_at, cost = entry
+        if self.ttl and (time.monotonic() - stored_at) > self.ttl:
+            del self._entries[key]
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += cost
+        return answer
+    
+    def set(self, key: str, answer: str, cost: float = 0.0):
+        """
+        Guarda una respuesta junto con el tiempo que costó generarla
+        """
+        self._entries[key] = (answer, time.monotonic(), cost)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        """Vacía la caché"""
+        self._entries.clear()
+    
+    def stats(self) -> dict:
+        """
+        Contadores de uso de la caché
+        """
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total) if total else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'saved_seconds': round(self.saved_seconds, 2),
+        }
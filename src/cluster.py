@@ -0,0 +1,234 @@
+"""
+Modo multi-worker: un proceso frontal recibe los updates de Telegram y los reparte
+entre N procesos worker por hash consistente del chat_id
+
+Todos los updates de un mismo chat llegan siempre al mismo worker y en orden, por lo
+que el historial en memoria de cada chat vive en un solo proceso. El estado que debe
+sobrevivir a cambios en el número de workers (historial, caché de respuestas) se
+guarda en el backend compartido de src/state.py (STATE_BACKEND=sqlite|postgres).
+
+Uso:
+    python -m src.cluster sales --workers 4
+    python -m src.cluster chat --workers 2
+"""
+import os
+import sys
+import signal
+import asyncio
+import hashlib
+import logging
+import argparse
+import importlib
+import multiprocessing
+from bisect import bisect
+
+from dotenv import load_dotenv
+from telegram import Update
+from telegram.ext import TypeHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from servicio.webhook import application_builder, webhook_enabled, webhook_options
+from src.logs import setup_logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Bot -> (módulo con build_application, variable de entorno del token, ruta del webhook)
+BOTS = {
+    'sales': ('main', 'TELEGRAM_TOKEN', 'sales'),
+    'chat': ('chat.main', 'TOKEN_TELEGRAM', 'chat'),
+}
+
+# Segundos entre revisiones de workers caídos
+MONITOR_INTERVAL = 5.0
+
+
+class HashRing:
+    """
+    Anillo de hash consistente con nodos virtuales
+    
+    Al cambiar el número de workers solo se reasigna ~1/N de los chats.
+    """
+    
+    def __init__(self, nodes: int, replicas: int = 64):
+        self._ring = sorted(
+            (self._hash(f"worker-{node}-{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in self._ring]
+    
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+    
+    def node_for(self, key) -> int:
+        """Worker responsable de la clave"""
+        index = bisect(self._keys, self._hash(str(key))) % len(self._keys)
+        return self._ring[index][1]
+
+
+def routing_key(update: Update):
+    """
+    Clave de reparto de un update: el chat, o el usuario/update si no hay chat
+    """
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
+def _worker_main(bot: str, index: int, queue):
+    """Punto de entrada del proceso worker"""
+    # Ctrl+C llega a todo el grupo de procesos: el frontal coordina el cierre
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Cada worker expone sus métricas en METRICS_PORT + 1 + índice
+    if int(os.getenv("METRICS_PORT", "0")):
+        os.environ["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + 1 + index)
+    # RotatingFileHandler no admite varios procesos sobre el mismo archivo
+    log_file = os.getenv("LOG_FILE", "bot.log")
+    if log_file:
+        root, ext = os.path.splitext(log_file)
+        os.environ["LOG_FILE"] = f"{root}.worker{index}{ext}"
+    asyncio.run(_run_worker(bot, index, queue))
+
+
+async def _run_worker(bot: str, index: int, queue):
+    """
+    Procesa los updates que el frontal envía por la cola del worker
+    """
+    module_name, token_env, _ = BOTS[bot]
+    module = importlib.import_module(module_name)
+    app = module.build_application(os.getenv(token_env), updater=False)
+    
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info("👷 Worker %s (%s) listo (pid %s)", index, bot, os.getpid())
+    
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await app.shutdown()
+        logger.info("👋 Worker %s detenido", index)
+
+
+class Cluster:
+    """
+    Proceso frontal: recibe updates (polling o webhook) y los reparte a los workers
+    """
+    
+    def __init__(self, bot: str, workers: int = None):
+        if bot not in BOTS:
+            raise ValueError(f"Bot desconocido: {bot} (opciones: {', '.join(BOTS)})")
+        self.bot = bot
+        self.workers = workers or int(os.getenv("BOT_WORKERS", "2"))
+        self.ring = HashRing(self.workers)
+        self._context = multiprocessing.get_context("spawn")
+        # Las colas sobreviven al reinicio de un worker: no se pierden updates pendientes
+        self._queues = [self._context.Queue() for _ in range(self.workers)]
+        self._processes = [None] * self.workers
+        self.routed = [0] * self.workers
+        self.restarts = 0
+    
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.bot, index, self._queues[index]),
+            name=f"{self.bot}-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+    
+    async def _route(self, update: Update, context):
+        index = self.ring.node_for(routing_key(update))
+        self._queues[index].put(update.to_dict())
+        self.routed[index] += 1
+    
+    async def _monitor(self):
+        """Reinicia los workers que terminaron inesperadamente"""
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.warning("⚠️ Worker %s terminó (código %s), reiniciando", index, process.exitcode)
+                    self.restarts += 1
+                    self._start_worker(index)
+    
+    def stats(self) -> dict:
+        """Updates repartidos por worker y reinicios"""
+        return {
+            'workers': self.workers,
+            'routed': list(self.routed),
+            'alive': sum(1 for p in self._processes if p is not None and p.is_alive()),
+            'restarts': self.restarts,
+        }
+    
+    async def run(self):
+        _, token_env, webhook_path = BOTS[self.bot]
+        token = os.getenv(token_env)
+        if not token:
+            logger.error("❌ %s no está configurado", token_env)
+            return
+        
+        for index in range(self.workers):
+            self._start_worker(index)
+        logger.info("🧩 %s workers iniciados para el bot '%s'", self.workers, self.bot)
+        
+        app = application_builder(token).build()
+        app.add_handler(TypeHandler(Update, self._route))
+        
+        async with app:
+            await app.start()
+            if webhook_enabled():
+                await app.updater.start_webhook(
+                    allowed_updates=Update.ALL_TYPES,
+                    **webhook_options(webhook_path),
+                )
+            else:
+                await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            
+            monitor = asyncio.create_task(self._monitor())
+            try:
+                await asyncio.Event().wait()
+            except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
+                logger.info("👋 Deteniendo cluster...")
+            finally:
+                monitor.cancel()
+                await app.updater.stop()
+                await app.stop()
+                for queue in self._queues:
+                    queue.put(None)
+                for process in self._processes:
+                    process.join(timeout=30)
+                logger.info("📊 Updates repartidos: %s", self.stats()['routed'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot de Telegram en modo multi-worker")
+    parser.add_argument("bot", choices=sorted(BOTS), help="Bot a ejecutar")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número de procesos worker (por defecto BOT_WORKERS)")
+    args = parser.parse_args()
+    
+    setup_logging()
+    try:
+        asyncio.run(Cluster(args.bot, args.workers).run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Ejecución del SQL Agent con límite de tiempo, cancelación y métricas
+"""
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import AGENT_RUN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class AgentRunner:
+    """
+    Ejecuta corridas del agente y mide cola, duración y timeouts.
+    
+    - run_async: corrida nativa asíncrona; al vencer el timeout la corrutina se
+      cancela de verdad (se abortan las llamadas al LLM y a la BD en curso).
+    - run_sync: respaldo en un pool de hilos dedicado y acotado; al vencer el
+      timeout se deja de esperar, y el hilo termina al cumplirse max_execution_time.
+    """
+    
+    def __init__(self, max_workers: int = None, timeout: float = None):
+        self.max_workers = max_workers or int(os.getenv("AGENT_MAX_WORKERS", "4"))
+        self.timeout = timeout or float(os.getenv("AGENT_TIMEOUT", "25"))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sql-agent")
+        
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+    
+    async def run_async(self, coroutine_factory):
+        """
+        Ejecuta la corrida asíncrona con timeout y cancelación
+        
+        Args:
+            coroutine_factory: Función sin argumentos que devuelve la corrutina a ejecutar
+        """
+        self.running += 1
+        start = time.monotonic()
+        outcome = 'ok'
+        try:
+            result = await asyncio.wait_for(coroutine_factory(), timeout=self.timeout)
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            outcome = 'timeout'
+            logger.warning("⏱️ Corrida del agente cancelada tras %ss", self.timeout)
+            raise
+        except Exception:
+            self.failures += 1
+            outcome = 'error'
+            raise
+        finally:
+            self.running -= 1
+            elapsed = time.monotonic() - start
+            self._record(elapsed)
+            AGENT_RUN_SECONDS.observe(elapsed, mode='async', outcome=outcome)
+    
+    async def run_sync(self, func):
+        """
+        Ejecuta una función bloqueante en el pool dedicado del agente
+        """
+        self.queued += 1
+        loop = asyncio.get_running_loop()
+        submitted = time.monotonic()
+        outcome = 'ok'
+        
+        def wrapped():
+            self.queued -= 1
+            self.running += 1
+            start = time.monotonic()
+            try:
+                return func()
+            finally:
+                self.running -= 1
+                self._record(time.monotonic() - start)
+        
+        try:
+            result = await asyncio.wait_for(loop.run_in_executor(self.executor, wrapped), timeout=self.timeout)
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            outcome = 'timeout'
+            logger.warning("⏱️ Corrida del agente sin respuesta tras %ss (el hilo sigue hasta su límite)", self.timeout)
+            raise
+        except Exception:
+            self.failures += 1
+            outcome = 'error'
+            raise
+        finally:
+            # Incluye la espera en la cola del pool
+            AGENT_RUN_SECONDS.observe(time.monotonic() - submitted, mode='sync', outcome=outcome)
+    
+    def _record(self, elapsed: float):
+        self.total_run_time += elapsed
+        self.max_run_time = max(self.max_run_time, elapsed)
+    
+    def stats(self) -> dict:
+        """
+        Profundidad de la cola y tiempos de corrida
+        """
+        finished = self.completed + self.failures + self.timeouts
+        return {
+            'queue_depth': self.queued,
+            'running': self.running,
+            'max_workers': self.max_workers,
+            'completed': self.completed,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'avg_run_time': round(self.total_run_time / finished, 2) if finished else 0.0,
+            'max_run_time': round(self.max_run_time, 2),
+        }
+    
+    def shutdown(self):
+        """Libera el pool de hilos"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
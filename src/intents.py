@@ -0,0 +1,265 @@
+"""
+Clasificador de intenciones compartido por los dos bots
+
+Todas las reglas se compilan una sola vez en una expresión regular con grupos
+nombrados. El texto se normaliza (minúsculas, sin tildes, números en palabras a
+dígitos) antes de clasificar, y además de la intención se extraen los
+parámetros (slots): límite, palabra clave, usuario y rango de fechas.
+"""
+import re
+import time
+import calendar
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from src.cache import NUMBER_WORDS, normalize_question, strip_accents
+from src.metrics import INTENT_SECONDS, INTENTS_TOTAL
+
+# Intenciones que se responden con datos de ventas
+INTENT_COUNT_INVOICES = 'count_invoices'
+INTENT_COUNT_CUSTOMERS = 'count_customers'
+INTENT_TOP_CUSTOMERS = 'top_customers'
+INTENT_RECENT_SALES = 'recent_sales'
+INTENT_SEARCH = 'search'
+INTENT_SALES_BY_DATE = 'sales_by_date'
+INTENT_STATS = 'stats'
+INTENT_DATA_QUERY = 'data_query'
+INTENT_CHAT = 'chat'
+
+DATA_INTENTS = {
+    INTENT_COUNT_INVOICES, INTENT_COUNT_CUSTOMERS, INTENT_TOP_CUSTOMERS,
+    INTENT_RECENT_SALES, INTENT_SEARCH, INTENT_SALES_BY_DATE, INTENT_STATS,
+    INTENT_DATA_QUERY,
+}
+
+_SALES = r'(?:ventas?|facturas?|registros|compras|pedidos)'
+_MONTH_NAMES = (
+    r'(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre'
+    r'|noviembre|diciembre)'
+)
+_YEAR = r'(?:19|20)\d{2}'
+_PERIOD = (
+    r'(?:hoy|ayer|esta semana|semana pasada|ultima semana|este mes|mes pasado|ultimo mes'
+    r'|este ano|ano pasado|ultimos? \d+ dias'
+    # Un solo mes ("en marzo", "de marzo 2024"); "enero y febrero" es una comparación
+    r'|(?:en|de) ' + _MONTH_NAMES + r'(?! (?:y|a|hasta|al?) (?:de )?' + _MONTH_NAMES + r')'
+    r'|(?:en|de|del ano) ' + _YEAR + r')'
+)
+
+# Reglas por intención, en orden de prioridad (la primera que coincide gana)
+_RULES = [
+    (INTENT_SEARCH, r'\b(?:busca|buscar|busque|encuentra|encontrar)\b|\bque contengan?\b'),
+    (INTENT_TOP_CUSTOMERS,
+     r'\b(?:top|mejor(?:es)?|principales)\s+(?:\d+\s+)?(?:clientes?|compradores)\b'
+     r'|\bclientes? con mas (?:ventas|compras|facturas)\b'
+     r'|\bquien(?:es)? (?:es|son|compro|compraron) (?:el|los)? ?(?:cliente|clientes|que mas)\b'
+     r'|\branking de clientes\b|\bclientes? (?:que mas|mas frecuentes?)\b'),
+    (INTENT_RECENT_SALES,
+     r'\b(?:ultim[oa]s|recientes?)\s+(?:\d+\s+)?(?:' + r'ventas?|facturas?|registros|compras|clientes' + r')\b'
+     r'|\b' + _SALES + r' (?:mas )?recientes\b|\bultimas \d+\b'),
+    (INTENT_COUNT_CUSTOMERS,
+     r'\b(?:cuantos|numero de|total de|cantidad de)\s+(?:\w+\s+)?clientes\b|\bclientes unicos\b|\btotal clientes\b'),
+    (INTENT_COUNT_INVOICES,
+     r'\b(?:cuantas|cuantos|numero de|total de|cantidad de)\s+(?:\w+\s+)?' + _SALES + r'\b'
+     r'|\btotal (?:de )?' + _SALES + r'\b'),
+    (INTENT_SALES_BY_DATE, r'\b' + _SALES + r'\b.*\b' + _PERIOD + r'\b|\b' + _PERIOD + r'\b.*\b' + _SALES + r'\b'),
+    (INTENT_STATS, r'\b(?:estadisticas?|resumen|metricas)\b'),
+    (INTENT_DATA_QUERY,
+     r'\b(?:cuant[oa]s?|promedio|lista|listar|muestra (?:las?|los|todas?|todos|\d+)|muestrame|mostrar'
+     r'|compara|comparar|suma|ranking'
+     r'|mayor|menor|dame|cual)\b.*\b(?:ventas?|facturas?|clientes?|compras|ingresos|pedidos)\b'
+     r'|\b(?:ventas?|facturas?|clientes?|compras|ingresos)\b.*\b(?:por (?:dia|mes|semana|hora)|promedio|total)\b'),
+]
+
+_PRIORITY = {intent: i for i, (intent, _) in enumerate(_RULES)}
+
+# Cada regla es un lookahead opcional: una sola pasada de match() indica todas las que coinciden
+_INTENT_RE = re.compile(''.join(f'(?:(?=.*?(?P<{intent}>{pattern}))|)' for intent, pattern in _RULES))
+
+_YEAR_RE = re.compile(r'\b(' + _YEAR + r')\b')
+# Los artículos "un/una" no son un límite ("dame una lista de clientes")
+_LIMIT_WORDS = {word: digits for word, digits in NUMBER_WORDS.items() if word not in ('un', 'una')}
+_WORD_RE = re.compile(r'\w+')
+_USERNAME_RE = re.compile(r'@(\w{3,32})')
+_QUOTED_RE = re.compile(r'["“”«»\']([^"“”«»\']{2,})["“”«»\']')
+_KEYWORD_RE = re.compile(
+    r'\b(?:busca|buscar|busque|encuentra|encontrar|contengan?|sobre|relacionad[oa]s? con)\s+(?P<rest>.+)$'
+)
+_KEYWORD_STOPWORDS = {
+    'las', 'los', 'la', 'el', 'de', 'del', 'que', 'con', 'en', 'a', 'sobre', 'texto', 'palabra',
+    'venta', 'ventas', 'factura', 'facturas', 'registros', 'compras', 'todas', 'todos',
+    'contengan', 'contenga', 'contienen', 'usuario', 'cliente', 'relacionadas', 'relacionados',
+    'me', 'por', 'favor', 'una', 'un',
+}
+_PUNCT_KEEP_ACCENTS_RE = re.compile(r'[^\w\s@]')
+
+_MONTHS = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+    'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+}
+_LAST_DAYS_RE = re.compile(r'\bultimos? (\d+) dias\b')
+_MONTH_RE = re.compile(r'\b(?:en|de) (' + '|'.join(_MONTHS) + r')(?: (?:de |del )?(' + _YEAR + r'))?\b')
+
+
+@dataclass
+class Intent:
+    """Resultado de la clasificación"""
+    name: str
+    text: str
+    message: str = ''
+    limit: int = None
+    keyword: str = None
+    username: str = None
+    date_range: tuple = None
+    matches: list = field(default_factory=list)
+    
+    @property
+    def is_data(self) -> bool:
+        """Indica si la intención se responde con datos de ventas"""
+        return self.name in DATA_INTENTS
+
+
+def _month_range(year: int, month: int):
+    last_day = calendar.monthrange(year, month)[1]
+    return date(year, month, 1), date(year, month, last_day)
+
+
+def parse_relative_dates(text: str, today: date = None):
+    """
+    Interpreta expresiones de fecha relativas en español
+    
+    Args:
+        text: Texto ya normalizado (minúsculas, sin tildes, números en dígitos)
+        today: Fecha de referencia (por defecto hoy)
+        
+    Returns:
+        (fecha_inicio, fecha_fin) ambas incluidas, o None si no hay fechas
+    """
+    today = today or date.today()
+    
+    match = _LAST_DAYS_RE.search(text)
+    if match:
+        days = max(int(match.group(1)), 1)
+        return today - timedelta(days=days - 1), today
+    if re.search(r'\bhoy\b', text):
+        return today, today
+    if re.search(r'\bayer\b', text):
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday
+    if 'semana pasada' in text:
+        monday = today - timedelta(days=today.weekday())
+        return monday - timedelta(days=7), monday - timedelta(days=1)
+    if 'ultima semana' in text:
+        return today - timedelta(days=6), today
+    if 'esta semana' in text or 'de la semana' in text:
+        return today - timedelta(days=today.weekday()), today
+    if 'mes pasado' in text:
+        first_this_month = today.replace(day=1)
+        last_prev = first_this_month - timedelta(days=1)
+        return _month_range(last_prev.year, last_prev.month)
+    if 'ultimo mes' in text:
+        return today - timedelta(days=29), today
+    if 'este mes' in text or re.search(r'\bdel mes\b', text):
+        return today.replace(day=1), today
+    if 'ano pasado' in text:
+        return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
+    if 'este ano' in text:
+        return date(today.year, 1, 1), today
+    
+    match = _MONTH_RE.search(text)
+    if match:
+        month = _MONTHS[match.group(1)]
+        if match.group(2):
+            year = int(match.group(2))
+        else:
+            # Un mes posterior al actual se refiere al año anterior
+            year = today.year if month <= today.month else today.year - 1
+        return _month_range(year, month)
+    
+    match = _YEAR_RE.search(text)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year, 12, 31)
+    
+    return None
+
+
+def is_year(value) -> bool:
+    """Indica si un número es un año (1900-2099) y no una cantidad"""
+    return value is not None and bool(_YEAR_RE.fullmatch(str(value)))
+
+
+def extract_limit(message: str):
+    """
+    Cantidad pedida en el mensaje original: el primer número escrito en dígitos o
+    en palabras, sin contar los artículos "un/una" ni los años
+    """
+    for word in _WORD_RE.findall(strip_accents(message.lower())):
+        value = _LIMIT_WORDS.get(word, word)
+        if value.isdigit() and len(value) <= 4 and not is_year(value):
+            return int(value)
+    return None
+
+
+def _extract_keyword(message: str):
+    """
+    Extrae la palabra clave de búsqueda conservando las tildes originales
+    """
+    quoted = _QUOTED_RE.search(message)
+    if quoted:
+        return quoted.group(1).strip()
+    
+    text = _PUNCT_KEEP_ACCENTS_RE.sub(' ', message.lower())
+    match = _KEYWORD_RE.search(text)
+    if not match:
+        return None
+    words = [w for w in match.group('rest').split() if w not in _KEYWORD_STOPWORDS and not w.startswith('@')]
+    return ' '.join(words[:3]) or None
+
+
+class IntentClassifier:
+    """
+    Clasificador de intenciones basado en una única expresión regular precompilada
+    """
+    
+    def classify(self, message: str, today: date = None) -> Intent:
+        """
+        Clasifica un mensaje y extrae sus parámetros
+        
+        Args:
+            message: Mensaje original del usuario
+            today: Fecha de referencia para las fechas relativas (opcional)
+        """
+        start = time.perf_counter()
+        intent = self._classify(message, today)
+        INTENT_SECONDS.observe(time.perf_counter() - start)
+        INTENTS_TOTAL.inc(intent=intent.name)
+        return intent
+    
+    def _classify(self, message: str, today: date = None) -> Intent:
+        text = normalize_question(message)
+        
+        groups = _INTENT_RE.match(text).groupdict()
+        matched = {intent for intent, value in groups.items() if value is not None}
+        name = min(matched, key=_PRIORITY.get) if matched else INTENT_CHAT
+        
+        intent = Intent(name=name, text=text, message=message, matches=sorted(matched, key=_PRIORITY.get))
+        if name == INTENT_CHAT:
+            return intent
+        
+        if not _LAST_DAYS_RE.search(text):
+            intent.limit = extract_limit(message)
+        
+        username = _USERNAME_RE.search(message)
+        if username:
+            intent.username = username.group(1)
+        
+        intent.date_range = parse_relative_dates(text, today)
+        if name == INTENT_SEARCH:
+            intent.keyword = _extract_keyword(message)
+        
+        return intent
+
+
+# Instancia compartida
+classifier = IntentClassifier()
@@ -0,0 +1,176 @@
+"""
+Configuración única de logging para ambos bots
+
+Los registros se encolan en el hilo que los emite (QueueHandler) y un hilo en
+segundo plano (QueueListener) los escribe en consola y en un archivo rotado por
+tamaño, de modo que el event loop nunca espera una escritura a disco. El archivo
+usa JSON por línea con el id de traza de la petición en curso.
+
+Los mensajes de los usuarios y las respuestas del modelo se registran con
+content(), que los recorta, resume o elimina según LOG_CONTENT; los registros de
+alto volumen marcados con extra=SAMPLED se muestrean con LOG_SAMPLE_RATE.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from src.tracing import current_trace_id
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'
+
+# Marca de registros de alto volumen (por mensaje) que pueden muestrearse
+SAMPLED = {'sampled': True}
+
+_listener = None
+
+
+class _Content:
+    """
+    Texto de usuario o del modelo que se procesa solo si el registro se emite
+    """
+    
+    __slots__ = ('text', 'limit')
+    
+    def __init__(self, text, limit: int = None):
+        self.text = text
+        self.limit = limit
+    
+    def __str__(self):
+        text = "" if self.text is None else str(self.text)
+        mode = os.getenv("LOG_CONTENT", "preview").lower()
+        if mode == "full":
+            return text
+        if mode == "none":
+            return f"<{len(text)} caracteres>"
+        if mode == "hash":
+            digest = hashlib.sha256(text.encode()).hexdigest()[:10]
+            return f"<{len(text)} caracteres sha256:{digest}>"
+        limit = self.limit or int(os.getenv("LOG_PREVIEW_CHARS", "80"))
+        return text if len(text) <= limit else text[:limit] + "…"
+
+
+def content(text, limit: int = None) -> _Content:
+    """
+    Contenido de mensajes para los logs según LOG_CONTENT:
+    full (completo), preview (recortado a LOG_PREVIEW_CHARS), hash (longitud y
+    huella, sin el texto) o none (solo longitud)
+    """
+    return _Content(text, limit)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Agrega el id de traza y descarta la fracción no muestreada de los registros
+    de alto volumen (nunca los WARNING o superiores)
+    """
+    
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (getattr(record, 'sampled', False) and record.levelno < logging.WARNING
+                and self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return False
+        record.trace_id = current_trace_id() or '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'trace_id': getattr(record, 'trace_id', '-'),
+            'process': record.process,
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Resuelve el mensaje en el hilo que registra (los argumentos pueden cambiar
+    después) y deja el formato final al hilo escritor
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(log_file: str = None):
+    """
+    Configura el logging del proceso una sola vez (llamadas siguientes no hacen nada)
+    
+    Variables: LOG_LEVEL, LOG_FILE (vacío desactiva el archivo), LOG_FORMAT
+    (json|text, formato del archivo), LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+    LOG_SAMPLE_RATE, LOG_CONTENT y LOG_PREVIEW_CHARS.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    
+    level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    log_file = log_file if log_file is not None else os.getenv("LOG_FILE", "bot.log")
+    
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+    
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+            backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+            encoding='utf-8',
+        )
+        if os.getenv("LOG_FORMAT", "json").lower() == "json":
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(file_handler)
+    
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(ContextFilter(float(os.getenv("LOG_SAMPLE_RATE", "1"))))
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    # Bibliotecas muy verbosas a nivel INFO (una línea por petición HTTP)
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(max(level, logging.WARNING))
+    
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Vacía la cola de registros y detiene el hilo escritor"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,265 @@
+"""
+Métricas en formato de texto de Prometheus (contadores, histogramas y gauges)
+servidas por un endpoint HTTP local (METRICS_PORT)
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import functools
+
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Límites de los buckets de latencia en segundos
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Counter:
+    """Contador monótono con etiquetas"""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, {}, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Histograma de latencias con buckets acumulativos y etiquetas"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por bucket, suma, total]
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+    
+    def time(self, **labels):
+        """Context manager que mide la duración del bloque"""
+        return _Timer(self, labels)
+    
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, {'le': repr(float(bound))}, bucket_count))
+                samples.append((f"{self.name}_bucket", key, {'le': '+Inf'}, count))
+                samples.append((f"{self.name}_sum", key, {}, total))
+                samples.append((f"{self.name}_count", key, {}, count))
+        return samples
+
+
+class Gauge:
+    """
+    Gauge calculado al momento de exportar: la función devuelve un número o un
+    diccionario {tupla de (etiqueta, valor): número}
+    """
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+    
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.debug("No se pudo calcular el gauge %s: %s", self.name, e)
+            return []
+        if isinstance(value, dict):
+            return [(self.name, key, {}, v) for key, v in value.items()]
+        return [(self.name, (), {}, value)]
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        labels = dict(self.labels)
+        labels.setdefault('outcome', 'error' if exc_type else 'ok')
+        self.histogram.observe(time.perf_counter() - self.start, **labels)
+        return False
+
+
+class Registry:
+    """Conjunto de métricas exportadas"""
+    
+    def __init__(self):
+        self._metrics = {}
+    
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation))
+    
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, buckets))
+    
+    def gauge(self, name: str, documentation: str, callback) -> Gauge:
+        # Se reemplaza: el objeto observado puede cambiar (p. ej. al reinicializar servicios)
+        gauge = self._metrics[name] = Gauge(name, documentation, callback)
+        return gauge
+    
+    def render(self) -> str:
+        """Exporta todas las métricas en formato de texto de Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Métricas de la aplicación
+INTENT_SECONDS = registry.histogram(
+    "bot_intent_classification_seconds", "Duración de la clasificación de intenciones",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01),
+)
+INTENTS_TOTAL = registry.counter("bot_intents_total", "Mensajes clasificados por intención")
+DB_QUERY_SECONDS = registry.histogram("bot_db_query_seconds", "Duración de los métodos de NeonDatabase")
+AGENT_RUN_SECONDS = registry.histogram("bot_agent_run_seconds", "Duración de las corridas del SQL Agent")
+LLM_REQUEST_SECONDS = registry.histogram("bot_llm_request_seconds", "Duración de las llamadas al LLM")
+LLM_TOKENS_TOTAL = registry.counter("bot_llm_tokens_total", "Tokens enviados y recibidos del LLM")
+TELEGRAM_SEND_SECONDS = registry.histogram("bot_telegram_request_seconds", "Latencia de las llamadas a la Bot API")
+
+
+def timed(histogram: Histogram):
+    """
+    Decorador para métodos asíncronos: registra su duración con la etiqueta method
+    (y un span db.<método> en la traza de la petición en curso)
+    """
+    def decorator(func):
+        span_name = f"db.{func.__name__}"
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(span_name), histogram.time(method=func.__name__):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_pool_gauges(database):
+    """Gauges del pool asyncpg: tamaño, conexiones libres, en uso y máximo"""
+    registry.gauge("bot_db_pool_size", "Conexiones abiertas del pool asyncpg",
+                   lambda: database.pool.get_size())
+    registry.gauge("bot_db_pool_idle", "Conexiones libres del pool asyncpg",
+                   lambda: database.pool.get_idle_size())
+    # asyncpg no expone las tareas en espera: en uso == máximo indica pool saturado
+    registry.gauge("bot_db_pool_in_use", "Conexiones en uso del pool asyncpg",
+                   lambda: database.pool.get_size() - database.pool.get_idle_size())
+    registry.gauge("bot_db_pool_max", "Tamaño máximo del pool asyncpg",
+                   lambda: database.pool.get_max_size())
+
+
+def register_agent_gauges(runner):
+    """Gauges del ejecutor del SQL Agent"""
+    registry.gauge("bot_agent_queue_depth", "Corridas del agente esperando un hilo",
+                   lambda: runner.queued)
+    registry.gauge("bot_agent_running", "Corridas del agente en curso",
+                   lambda: runner.running)
+
+
+def register_scheduler_gauges(scheduler):
+    """Gauges del planificador de mensajes por usuario"""
+    registry.gauge("bot_scheduler_queue_depth", "Mensajes en cola por prioridad",
+                   lambda: {(('priority', name),): depth
+                            for name, depth in scheduler.stats()['queue_by_priority'].items()})
+
+
+async def _handle_connection(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Descartar cabeceras
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug("Error en petición de métricas: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    """
+    Inicia el endpoint /metrics si METRICS_PORT está definido
+    
+    Returns:
+        El servidor asyncio, o None si está desactivado o el puerto no está disponible
+    """
+    port = int(os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    listen = os.getenv("METRICS_LISTEN", "127.0.0.1")
+    try:
+        server = await asyncio.start_server(_handle_connection, listen, port)
+    except OSError as e:
+        logger.warning("⚠️ No se pudo iniciar el endpoint de métricas en %s:%s: %s", listen, port, e)
+        return None
+    logger.info("📈 Métricas disponibles en http://%s:%s/metrics", listen, port)
+    return server
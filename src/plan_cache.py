@@ -0,0 +1,383 @@
+"""
+Caché persistente de planes SQL aprendidos del agente
+
+Cuando el SQL Agent responde una pregunta, la última consulta SQL que ejecutó se
+convierte en una plantilla parametrizada (los valores que venían de la pregunta
+pasan a ser $1, $2...) y se guarda con la "forma" de la pregunta como clave.
+Las siguientes preguntas con la misma forma ejecutan esa plantilla directamente.
+"""
+import os
+import re
+import json
+import time
+import logging
+import tempfile
+
+from src.cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# Tablas que una plantilla puede consultar
+ALLOWED_TABLES = {'invoices'}
+
+_USERNAME_RE = re.compile(r'@(\w{3,32})')
+_QUOTED_RE = re.compile(r'["“”«»]([^"“”«»]{2,})["“”«»]')
+_NUMBER_RE = re.compile(r'\b\d{1,6}\b')
+_SQL_STRING_RE = re.compile(r"'((?:[^']|'')*)'")
+_SQL_NUMBER_RE = re.compile(r'(?<![\w$.])(\d{1,6})(?![\w.])')
+# Posiciones donde un número del SQL puede venir de la pregunta
+_NUMBER_POSITION = r'(\b(?:limit|offset)\s+|(?:<>|!=|<=|>=|=|<|>)\s*)'
+_FROM_JOIN_RE = re.compile(r'\b(from|join)\b', re.IGNORECASE)
+_TABLE_NAME_RE = re.compile(r'\s*(?:only\s+)?("[^"]+"|[a-zA-Z_][\w.]*)', re.IGNORECASE)
+# Palabras que terminan la lista de tablas de un FROM
+_FROM_END_RE = re.compile(
+    r'(?:where|group|order|having|limit|offset|union|intersect|except|window|fetch|for'
+    r'|on|using|join|inner|left|right|full|cross|natural|lateral)\b',
+    re.IGNORECASE
+)
+# Funciones que usan FROM en sus argumentos: EXTRACT(MONTH FROM fecha)
+_FROM_FUNCTION_RE = re.compile(r'\b(?:extract|substring|trim|overlay)\s*\(', re.IGNORECASE)
+_CTE_RE = re.compile(r'\b([a-zA-Z_]\w*)\s+as\s*(?:not\s+)?(?:materialized\s*)?\(', re.IGNORECASE)
+_INTERVAL_EXPR_RE = re.compile(r'\binterval\s+(\([^()]*\))', re.IGNORECASE)
+# Palabras que hacen que el SQL dependa de la fecha en que se hizo la pregunta
+_RELATIVE_DATE_RE = re.compile(
+    r'\b(?:hoy|ayer|anteayer|manana|semanas?|mes|meses|anos?|trimestres?|dias?|horas?'
+    r'|pasad[oa]s?|actual|reciente|recientemente)\b'
+)
+_DATE_LITERAL_RE = re.compile(r'\d{4}-\d{1,2}-\d{1,2}')
+_FORBIDDEN_RE = re.compile(
+    r'\b(?:insert|update|delete|drop|alter|create|truncate|grant|revoke|copy|vacuum|call|do)\b',
+    re.IGNORECASE
+)
+
+
+def question_shape(question: str):
+    """
+    Calcula la forma de la pregunta y los valores extraídos de ella
+    
+    Returns:
+        (shape, values) donde values es una lista de (tipo, valor) en orden de aparición
+    """
+    values = []
+    text = question
+    
+    def replace_user(match):
+        values.append(('user', match.group(1)))
+        return ' SLOTUSER '
+    
+    def replace_quoted(match):
+        values.append(('text', match.group(1)))
+        return ' SLOTTEXT '
+    
+    text = _USERNAME_RE.sub(replace_user, text)
+    text = _QUOTED_RE.sub(replace_quoted, text)
+    text = normalize_question(text)
+    
+    def replace_number(match):
+        values.append(('number', int(match.group(0))))
+        return 'SLOTNUM'
+    
+    text = _NUMBER_RE.sub(replace_number, text)
+    return text, values
+
+
+def validate_sql(sql: str) -> bool:
+    """
+    Verifica que la consulta sea un único SELECT de solo lectura sobre tablas permitidas
+    """
+    statement = sql.strip().rstrip(';').strip()
+    if not statement or ';' in statement:
+        return False
+    if not re.match(r'^(select|with)\b', statement, re.IGNORECASE):
+        return False
+    if _FORBIDDEN_RE.search(_SQL_STRING_RE.sub("''", statement)):
+        return False
+    tables = referenced_tables(statement)
+    return bool(tables) and tables <= ALLOWED_TABLES
+
+
+def referenced_tables(sql: str) -> set:
+    """
+    Tablas de todas las listas FROM (incluidas las separadas por comas) y de los JOIN,
+    sin contar los nombres de CTE ni el FROM de EXTRACT(... FROM ...) y similares
+    """
+    text = _mask_function_from(_SQL_STRING_RE.sub("''", sql))
+    ctes = {name.lower() for name in _CTE_RE.findall(text)} if re.match(r'\s*with\b', text, re.I) else set()
+    
+    tables = set()
+    for match in _FROM_JOIN_RE.finditer(text):
+        if match.group(1).lower() == 'join':
+            items = [text[match.end():]]
+        else:
+            items = _from_items(text, match.end())
+        for item in items:
+            if item.lstrip().startswith('('):
+                # Subconsulta: sus tablas se cuentan con su propio FROM
+                continue
+            name = _TABLE_NAME_RE.match(item)
+            if name:
+                tables.add(name.group(1).strip('"').split('.')[-1].lower())
+    return tables - ctes
+
+
+def _matching_paren(text: str, start: int) -> int:
+    """Posición del paréntesis que cierra el abierto en start (o el final del texto)"""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(text)
+
+
+def _mask_function_from(text: str) -> str:
+    """Borra la palabra FROM dentro de EXTRACT(), SUBSTRING(), TRIM() y OVERLAY()"""
+    chars = list(text)
+    for match in _FROM_FUNCTION_RE.finditer(text):
+        start = match.end()
+        end = _matching_paren(text, start - 1)
+        for inner in re.finditer(r'\bfrom\b', text[start:end], re.IGNORECASE):
+            chars[start + inner.start():start + inner.end()] = '    '
+    return ''.join(chars)
+
+
+def _from_items(text: str, start: int) -> list:
+    """Elementos de la lista de un FROM, separados por comas al mismo nivel"""
+    items = []
+    depth = 0
+    item_start = start
+    i = start
+    while i < len(text):
+        char = text[i]
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0:
+                # Fin de la subconsulta que contiene este FROM
+                break
+        elif depth == 0:
+            if char == ',':
+                items.append(text[item_start:i])
+                item_start = i + 1
+            elif (not text[i - 1].isalnum() and text[i - 1] != '_'
+                    and _FROM_END_RE.match(text, i)):
+                break
+        i += 1
+    items.append(text[item_start:i])
+    return items
+
+
+def _is_date_dependent(question: str, shape: str, sql: str) -> bool:
+    """
+    Indica si el SQL depende de la fecha de la pregunta: palabras de fecha relativa
+    (hoy, ayer, mes pasado...) o literales de fecha que no vienen de la pregunta
+    """
+    if _RELATIVE_DATE_RE.search(shape):
+        return True
+    literals = ' '.join(_SQL_STRING_RE.findall(sql))
+    return any(date not in question for date in _DATE_LITERAL_RE.findall(literals))
+
+
+def parameterize(sql: str, values: list):
+    """
+    Reemplaza en el SQL los literales que provienen de la pregunta por $1, $2...
+    
+    Returns:
+        (template_sql, slots) donde slots[i] = (índice en values, tipo) del parámetro $i+1,
+        o None si algún valor de la pregunta no aparece en el SQL
+    """
+    sql = sql.strip().rstrip(';').strip()
+    slots = []
+    
+    for index, (kind, value) in enumerate(values):
+        placeholder = f"${len(slots) + 1}"
+        
+        param_type = 'text'
+        if kind == 'number':
+            # Solo números tras LIMIT/OFFSET o un operador de comparación, fuera de
+            # literales de texto: nunca posiciones ordinales de GROUP BY / ORDER BY
+            pattern = re.compile(_NUMBER_POSITION + str(value) + r'(?![\w.])', re.IGNORECASE)
+            new_sql, count = _replace_outside_strings(sql, pattern, rf"\g<1>{placeholder}::int")
+            param_type = 'int'
+            if count == 0:
+                # Números dentro de literales, por ejemplo INTERVAL '7 days'
+                new_sql, count = _replace_in_strings(sql, str(value), placeholder)
+                param_type = 'text'
+        else:
+            new_sql, count = _replace_in_strings(sql, str(value), placeholder)
+        
+        if count == 0:
+            return None
+        sql = new_sql
+        slots.append((index, param_type))
+    
+    # INTERVAL solo acepta literales: INTERVAL (expr) -> (expr)::interval
+    sql = _INTERVAL_EXPR_RE.sub(r'\1::interval', sql)
+    return sql, slots
+
+
+def _replace_outside_strings(sql: str, pattern, replacement: str):
+    parts = _SQL_STRING_RE.split(sql)
+    count = 0
+    # split con un grupo: posiciones pares fuera de strings, impares dentro (sin comillas)
+    for i in range(0, len(parts), 2):
+        parts[i], n = pattern.subn(replacement, parts[i])
+        count += n
+    for i in range(1, len(parts), 2):
+        parts[i] = "'" + parts[i] + "'"
+    return ''.join(parts), count
+
+
+def _replace_in_strings(sql: str, value: str, placeholder: str):
+    count = 0
+    
+    def replace(match):
+        nonlocal count
+        content = match.group(1)
+        position = content.lower().find(value.lower())
+        if position < 0:
+            return match.group(0)
+        count += 1
+        prefix, suffix = content[:position], content[position + len(value):]
+        expression = f"{placeholder}::text"
+        if prefix:
+            expression = f"'{prefix}' || {expression}"
+        if suffix:
+            expression = f"{expression} || '{suffix}'"
+        return f"({expression})"
+    
+    return _SQL_STRING_RE.sub(replace, sql), count
+
+
+def extract_final_sql(intermediate_steps: list):
+    """
+    Devuelve la última consulta ejecutada con la herramienta sql_db_query
+    """
+    for action, _observation in reversed(intermediate_steps or []):
+        if getattr(action, 'tool', None) != 'sql_db_query':
+            continue
+        tool_input = action.tool_input
+        if isinstance(tool_input, dict):
+            tool_input = tool_input.get('query') or next(iter(tool_input.values()), '')
+        return str(tool_input).strip().strip('`').strip()
+    return None
+
+
+class SQLPlanCache:
+    """
+    Plantillas SQL aprendidas, persistidas en un archivo JSON local
+    """
+    
+    def __init__(self, path: str = None, max_entries: int = None):
+        self.path = path or os.getenv("SQL_PLAN_CACHE_PATH", "sql_plan_cache.json")
+        self.max_entries = max_entries or int(os.getenv("SQL_PLAN_CACHE_SIZE", "500"))
+        self.hits = 0
+        self.learned = 0
+        self.rejected = 0
+        self._plans = self._load()
+    
+    def lookup(self, question: str):
+        """
+        Busca una plantilla para la pregunta
+        
+        Returns:
+            (shape, sql, params) o None
+        """
+        shape, values = question_shape(question)
+        plan = self._plans.get(shape)
+        if not plan:
+            return None
+        try:
+            params = [
+                int(values[i][1]) if param_type == 'int' else str(values[i][1])
+                for i, param_type in plan['slots']
+            ]
+        except (IndexError, ValueError):
+            return None
+        return shape, plan['sql'], params
+    
+    def learn(self, question: str, sql: str):
+        """
+        Convierte el SQL del agente en plantilla y la guarda si es válida
+        """
+        if not sql or not validate_sql(sql):
+            self.rejected += 1
+            logger.debug("SQL no apto para plantilla: %s", sql)
+            return False
+        
+        shape, values = question_shape(question)
+        if _is_date_dependent(question, shape, sql):
+            # La plantilla fijaría las fechas calculadas para el día en que se aprendió
+            self.rejected += 1
+            logger.debug("SQL dependiente de la fecha, no se guarda como plantilla: %s", sql)
+            return False
+        
+        result = parameterize(sql, values)
+        if result is None:
+            self.rejected += 1
+            return False
+        
+        template_sql, slots = result
+        self._plans[shape] = {
+            'sql': template_sql,
+            'slots': slots,
+            'question': question,
+            'created_at': time.time(),
+            'uses': 0,
+        }
+        self.learned += 1
+        self._evict()
+        self._save()
+        logger.info("🧠 Plantilla SQL aprendida para: %s", shape)
+        return True
+    
+    def record_hit(self, shape: str):
+        """Marca el uso de una plantilla"""
+        self.hits += 1
+        if shape in self._plans:
+            self._plans[shape]['uses'] += 1
+    
+    def invalidate(self, shape: str):
+        """Elimina una plantilla que falló al reutilizarse"""
+        if self._plans.pop(shape, None) is not None:
+            logger.warning("🗑️ Plantilla SQL inválida eliminada: %s", shape)
+            self._save()
+    
+    def stats(self) -> dict:
+        return {
+            'plans': len(self._plans),
+            'hits': self.hits,
+            'learned': self.learned,
+            'rejected': self.rejected,
+        }
+    
+    def _evict(self):
+        # Conservar las plantillas más usadas / más recientes
+        while len(self._plans) > self.max_entries:
+            victim = min(self._plans, key=lambda k: (self._plans[k]['uses'], self._plans[k]['created_at']))
+            del self._plans[victim]
+    
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                plans = json.load(f)
+            # Revalidar al cargar: el archivo puede haber sido editado
+            return {k: v for k, v in plans.items() if validate_sql(v.get('sql', ''))}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("⚠️ No se pudo leer la caché de planes SQL: %s", e)
+            return {}
+    
+    def _save(self):
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False, suffix='.tmp') as f:
+                json.dump(self._plans, f, ensure_ascii=False, indent=2)
+            os.replace(f.name, self.path)
+        except Exception as e:
+            logger.warning("⚠️ No se pudo guardar la caché de planes SQL: %s", e)
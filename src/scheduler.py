@@ -0,0 +1,263 @@
+"""
+Planificador justo de mensajes entrantes por usuario
+
+Se ubica entre los handlers de Telegram y el procesamiento (HybridAssistant /
+GroqService): limita a cada usuario con un token bucket, encola sus mensajes
+en una cola propia y los workers atienden a los usuarios por turnos
+(round-robin), dando prioridad a las consultas SQL directas sobre el chat y
+sobre las corridas del agente.
+"""
+import os
+import time
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict, deque
+
+from src.intents import INTENT_CHAT, INTENT_DATA_QUERY
+from src.tracing import copy_context, current_span
+
+logger = logging.getLogger(__name__)
+
+# Prioridades (menor número = se atiende primero)
+PRIORITY_DIRECT = 0  # Consultas SQL directas / plantillas
+PRIORITY_CHAT = 1    # Una llamada al LLM
+PRIORITY_AGENT = 2   # Corrida del SQL Agent
+
+PRIORITY_NAMES = {PRIORITY_DIRECT: 'direct', PRIORITY_CHAT: 'chat', PRIORITY_AGENT: 'agent'}
+
+
+class RateLimitExceeded(Exception):
+    """El usuario superó su límite de mensajes o su cola está llena"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(f"Límite de mensajes superado, reintentar en {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def priority_for_intent(intent) -> int:
+    """
+    Prioridad de un mensaje en el bot principal según su intención
+    """
+    if intent.name == INTENT_CHAT:
+        return PRIORITY_CHAT
+    if intent.name == INTENT_DATA_QUERY:
+        return PRIORITY_AGENT
+    return PRIORITY_DIRECT
+
+
+class _TokenBucket:
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def take(self) -> float:
+        """Consume un token; devuelve 0 si se pudo o los segundos a esperar si no"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FairScheduler:
+    """
+    Colas por usuario atendidas por turnos, con límite de tasa y prioridades
+    """
+    
+    def __init__(self, workers: int = None, rate: float = None, burst: int = None,
+                 max_queue_per_user: int = None):
+        self.workers = workers or int(os.getenv("SCHEDULER_WORKERS", "8"))
+        self.rate = rate or float(os.getenv("USER_RATE_PER_MINUTE", "12")) / 60.0
+        self.burst = burst or int(os.getenv("USER_RATE_BURST", "5"))
+        self.max_queue_per_user = max_queue_per_user or int(os.getenv("USER_MAX_QUEUE", "5"))
+        
+        # prioridad -> OrderedDict(user_id -> deque de trabajos); el orden del dict es el turno
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._buckets = {}
+        # Usuarios con un trabajo en curso: como mucho uno a la vez por usuario
+        self._busy = set()
+        self._sequence = itertools.count()
+        self._pending = None
+        # Permisos tomados por workers que solo encontraron usuarios ocupados
+        self._deferred = 0
+        self._swept_at = time.monotonic()
+        self._worker_tasks = []
+        
+        self.active = 0
+        self.processed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    async def submit(self, user_id: int, job_factory, priority: int = PRIORITY_CHAT):
+        """
+        Encola un trabajo del usuario y espera su resultado
+        
+        Args:
+            user_id: Usuario que envió el mensaje
+            job_factory: Función sin argumentos que devuelve la corrutina a ejecutar
+            priority: PRIORITY_DIRECT, PRIORITY_CHAT o PRIORITY_AGENT
+            
+        Raises:
+            RateLimitExceeded: si el usuario no tiene tokens o su cola está llena
+        """
+        self._ensure_workers()
+        self._evict_idle_buckets()
+        
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _TokenBucket(self.burst, self.rate)
+        if self._user_queue_length(user_id) >= self.max_queue_per_user:
+            self.rejected += 1
+            raise RateLimitExceeded(1 / self.rate)
+        retry_after = bucket.take()
+        if retry_after:
+            self.rejected += 1
+            raise RateLimitExceeded(retry_after)
+        
+        future = asyncio.get_running_loop().create_future()
+        # El trabajo se ejecuta en la tarea de un worker: se conserva el contexto
+        # de quien lo encola para continuar su traza
+        parent = current_span()
+        wait_span = parent.child("scheduler.wait", priority=PRIORITY_NAMES[priority]) if parent else None
+        queue = self._queues[priority].setdefault(user_id, deque())
+        queue.append((next(self._sequence), future, job_factory, time.monotonic(), copy_context(), wait_span))
+        self._pending.release()
+        return await future
+    
+    def stats(self) -> dict:
+        """
+        Profundidad de colas y tiempos de espera
+        """
+        depth = {
+            PRIORITY_NAMES[priority]: sum(len(q) for q in queues.values())
+            for priority, queues in self._queues.items()
+        }
+        return {
+            'queue_depth': sum(depth.values()),
+            'queue_by_priority': depth,
+            'waiting_users': len({u for queues in self._queues.values() for u in queues}),
+            'busy_users': len(self._busy),
+            'tracked_users': len(self._buckets),
+            'active': self.active,
+            'workers': self.workers,
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'avg_wait': round(self.total_wait / self.processed, 3) if self.processed else 0.0,
+            'max_wait': round(self.max_wait, 3),
+        }
+    
+    async def close(self):
+        """Detiene los workers"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+    
+    def _ensure_workers(self):
+        if self._worker_tasks:
+            return
+        self._pending = asyncio.Semaphore(0)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(), name=f"scheduler-worker-{i}")
+            for i in range(self.workers)
+        ]
+    
+    def _user_queue_length(self, user_id: int) -> int:
+        return sum(len(queues.get(user_id, ())) for queues in self._queues.values())
+    
+    def _evict_idle_buckets(self):
+        """
+        Descarta los buckets que ya se rellenaron por completo (equivalen a uno nuevo)
+        de usuarios sin trabajos, como mucho una vez por tiempo de recarga
+        """
+        now = time.monotonic()
+        refill = self.burst / self.rate
+        if now - self._swept_at < refill:
+            return
+        self._swept_at = now
+        idle = [
+            user_id for user_id, bucket in self._buckets.items()
+            if now - bucket.updated >= refill and user_id not in self._busy
+            and not self._user_queue_length(user_id)
+        ]
+        for user_id in idle:
+            del self._buckets[user_id]
+    
+    def _is_oldest(self, user_id: int, sequence: int) -> bool:
+        """Indica si el trabajo es el más antiguo del usuario entre todas las prioridades"""
+        return all(
+            queues[user_id][0][0] >= sequence
+            for queues in self._queues.values() if user_id in queues
+        )
+    
+    def _next_job(self):
+        """
+        Siguiente trabajo: la prioridad más alta con trabajos, y dentro de ella
+        el usuario al que le toca el turno que no tenga otro trabajo en curso
+        
+        Los mensajes de un mismo usuario se procesan de a uno y en el orden en
+        que llegaron, aunque tengan prioridades distintas.
+        """
+        for priority in sorted(self._queues):
+            queues = self._queues[priority]
+            for user_id, queue in queues.items():
+                if user_id in self._busy or not self._is_oldest(user_id, queue[0][0]):
+                    continue
+                job = queue.popleft()
+                del queues[user_id]
+                if queue:
+                    # El usuario vuelve al final del turno
+                    queues[user_id] = queue
+                self._busy.add(user_id)
+                return user_id, job
+        return None
+    
+    def _release_user(self, user_id: int):
+        """Libera al usuario y devuelve los permisos de los workers que no encontraron trabajo"""
+        self._busy.discard(user_id)
+        deferred, self._deferred = self._deferred, 0
+        for _ in range(deferred):
+            self._pending.release()
+    
+    async def _worker(self):
+        while True:
+            await self._pending.acquire()
+            next_job = self._next_job()
+            if next_job is None:
+                # Quedan trabajos, pero de usuarios ocupados: se reintenta al liberarse uno
+                self._deferred += 1
+                continue
+            user_id, (_sequence, future, job_factory, enqueued_at, context, wait_span) = next_job
+            try:
+                if wait_span is not None:
+                    wait_span.finish()
+                if future.cancelled():
+                    continue
+                
+                wait = time.monotonic() - enqueued_at
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.processed += 1
+                
+                self.active += 1
+                try:
+                    result = await asyncio.create_task(job_factory(), context=context)
+                    if not future.done():
+                        future.set_result(result)
+                except asyncio.CancelledError:
+                    if not future.done():
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                finally:
+                    self.active -= 1
+            finally:
+                self._release_user(user_id)
@@ -0,0 +1,82 @@
+"""
+Coalescencia de llamadas idénticas concurrentes (single-flight)
+"""
+import copy
+import asyncio
+import functools
+import logging
+
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_IMMUTABLE = (str, bytes, int, float, bool, type(None))
+
+
+def _private_copy(value):
+    """Copia del resultado para un llamador (los valores inmutables se comparten)"""
+    return value if isinstance(value, _IMMUTABLE) else copy.deepcopy(value)
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: solo la primera se ejecuta
+    y todas las demás esperan y reciben su resultado (o su excepción).
+    """
+    
+    def __init__(self):
+        self._inflight = {}
+        self.executed = 0
+        self.shared = 0
+    
+    async def do(self, key, func):
+        """
+        Ejecuta func() o se une a la ejecución en curso con la misma clave
+        
+        Args:
+            key: Clave hashable que identifica la llamada
+            func: Función sin argumentos que devuelve una corrutina
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            logger.debug("🔗 Uniendo a ejecución en curso: %s", key)
+            with span("singleflight.join"):
+                return _private_copy(await asyncio.shield(future))
+        
+        future = asyncio.ensure_future(func())
+        self._inflight[key] = future
+        self.executed += 1
+        future.add_done_callback(lambda f: self._forget(key, f))
+        # shield: si quien inició la llamada se cancela, los demás siguen esperando el resultado.
+        # Cada llamador, también el que la inició, recibe su propia copia para que nadie
+        # modifique el resultado que ven los demás
+        return _private_copy(await asyncio.shield(future))
+    
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Evitar el aviso "exception was never retrieved" si nadie quedó esperando
+        if not future.cancelled():
+            future.exception()
+    
+    def stats(self) -> dict:
+        """Llamadas ejecutadas y llamadas que compartieron resultado"""
+        return {
+            'in_flight': len(self._inflight),
+            'executed': self.executed,
+            'shared': self.shared,
+        }
+
+
+def coalesce(method):
+    """
+    Decorador para métodos asíncronos de lectura: llamadas concurrentes con los
+    mismos argumentos comparten una sola ejecución. La instancia debe tener
+    un atributo `_singleflight` (SingleFlight).
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        return await self._singleflight.do(key, lambda: method(self, *args, **kwargs))
+    return wrapper
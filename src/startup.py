@@ -0,0 +1,67 @@
+"""
+Tiempos de las fases de arranque de los bots
+
+El arranque es escalonado: la base de datos y los servicios livianos se inician
+antes de recibir updates, y lo costoso (LangChain, el SQL Agent, el cliente de
+OpenAI) se construye en segundo plano. Cada fase se registra en el log y en el
+gauge bot_startup_seconds.
+"""
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+from src.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Referencia de tiempo: importación de este módulo (antes que los servicios)
+PROCESS_START = time.perf_counter()
+
+
+class StartupTimer:
+    """
+    Mide las fases del arranque y el tiempo hasta estar listo para responder
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.phases = {}
+        registry.gauge(
+            "bot_startup_seconds", "Duración de las fases de arranque",
+            lambda: {(('phase', phase),): round(seconds, 4) for phase, seconds in self.phases.items()}
+        )
+    
+    def record(self, phase: str, seconds: float):
+        self.phases[phase] = seconds
+        logger.info("⏱️ Arranque %s: %s en %.3fs", self.name, phase, seconds)
+    
+    @contextmanager
+    def phase(self, phase: str):
+        """Mide una fase del arranque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+    
+    def track(self, phase: str, future: asyncio.Future):
+        """Registra la duración de una fase en segundo plano cuando termina bien"""
+        start = time.perf_counter()
+        
+        def done(task):
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                logger.warning("⚠️ Arranque %s: %s falló: %s", self.name, phase, task.exception())
+            else:
+                self.record(phase, time.perf_counter() - start)
+        
+        future.add_done_callback(done)
+        return future
+    
+    def ready(self) -> float:
+        """Registra el tiempo desde el inicio del proceso hasta aceptar updates"""
+        elapsed = time.perf_counter() - PROCESS_START
+        self.record("listo", elapsed)
+        return elapsed
@@ -0,0 +1,230 @@
+"""
+Backends de estado compartido entre procesos (historial, caché de respuestas)
+
+- local: diccionario en memoria del proceso (pruebas, un solo proceso)
+- sqlite: archivo SQLite compartido por los workers de una misma máquina
+- postgres: tabla bot_state en la base de datos de la aplicación (varias máquinas)
+
+Los valores deben ser serializables a JSON.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend:
+    """
+    Interfaz de un almacén clave/valor con espacios de nombres y expiración opcional
+    """
+    
+    async def get(self, namespace: str, key: str):
+        """Devuelve el valor guardado o None si no existe o expiró"""
+        raise NotImplementedError
+    
+    async def set(self, namespace: str, key: str, value, ttl: float = None):
+        """Guarda un valor (ttl en segundos, sin expiración si es None)"""
+        raise NotImplementedError
+    
+    async def delete(self, namespace: str, key: str):
+        """Elimina un valor"""
+        raise NotImplementedError
+    
+    async def clear(self, namespace: str):
+        """Elimina todos los valores de un espacio de nombres"""
+        raise NotImplementedError
+    
+    async def close(self):
+        """Libera los recursos del backend"""
+
+
+class LocalBackend(StateBackend):
+    """
+    Estado en memoria del proceso actual
+    """
+    
+    def __init__(self):
+        # (namespace, key) -> (valor serializado, expira_en)
+        self._values = {}
+    
+    async def get(self, namespace: str, key: str):
+        entry = self._values.get((namespace, key))
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._values[(namespace, key)]
+            return None
+        # Se devuelve una copia, como en los backends persistentes
+        return json.loads(value)
+    
+    async def set(self, namespace: str, key: str, value, ttl: float = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._values[(namespace, key)] = (json.dumps(value), expires_at)
+    
+    async def delete(self, namespace: str, key: str):
+        self._values.pop((namespace, key), None)
+    
+    async def clear(self, namespace: str):
+        for item in [item for item in self._values if item[0] == namespace]:
+            del self._values[item]
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Estado en un archivo SQLite (modo WAL) compartido por varios procesos
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("STATE_SQLITE_PATH", "bot_state.db")
+        self._conn = None
+        self._lock = asyncio.Lock()
+    
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS bot_state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+    
+    async def _run(self, func, *args):
+        # sqlite3 es bloqueante: se ejecuta en un hilo, una operación a la vez
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+    
+    def _get(self, namespace, key):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM bot_state WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+    
+    def _set(self, namespace, key, value, ttl):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO bot_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+        conn.commit()
+    
+    def _delete(self, namespace, key):
+        conn = self._connection()
+        conn.execute("DELETE FROM bot_state WHERE namespace = ? AND key = ?", (namespace, key))
+        conn.commit()
+    
+    def _clear(self, namespace):
+        conn = self._connection()
+        conn.execute("DELETE FROM bot_state WHERE namespace = ?", (namespace,))
+        conn.commit()
+    
+    async def get(self, namespace: str, key: str):
+        return await self._run(self._get, namespace, key)
+    
+    async def set(self, namespace: str, key: str, value, ttl: float = None):
+        await self._run(self._set, namespace, key, value, ttl)
+    
+    async def delete(self, namespace: str, key: str):
+        await self._run(self._delete, namespace, key)
+    
+    async def clear(self, namespace: str):
+        await self._run(self._clear, namespace)
+    
+    async def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class PostgresBackend(StateBackend):
+    """
+    Estado en la tabla bot_state usando el pool asyncpg de NeonDatabase
+    """
+    
+    def __init__(self, database):
+        self.database = database
+        self._ready = False
+    
+    async def _ensure_table(self, conn):
+        if self._ready:
+            return
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value JSONB NOT NULL,
+                expires_at TIMESTAMPTZ,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self._ready = True
+    
+    async def get(self, namespace: str, key: str):
+        async with self.database.pool.acquire() as conn:
+            await self._ensure_table(conn)
+            value = await conn.fetchval("""
+                SELECT value FROM bot_state
+                WHERE namespace = $1 AND key = $2
+                  AND (expires_at IS NULL OR expires_at > NOW())
+            """, namespace, key)
+        return json.loads(value) if value is not None else None
+    
+    async def set(self, namespace: str, key: str, value, ttl: float = None):
+        async with self.database.pool.acquire() as conn:
+            await self._ensure_table(conn)
+            await conn.execute("""
+                INSERT INTO bot_state (namespace, key, value, expires_at)
+                VALUES ($1, $2, $3::jsonb, NOW() + make_interval(secs => $4))
+                ON CONFLICT (namespace, key)
+                DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+            """, namespace, key, json.dumps(value), float(ttl) if ttl else None)
+    
+    async def delete(self, namespace: str, key: str):
+        async with self.database.pool.acquire() as conn:
+            await self._ensure_table(conn)
+            await conn.execute(
+                "DELETE FROM bot_state WHERE namespace = $1 AND key = $2", namespace, key
+            )
+    
+    async def clear(self, namespace: str):
+        async with self.database.pool.acquire() as conn:
+            await self._ensure_table(conn)
+            await conn.execute("DELETE FROM bot_state WHERE namespace = $1", namespace)
+
+
+def create_state_backend(database=None) -> StateBackend:
+    """
+    Crea el backend de estado configurado en STATE_BACKEND
+    
+    Returns:
+        El backend, o None si no hay estado compartido (STATE_BACKEND vacío o "none")
+    """
+    kind = os.getenv("STATE_BACKEND", "none").lower()
+    if kind in ("", "none"):
+        return None
+    if kind == "local":
+        backend = LocalBackend()
+    elif kind == "sqlite":
+        backend = SQLiteBackend()
+    elif kind == "postgres":
+        if database is None:
+            raise ValueError("STATE_BACKEND=postgres requiere la base de datos de la aplicación")
+        backend = PostgresBackend(database)
+    else:
+        raise ValueError(f"STATE_BACKEND desconocido: {kind}")
+    logger.info("🗃️ Estado compartido en backend '%s'", kind)
+    return backend
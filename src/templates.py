@@ -0,0 +1,226 @@
+"""
+Motor de plantillas NL-a-SQL: responde las preguntas frecuentes con consultas
+parametrizadas, sin pasar por el LLM
+"""
+import os
+import logging
+from collections import Counter
+
+from src.intents import (
+    classifier, extract_limit, is_year,
+    INTENT_COUNT_INVOICES, INTENT_COUNT_CUSTOMERS, INTENT_TOP_CUSTOMERS,
+    INTENT_RECENT_SALES, INTENT_SEARCH, INTENT_SALES_BY_DATE, INTENT_STATS,
+)
+from src.logs import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 5
+MAX_LIMIT = int(os.getenv("TEMPLATE_MAX_LIMIT", "50"))
+
+
+def _bounded(limit, default: int = DEFAULT_LIMIT) -> int:
+    """Limita la cantidad de filas pedida al rango [1, MAX_LIMIT]"""
+    if limit is None:
+        return default
+    return min(max(int(limit), 1), MAX_LIMIT)
+
+
+def _requested_limit(intent, default: int = DEFAULT_LIMIT) -> int:
+    """
+    Cantidad de filas pedida en la pregunta; si el número no es una cantidad
+    explícita (un artículo "un/una" o un año) se usa el valor por defecto
+    """
+    limit = intent.limit
+    if limit is None or is_year(limit) or (intent.message and extract_limit(intent.message) != limit):
+        return default
+    return _bounded(limit, default)
+
+
+def _period_label(date_range) -> str:
+    """Describe un rango de fechas para la respuesta"""
+    start, end = date_range
+    if start == end:
+        return f"el {start.strftime('%d/%m/%Y')}"
+    return f"del {start.strftime('%d/%m/%Y')} al {end.strftime('%d/%m/%Y')}"
+
+
+def _format_sales(sales: list) -> str:
+    lines = []
+    for i, sale in enumerate(sales, 1):
+        username = f"@{sale['username']}" if sale.get('username') else "Cliente"
+        created_at = sale['created_at'].strftime('%d/%m/%Y %H:%M') if sale.get('created_at') else "N/A"
+        lines.append(f"{i}. 🧾 {sale['invoice_number']} - {username} - {created_at}")
+    return "\n".join(lines)
+
+
+def _format_customers(customers: list) -> str:
+    lines = []
+    for i, customer in enumerate(customers, 1):
+        lines.append(
+            f"{i}. @{customer['username']}: {customer['total_purchases']} compras "
+            f"({customer['unique_invoices']} facturas únicas)"
+        )
+    return "\n".join(lines)
+
+
+class TemplateEngine:
+    """
+    Responde de forma determinista las clases de preguntas de /help usando el
+    clasificador de intenciones y consultas parametrizadas de NeonDatabase.
+    Devuelve None cuando la pregunta no encaja en ninguna plantilla y debe ir al agente.
+    """
+    
+    def __init__(self, database):
+        self.database = database
+        self.attempts = 0
+        self.answered = 0
+        self.by_intent = Counter()
+        self._handlers = {
+            INTENT_COUNT_INVOICES: self._count_invoices,
+            INTENT_COUNT_CUSTOMERS: self._count_customers,
+            INTENT_TOP_CUSTOMERS: self._top_customers,
+            INTENT_RECENT_SALES: self._recent_sales,
+            INTENT_SEARCH: self._search,
+            INTENT_SALES_BY_DATE: self._sales_by_date,
+            INTENT_STATS: self._stats,
+        }
+    
+    async def answer(self, question: str):
+        """
+        Intenta responder la pregunta con una plantilla
+        
+        Returns:
+            La respuesta formateada o None si debe resolverla el agente
+        """
+        self.attempts += 1
+        intent = classifier.classify(question)
+        handler = self._handlers.get(intent.name)
+        if handler is None:
+            return None
+        
+        answer = await handler(intent)
+        if answer:
+            self.answered += 1
+            self.by_intent[intent.name] += 1
+            logger.info("📐 Respondido con plantilla: %s", intent.name, extra=SAMPLED)
+        return answer
+    
+    def coverage(self) -> dict:
+        """
+        Cuántas preguntas se respondieron sin el LLM
+        """
+        return {
+            'attempts': self.attempts,
+            'answered': self.answered,
+            'coverage': (self.answered / self.attempts) if self.attempts else 0.0,
+            'by_intent': dict(self.by_intent),
+        }
+    
+    async def _count_invoices(self, intent):
+        if intent.date_range:
+            summary = await self.database.get_sales_summary_by_date_range(*intent.date_range)
+            return (
+                f"📊 {_period_label(intent.date_range).capitalize()} hubo **{summary['total_records']}** ventas "
+                f"({summary['total_invoices']} facturas únicas)."
+            )
+        total = await self.database.count_invoices()
+        return f"📊 Tenemos un total de **{total}** facturas registradas en el sistema."
+    
+    async def _count_customers(self, intent):
+        if intent.date_range:
+            summary = await self.database.get_sales_summary_by_date_range(*intent.date_range)
+            return f"👥 {_period_label(intent.date_range).capitalize()} compraron **{summary['total_customers']}** clientes únicos."
+        total = await self.database.count_customers()
+        return f"👥 Hay **{total}** clientes únicos registrados."
+    
+    async def _top_customers(self, intent):
+        # "¿Quién es el cliente con más ventas?" pide uno solo
+        default = 1 if ' el cliente' in f" {intent.text}" else DEFAULT_LIMIT
+        limit = _requested_limit(intent, default)
+        if intent.date_range:
+            customers = await self.database.get_top_customers_by_date_range(*intent.date_range, limit)
+            period = f" {_period_label(intent.date_range)}"
+        else:
+            customers = await self.database.get_top_customers(limit)
+            period = ""
+        
+        if not customers:
+            return f"❌ No hay ventas registradas{period}."
+        if limit == 1:
+            top = customers[0]
+            return (
+                f"👑 El cliente con más ventas{period} es **@{top['username']}** con "
+                f"{top['total_purchases']} compras ({top['unique_invoices']} facturas únicas)."
+            )
+        return f"👑 Top {len(customers)} clientes{period}:\n\n{_format_customers(customers)}"
+    
+    async def _recent_sales(self, intent):
+        limit = _requested_limit(intent)
+        if 'clientes' in intent.text.split():
+            customers = await self.database.get_recent_customers(limit)
+            lines = [
+                f"{i}. @{c['username']} - {c['last_purchase'].strftime('%d/%m/%Y %H:%M')}"
+                for i, c in enumerate(customers, 1)
+            ]
+            return f"👥 Los últimos {len(customers)} clientes:\n\n" + "\n".join(lines)
+        
+        sales = await self.database.get_recent_sales(limit)
+        return f"📋 Las últimas {len(sales)} ventas:\n\n{_format_sales(sales)}"
+    
+    async def _search(self, intent):
+        limit = _requested_limit(intent)
+        if intent.username:
+            sales = await self.database.get_recent_sales_by_username(intent.username, limit)
+            if not sales:
+                return f"❌ No se encontraron ventas de @{intent.username}"
+            for sale in sales:
+                sale['username'] = intent.username
+            return f"🔍 Últimas {len(sales)} ventas de @{intent.username}:\n\n{_format_sales(sales)}"
+        
+        if intent.keyword:
+            sales = await self.database.search_all_sales_by_keyword(intent.keyword, limit)
+            if not sales:
+                return f"❌ No se encontraron ventas para '{intent.keyword}'"
+            return f"🔍 Encontré {len(sales)} resultados para '{intent.keyword}':\n\n{_format_sales(sales)}"
+        
+        return None
+    
+    async def _sales_by_date(self, intent):
+        if not intent.date_range:
+            return None
+        limit = _requested_limit(intent)
+        summary = await self.database.get_sales_summary_by_date_range(*intent.date_range)
+        period = _period_label(intent.date_range)
+        if not summary['total_records']:
+            return f"❌ No hubo ventas {period}."
+        sales = await self.database.get_sales_by_date_range(*intent.date_range, limit)
+        return (
+            f"📅 Ventas {period}: **{summary['total_records']}** "
+            f"({summary['total_invoices']} facturas únicas, {summary['total_customers']} clientes)\n\n"
+            f"Últimas {len(sales)}:\n{_format_sales(sales)}"
+        )
+    
+    async def _stats(self, intent):
+        if intent.date_range:
+            summary = await self.database.get_sales_summary_by_date_range(*intent.date_range)
+            return (
+                f"📊 Estadísticas {_period_label(intent.date_range)}:\n\n"
+                f"💰 Total de registros: {summary['total_records']}\n"
+                f"🧾 Facturas únicas: {summary['total_invoices']}\n"
+                f"👥 Clientes: {summary['total_customers']}"
+            )
+        stats = await self.database.get_total_sales_stats()
+        if not stats or not stats['total_records']:
+            return "❌ No hay registros de ventas en el sistema"
+        lines = [
+            "📊 Estadísticas generales:\n",
+            f"💰 Total de registros: {stats['total_records']}",
+            f"🧾 Facturas únicas: {stats['total_invoices']}",
+            f"👥 Clientes totales: {stats['total_customers']}",
+        ]
+        if stats.get('first_sale'):
+            lines.append(f"📅 Primera venta: {stats['first_sale'].strftime('%d/%m/%Y')}")
+        if stats.get('last_sale'):
+            lines.append(f"📅 Última venta: {stats['last_sale'].strftime('%d/%m/%Y %H:%M')}")
+        return "\n".join(lines)
@@ -1,15 +1,23 @@
 """
 Herramientas de LangChain para el agente de ventas
 """
-from langchain.agents import create_sql_agent
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_community.utilities import SQLDatabase
-from langchain_openai import ChatOpenAI
-from langchain.agents.agent_types import AgentType
 import os
+import time
+import asyncio
+from datetime import date
 from dotenv import load_dotenv
 import logging
 
+from src.cache import AnswerCache, normalize_question
+from src.singleflight import SingleFlight
+from src.intents import classifier, parse_relative_dates
+from src.templates import TemplateEngine
+from database.schema import SchemaCache
+from src.plan_cache import SQLPlanCache, extract_final_sql
+from src.executor import AgentRunner
+from src.tracing import span, traced
+from src.logs import content, SAMPLED
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -21,16 +29,16 @@ class SalesAgent:
     usando LangChain y SQL Agent. Genera consultas SQL dinámicamente.
     """
     
-    def __init__(self):
-        # Configurar el LLM (usando Groq con OpenAI API compatible)
-        self.llm = ChatOpenAI(
-            model=os.getenv("MODEL_ID", "llama-3.1-70b-versatile"),
-            openai_api_key=os.getenv("GROQ_API_KEY"),
-            openai_api_base="https://api.groq.com/openai/v1",
-            temperature=0,  # Importante: temperatura 0 para consultas precisas
-        )
+    def __init__(self, database, state=None):
+        # Base de datos asíncrona compartida (pool asyncpg) para las consultas directas
+        self.database = database
+        # Backend de estado compartido entre workers (opcional, src/state.py)
+        self.state = state
+        self.templates = TemplateEngine(database)
+        # Metadatos de las tablas permitidas, compartidos por /schema y sql_db_schema
+        self.schema = SchemaCache(database)
         
-        # Conectar a la base de datos PostgreSQL
+        # Validar la configuración antes de iniciar (el agente se construye después)
         db_url = os.getenv("STR_DB")
         if not db_url:
             raise ValueError("STR_DB no está configurada en las variables de entorno")
@@ -38,22 +46,15 @@ class SalesAgent:
         # SQLAlchemy necesita postgresql+psycopg2:// en lugar de postgresql://
         if db_url.startswith("postgresql://"):
             db_url = db_url.replace("postgresql://", "postgresql+psycopg2://", 1)
+        self._db_url = db_url
         
-        self.db = SQLDatabase.from_uri(db_url)
-        
-        # Crear el toolkit y el agente con ZERO_SHOT (más compatible con Groq)
-        toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
-        
-        self.agent = create_sql_agent(
-            llm=self.llm,
-            toolkit=toolkit,
-            agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-            verbose=True,  # Para ver el proceso de pensamiento del agente
-            max_iterations=3,  # Reducido para evitar loops
-            max_execution_time=20,  # Timeout de 20 segundos
-            handle_parsing_errors=True,
-            return_intermediate_steps=False,
-        )
+        # LLM, SQLDatabase y agente de LangChain: se construyen con build_agent()
+        # (en segundo plano con start_build) para no demorar el arranque del bot
+        self.llm = None
+        self.db = None
+        self.agent = None
+        self.build_seconds = None
+        self._build_task = None
         
         # Prompt del sistema mejorado
         self.system_prefix = """
@@ -85,86 +86,348 @@ Ejemplos de preguntas que puedes responder:
 - ¿Cuántos clientes únicos tenemos?
 """
         
+        # Caché de respuestas (clave: pregunta normalizada + watermark de invoices)
+        self.answer_cache = AnswerCache()
+        self.watermark_interval = float(os.getenv("WATERMARK_CHECK_INTERVAL", "5"))
+        self._watermark_checked_at = 0.0
+        
+        # Preguntas equivalentes en curso comparten una sola ejecución del agente
+        self._singleflight = SingleFlight()
+        
+        # Plantillas SQL aprendidas de ejecuciones anteriores del agente
+        self.plan_cache = SQLPlanCache()
+        
+        # Corridas del agente: asíncronas y cancelables (AGENT_ASYNC), con pool de hilos de respaldo
+        self.runner = AgentRunner()
+        self.use_async = os.getenv("AGENT_ASYNC", "true").lower() in ("1", "true", "yes")
+    
+    def build_agent(self):
+        """
+        Construye el LLM de LangChain, el SQLDatabase del toolkit y el agente
+        
+        Es bloqueante (importa LangChain y se conecta a la base de datos): se ejecuta
+        en un hilo con start_build().
+        """
+        start_time = time.perf_counter()
+        from langchain.agents import create_sql_agent
+        from langchain.agents.agent_types import AgentType
+        from langchain_community.utilities import SQLDatabase
+        from langchain_openai import ChatOpenAI
+        from src.agent_toolkit import AsyncSQLDatabaseToolkit
+        import_seconds = time.perf_counter() - start_time
+        
+        # Configurar el LLM (usando Groq con OpenAI API compatible)
+        llm = ChatOpenAI(
+            model=os.getenv("MODEL_ID", "llama-3.1-70b-versatile"),
+            openai_api_key=os.getenv("GROQ_API_KEY"),
+            openai_api_base=os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1"),
+            temperature=0,  # Importante: temperatura 0 para consultas precisas
+        )
+        
+        # Este engine solo lo usa el toolkit del agente: se mantiene pequeño porque
+        # las consultas directas usan el pool asyncpg de NeonDatabase. Solo ve las
+        # tablas permitidas y no refleja el esquema: sql_db_schema usa la caché
+        db = SQLDatabase.from_uri(
+            self._db_url,
+            include_tables=self.schema.table_names or None,
+            sample_rows_in_table_info=self.schema.sample_rows,
+            lazy_table_reflection=True,
+            engine_args={
+                "pool_size": int(os.getenv("AGENT_DB_POOL_SIZE", "2")),
+                "max_overflow": 0,
+                "pool_pre_ping": True,
+            },
+        )
+        
+        # Crear el toolkit y el agente con ZERO_SHOT (más compatible con Groq)
+        # sql_db_query se ejecuta de forma asíncrona sobre el pool asyncpg
+        toolkit = AsyncSQLDatabaseToolkit(db=db, llm=llm, database=self.database, schema=self.schema)
+        
+        agent = create_sql_agent(
+            llm=llm,
+            toolkit=toolkit,
+            agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+            # Proceso de pensamiento del agente en stdout (sin pasar por el logging)
+            verbose=os.getenv("AGENT_VERBOSE", "false").lower() == "true",
+            max_iterations=3,  # Reducido para evitar loops
+            max_execution_time=20,  # Timeout de 20 segundos
+            handle_parsing_errors=True,
+            return_intermediate_steps=True,  # Para capturar el SQL final y aprender plantillas
+        )
+        
+        # El agente se publica al final: ready solo es True con todo construido
+        self.llm = llm
+        self.db = db
+        self.agent = agent
+        self.build_seconds = time.perf_counter() - start_time
+        logger.info(
+            "🤖 SQL Agent listo en %.2fs (imports de LangChain %.2fs)",
+            self.build_seconds, import_seconds
+        )
+    
+    def start_build(self) -> asyncio.Future:
+        """
+        Inicia la construcción del agente en un hilo (una sola vez)
+        """
+        if self._build_task is None:
+            self._build_task = asyncio.ensure_future(asyncio.to_thread(self.build_agent))
+            self._build_task.add_done_callback(self._build_done)
+        return self._build_task
+    
+    def _build_done(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("❌ No se pudo construir el SQL Agent: %s", task.exception())
+    
+    @property
+    def ready(self) -> bool:
+        """True cuando el agente de LangChain está construido"""
+        return self.agent is not None
+    
+    async def wait_ready(self):
+        """
+        Espera a que el agente esté construido (inicia la construcción si hace falta)
+        
+        Si la construcción falló, la siguiente llamada la reintenta.
+        """
+        if self.agent is not None:
+            return
+        task = self.start_build()
+        try:
+            await asyncio.shield(task)
+        except Exception:
+            if self._build_task is task:
+                self._build_task = None
+            raise
+    
+    @traced("sales_agent.ask")
     async def ask(self, question: str) -> str:
         """
         Procesa una pregunta en lenguaje natural y devuelve la respuesta
         
+        Las preguntas equivalentes (misma pregunta normalizada) que llegan mientras
+        otra está en curso esperan y reciben la misma respuesta.
+        
         Args:
             question: Pregunta del usuario en lenguaje natural
             
         Returns:
             Respuesta generada por el agente
         """
+        return await self._singleflight.do(
+            normalize_question(question),
+            lambda: self._ask(question)
+        )
+    
+    async def _ask(self, question: str) -> str:
+        """
+        Ejecuta la pregunta: caché, consulta directa o agente
+        """
         try:
-            logger.info(f"🤖 SQL Agent procesando pregunta: {question}")
+            logger.info("🤖 SQL Agent procesando pregunta: %s", content(question), extra=SAMPLED)
+            
+            # Revisar la caché antes de ejecutar consultas o el agente
+            await self._refresh_watermark()
+            cache_key = self._cache_key(question)
+            with span("sales_agent.cache"):
+                cached_answer = await self._cached_answer(cache_key)
+            if cached_answer is not None:
+                logger.info("⚡ Respuesta obtenida de la caché", extra=SAMPLED)
+                return cached_answer
+            
+            start_time = time.monotonic()
             
             # Intentar primero con consultas directas para preguntas comunes
             # (más rápido y confiable que el agente con Groq)
-            simple_answer = await self._try_simple_query(question)
+            with span("sales_agent.templates"):
+                simple_answer = await self._try_simple_query(question)
             if simple_answer:
-                logger.info(f"✅ Respondido con consulta directa")
+                logger.info("✅ Respondido con consulta directa", extra=SAMPLED)
+                await self._remember_answer(cache_key, simple_answer, time.monotonic() - start_time)
                 return simple_answer
             
+            # Desde aquí se necesita el LLM de LangChain: esperar la construcción del agente
+            await self.wait_ready()
+            
+            # Reutilizar el SQL aprendido de una pregunta con la misma forma
+            with span("sales_agent.learned_plan"):
+                learned_answer = await self._try_learned_plan(question)
+            if learned_answer:
+                await self._remember_answer(cache_key, learned_answer, time.monotonic() - start_time)
+                return learned_answer
+            
             # Si no es una pregunta simple, usar el agente
             # Construir el prompt completo
             full_prompt = f"{self.system_prefix}\n\nPregunta del usuario: {question}\n\nPor favor responde de manera clara y concisa."
             
-            # Ejecutar el agente (síncrono, ya que LangChain tiene problemas con async y Groq)
-            import asyncio
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: self.agent.invoke({"input": full_prompt})
-            )
+            # Ejecutar el agente: de forma nativa asíncrona (cancelable al vencer el
+            # timeout) o, si está desactivado, en el pool de hilos dedicado
+            # (cada iteración del agente queda registrada en la traza de la petición)
+            with span("sales_agent.agent", mode='async' if self.use_async else 'sync') as agent_span:
+                from src.agent_toolkit import AgentTraceHandler
+                config = {"callbacks": [AgentTraceHandler(agent_span)]}
+                if self.use_async:
+                    response = await self.runner.run_async(
+                        lambda: self.agent.ainvoke({"input": full_prompt}, config=config)
+                    )
+                else:
+                    response = await self.runner.run_sync(
+                        lambda: self.agent.invoke({"input": full_prompt}, config=config)
+                    )
             
             # Extraer la respuesta
-            answer = response.get("output", "No pude procesar la pregunta.")
+            answer = response.get("output")
+            if not answer:
+                return "No pude procesar la pregunta."
             
-            logger.info(f"✅ SQL Agent respondió: {answer[:200]}...")
+            # No cachear respuestas cortadas por límite de iteraciones/tiempo
+            if not answer.startswith("Agent stopped"):
+                await self._remember_answer(cache_key, answer, time.monotonic() - start_time)
+                self.plan_cache.learn(question, extract_final_sql(response.get("intermediate_steps")))
+            logger.info("✅ SQL Agent respondió: %s", content(answer), extra=SAMPLED)
             return answer
             
         except Exception as e:
-            logger.error(f"❌ Error en SQL Agent: {e}")
+            logger.error("❌ Error en SQL Agent: %s", e, exc_info=True)
             # Intentar responder con el LLM directamente sin herramientas
             return await self._fallback_response(question)
     
-    async def _try_simple_query(self, question: str) -> str:
+    @staticmethod
+    def _cache_key(question: str) -> str:
         """
-        Intenta responder preguntas simples con consultas directas
+        Clave de la caché de respuestas: la pregunta normalizada y, si tiene fechas
+        relativas ("ventas de hoy"), el día actual para no servirla al día siguiente
         """
-        q_lower = question.lower()
+        text = normalize_question(question)
+        today = date.today()
+        if parse_relative_dates(text, today):
+            return f"{today.isoformat()}:{text}"
+        return text
+    
+    async def _cached_answer(self, cache_key: str):
+        """
+        Busca la respuesta en la caché del proceso y, si no está, en el estado compartido
+        """
+        answer = self.answer_cache.get(cache_key)
+        if answer is not None or self.state is None:
+            return answer
         
         try:
-            # Cuántas facturas
-            if any(word in q_lower for word in ['cuántas facturas', 'total facturas', 'número de facturas']):
-                result = self.db.run("SELECT COUNT(*) as total FROM invoices")
-                return f"📊 Tenemos un total de **{result}** facturas registradas en el sistema."
-            
-            # Cuántos clientes
-            if any(word in q_lower for word in ['cuántos clientes', 'clientes únicos', 'total clientes']):
-                result = self.db.run("SELECT COUNT(DISTINCT username) as total FROM invoices WHERE username IS NOT NULL")
-                return f"👥 Hay **{result}** clientes únicos registrados."
-            
-            # Últimas ventas
-            if 'últimas' in q_lower or 'recientes' in q_lower:
-                import re
-                match = re.search(r'(\d+)', question)
-                limit = int(match.group(1)) if match else 5
-                result = self.db.run(f"SELECT invoice_number, username, created_at FROM invoices ORDER BY created_at DESC LIMIT {limit}")
-                return f"📋 Las últimas {limit} ventas:\n\n{result}"
-            
+            # La clave incluye el watermark: los cambios en invoices invalidan en todos los workers
+            answer = await self.state.get('answers', f"{self.answer_cache.watermark}:{cache_key}")
+        except Exception as e:
+            logger.warning("⚠️ No se pudo leer la caché compartida: %s", e)
+            return None
+        if answer is not None:
+            self.answer_cache.set(cache_key, answer)
+        return answer
+    
+    async def _remember_answer(self, cache_key: str, answer: str, cost: float):
+        """
+        Guarda la respuesta en la caché del proceso y en el estado compartido
+        """
+        self.answer_cache.set(cache_key, answer, cost)
+        if self.state is None:
+            return
+        try:
+            await self.state.set(
+                'answers', f"{self.answer_cache.watermark}:{cache_key}", answer,
+                ttl=self.answer_cache.ttl or None
+            )
+        except Exception as e:
+            logger.warning("⚠️ No se pudo guardar en la caché compartida: %s", e)
+    
+    async def _refresh_watermark(self):
+        """
+        Consulta la marca de datos de invoices (máximo id y fecha) como mucho
+        una vez cada WATERMARK_CHECK_INTERVAL segundos
+        """
+        now = time.monotonic()
+        if (now - self._watermark_checked_at) < self.watermark_interval:
+            return
+        
+        try:
+            watermark = await self.database.get_invoices_watermark()
+            self.answer_cache.check_watermark(watermark)
+            self._watermark_checked_at = now
+        except Exception as e:
+            # Sin watermark no se puede garantizar frescura: vaciar la caché
+            logger.warning("⚠️ No se pudo obtener el watermark de invoices: %s", e)
+            self.answer_cache.clear()
+    
+    def cache_stats(self) -> dict:
+        """
+        Estadísticas de la caché de respuestas (aciertos, fallos, tiempo ahorrado)
+        """
+        stats = self.answer_cache.stats()
+        stats['coalesced'] = self._singleflight.shared
+        stats['learned_plans'] = self.plan_cache.stats()
+        stats['schema'] = self.schema.stats()
+        return stats
+    
+    async def _try_simple_query(self, question: str) -> str:
+        """
+        Intenta responder preguntas frecuentes con el motor de plantillas (sin LLM)
+        """
+        try:
+            return await self.templates.answer(question)
         except Exception as e:
-            logger.debug(f"No se pudo responder con consulta simple: {e}")
+            logger.debug("No se pudo responder con consulta simple: %s", e)
         
         return None
     
+    def agent_stats(self) -> dict:
+        """
+        Cola, corridas en curso, timeouts y duración de las corridas del agente
+        """
+        return self.runner.stats()
+    
+    def coverage_stats(self) -> dict:
+        """
+        Cobertura del motor de plantillas (preguntas respondidas sin LLM)
+        """
+        return self.templates.coverage()
+    
+    async def _try_learned_plan(self, question: str) -> str:
+        """
+        Ejecuta una plantilla SQL aprendida y formatea el resultado con una sola llamada al LLM
+        """
+        plan = self.plan_cache.lookup(question)
+        if plan is None:
+            return None
+        
+        shape, sql, params = plan
+        try:
+            rows = await self.database.fetch_readonly(sql, *params)
+        except Exception as e:
+            # La plantilla ya no es válida (cambio de esquema, parámetros incompatibles)
+            logger.warning("⚠️ Plantilla SQL falló, se usará el agente: %s", e)
+            self.plan_cache.invalidate(shape)
+            return None
+        
+        self.plan_cache.record_hit(shape)
+        logger.info("🧠 Respondido con plantilla SQL aprendida (%s filas)", len(rows))
+        
+        from langchain.schema import HumanMessage, SystemMessage
+        
+        messages = [
+            SystemMessage(content=(
+                "Eres un asistente experto en análisis de ventas. Responde en español de manera "
+                "clara y concisa usando únicamente el resultado de la consulta SQL proporcionado.\n\n"
+                f"Consulta ejecutada:\n{sql}\n\nResultado ({len(rows)} filas):\n{rows}"
+            )),
+            HumanMessage(content=question)
+        ]
+        response = await self.llm.ainvoke(messages)
+        return response.content
+    
     async def _fallback_response(self, question: str) -> str:
         """
         Respuesta de fallback cuando el agente falla
         """
         try:
             # Obtener estadísticas básicas
-            stats = self.db.run("SELECT COUNT(*) as total, COUNT(DISTINCT username) as clientes FROM invoices")
+            summary = await self.database.get_all_sales_summary()
+            stats = f"total={summary['total_invoices']}, clientes={summary['total_users']}" if summary else "sin datos"
             
             # Usar el LLM para responder basado en estadísticas
             from langchain.schema import HumanMessage, SystemMessage
@@ -178,14 +441,14 @@ Ejemplos de preguntas que puedes responder:
             return response.content
             
         except Exception as e:
-            logger.error(f"Error en fallback: {e}")
+            logger.error("Error en fallback: %s", e, exc_info=True)
             return "Lo siento, no pude procesar tu pregunta. Por favor intenta reformularla de manera más simple."
     
-    def get_table_info(self) -> str:
+    async def get_table_info(self) -> str:
         """
-        Obtiene información sobre las tablas disponibles
+        Obtiene información sobre las tablas disponibles (desde la caché de esquema)
         """
-        return self.db.get_table_info()
+        return await self.schema.get()
 
 
 class HybridAssistant:
@@ -199,6 +462,7 @@ class HybridAssistant:
         self.sales_agent = sales_agent
         self.groq_service = groq_service
         
+    @traced("assistant.process_message")
     async def process_message(self, message: str, username: str = None) -> str:
         """
         Procesa un mensaje decidiendo si usar el SQL Agent o el chat conversacional
@@ -210,18 +474,7 @@ class HybridAssistant:
         Returns:
             Respuesta apropiada
         """
-        # Keywords que indican una consulta de datos
-        data_keywords = [
-            'cuántos', 'cuántas', 'total', 'cantidad', 'estadística', 'ventas',
-            'facturas', 'clientes', 'último', 'últimas', 'primero', 'promedio',
-            'lista', 'muestra', 'busca', 'encuentra', 'mayor', 'menor',
-            'suma', 'top', 'ranking', 'comparar', 'mostrar', 'dame'
-        ]
-        
-        message_lower = message.lower()
-        is_data_query = any(keyword in message_lower for keyword in data_keywords)
-        
-        logger.info(f"🔍 Mensaje clasificado como: {'CONSULTA DE DATOS' if is_data_query else 'CONVERSACIÓN'}")
+        is_data_query = self._is_data_query(message)
         
         if is_data_query:
             # Usar el SQL Agent para consultas de datos
@@ -233,3 +486,32 @@ class HybridAssistant:
                 conversation_history=None,
                 faq_context=None
             )
+    
+    async def stream_message(self, message: str, username: str = None):
+        """
+        Igual que process_message pero entrega la respuesta conversacional en fragmentos
+        
+        Las consultas de datos se entregan en un único fragmento con la respuesta completa.
+        
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        if self._is_data_query(message):
+            yield await self.sales_agent.ask(message)
+            return
+        
+        async for chunk in self.groq_service.stream_chat_response(
+            user_message=message,
+            conversation_history=None,
+            faq_context=None
+        ):
+            yield chunk
+    
+    def _is_data_query(self, message: str) -> bool:
+        """
+        Clasifica el mensaje como consulta de datos o conversación
+        """
+        intent = classifier.classify(message)
+        
+        logger.debug("🔍 Mensaje clasificado como: %s (%s)", 'CONSULTA DE DATOS' if intent.is_data else 'CONVERSACIÓN', intent.name)
+        return intent.is_data
@@ -0,0 +1,252 @@
+"""
+Trazas por update con id de correlación, registro de peticiones lentas y
+perfilado muestreado con cProfile activable en tiempo de ejecución
+"""
+import io
+import os
+import time
+import uuid
+import pstats
+import random
+import logging
+import cProfile
+import functools
+import contextvars
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Umbral (segundos) a partir del cual se registra el árbol de spans de una petición
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "5"))
+
+# Span activo en el contexto actual (se propaga a las tareas creadas desde él)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    Tramo medido de una petición; los spans hijos forman el árbol de la traza
+    """
+    
+    __slots__ = ('name', 'trace_id', 'attributes', 'start', 'end', 'children', 'error')
+    
+    def __init__(self, name: str, trace_id: str, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.attributes = attributes or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.error = None
+    
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+    
+    def child(self, name: str, **attributes) -> 'Span':
+        span = Span(name, self.trace_id, attributes)
+        self.children.append(span)
+        return span
+    
+    def finish(self, error: BaseException = None):
+        self.end = time.perf_counter()
+        if error is not None:
+            self.error = type(error).__name__
+    
+    def format_tree(self, origin: float = None, depth: int = 0) -> str:
+        """
+        Árbol de spans con inicio relativo y duración de cada tramo
+        """
+        origin = self.start if origin is None else origin
+        attributes = " ".join(f"{k}={v}" for k, v in self.attributes.items())
+        line = (
+            f"{'  ' * depth}{'└─ ' if depth else ''}{self.name} "
+            f"+{(self.start - origin) * 1000:.0f}ms {self.duration * 1000:.0f}ms"
+            f"{' ' + attributes if attributes else ''}"
+            f"{' ❌ ' + self.error if self.error else ''}"
+        )
+        lines = [line]
+        for child in sorted(self.children, key=lambda s: s.start):
+            lines.append(child.format_tree(origin, depth + 1))
+        return "\n".join(lines)
+
+
+class _SpanContext:
+    """Context manager de un span (no hace nada si no hay traza activa)"""
+    
+    __slots__ = ('span', '_token', '_root', '_profile')
+    
+    def __init__(self, span: Span, root: bool = False):
+        self.span = span
+        self._root = root
+        self._token = None
+        self._profile = None
+    
+    def __enter__(self):
+        if self.span is not None:
+            self._token = _current_span.set(self.span)
+            if self._root:
+                self._profile = profiler.maybe_start()
+        return self.span
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is None:
+            return False
+        self.span.finish(exc)
+        _current_span.reset(self._token)
+        if self._root:
+            report = profiler.stop(self._profile, self.span) if self._profile else None
+            tracer.finish(self.span, report)
+        return False
+
+
+class Tracer:
+    """
+    Registro de trazas terminadas: peticiones lentas y estadísticas
+    """
+    
+    def __init__(self, slow_threshold: float = TRACE_SLOW_THRESHOLD, keep: int = 20):
+        self.slow_threshold = slow_threshold
+        self.recent_slow = deque(maxlen=keep)
+        self.traces = 0
+        self.slow = 0
+    
+    def finish(self, root: Span, profile_report: str = None):
+        self.traces += 1
+        if root.duration < self.slow_threshold and not profile_report:
+            return
+        
+        tree = root.format_tree()
+        if root.duration >= self.slow_threshold:
+            self.slow += 1
+            self.recent_slow.append(tree)
+            logger.warning(
+                "🐢 Petición lenta [%s] %.2fs (umbral %ss)\n%s",
+                root.trace_id, root.duration, self.slow_threshold, tree
+            )
+        if profile_report:
+            logger.info("🔬 Perfil de la petición [%s]\n%s\n%s", root.trace_id, tree, profile_report)
+    
+    def stats(self) -> dict:
+        return {
+            'traces': self.traces,
+            'slow': self.slow,
+            'slow_threshold': self.slow_threshold,
+            'profile_rate': profiler.rate,
+            'profiled': profiler.profiled,
+        }
+
+
+class Profiler:
+    """
+    Perfilado con cProfile de una fracción de las peticiones
+    
+    cProfile mide el hilo del event loop completo mientras la petición está en curso,
+    por lo que el perfil incluye el trabajo de otras peticiones concurrentes. Solo
+    se perfila una petición a la vez.
+    """
+    
+    def __init__(self, rate: float = None, top: int = None):
+        self.rate = rate if rate is not None else float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.top = top or int(os.getenv("PROFILE_TOP", "25"))
+        self.output_dir = os.getenv("PROFILE_DIR")
+        self._active = None
+        self.profiled = 0
+    
+    def set_rate(self, rate: float):
+        """Cambia la fracción de peticiones perfiladas (0 desactiva)"""
+        self.rate = max(0.0, min(1.0, rate))
+        logger.info("🔬 Perfilado muestreado: %.0f%% de las peticiones", self.rate * 100)
+    
+    def maybe_start(self):
+        if not self.rate or self._active is not None or random.random() >= self.rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Otra herramienta de perfilado ya está activa
+            return None
+        self._active = profile
+        return profile
+    
+    def stop(self, profile, span: Span) -> str:
+        profile.disable()
+        self._active = None
+        self.profiled += 1
+        
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            profile.dump_stats(os.path.join(self.output_dir, f"{span.trace_id}.prof"))
+        
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(self.top)
+        return output.getvalue()
+
+
+tracer = Tracer()
+profiler = Profiler()
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def start_trace(name: str, trace_id: str = None, **attributes) -> _SpanContext:
+    """
+    Inicia la traza de una petición (span raíz con un nuevo id de correlación)
+    """
+    return _SpanContext(Span(name, trace_id or new_trace_id(), attributes), root=True)
+
+
+def span(name: str, **attributes) -> _SpanContext:
+    """
+    Span hijo del span activo; sin traza activa no registra nada
+    """
+    parent = _current_span.get()
+    return _SpanContext(parent.child(name, **attributes) if parent is not None else None)
+
+
+def current_span() -> Span:
+    return _current_span.get()
+
+
+def current_trace_id() -> str:
+    """Id de correlación de la petición en curso (o None)"""
+    active = _current_span.get()
+    return active.trace_id if active is not None else None
+
+
+def traced(name: str = None):
+    """
+    Decorador para funciones asíncronas: las ejecuta dentro de un span
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def copy_context() -> contextvars.Context:
+    """Contexto actual, para continuar la traza en otra tarea (p. ej. el planificador)"""
+    return contextvars.copy_context()
+
+
+def trace_update(name: str):
+    """
+    Decorador para handlers de Telegram (update, context): cada update abre una
+    traza nueva cuyo id sirve de correlación en logs y respuestas de error
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context):
+            chat = getattr(update, 'effective_chat', None)
+            with start_trace(name, update=update.update_id, chat=getattr(chat, 'id', None)):
+                return await func(update, context)
+        return wrapper
+    return decorator